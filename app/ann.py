@@ -0,0 +1,246 @@
+# app/ann.py
+from __future__ import annotations
+import os, math, time, logging, threading
+from typing import Any, Dict, List, Optional
+import numpy as np
+import faiss
+
+log = logging.getLogger(__name__)
+
+# "flat": exact scan; "ivf": IVF-Flat; "hnsw": HNSW graph; "ivfpq": IVF with product quantisation.
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+INDEX_TYPE = os.environ.get("INDEX_TYPE", "flat")
+
+IVF_NLIST = int(os.environ.get("IVF_NLIST", 0))  # 0 = ~4*sqrt(n), capped by training size
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", 16))
+HNSW_M = int(os.environ.get("HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", 80))
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", 64))
+PQ_M = int(os.environ.get("PQ_M", 0))  # sub-quantisers; 0 = dim // 8
+PQ_NBITS = int(os.environ.get("PQ_NBITS", 8))
+TRAIN_SAMPLE = int(os.environ.get("ANN_TRAIN_SAMPLE", 50_000))
+# Stored vectors in flat/ivf/hnsw: fp32 (exact), fp16 (half size) or sq8 (8-bit scalar
+# quantisation, quarter size). ivfpq already stores compressed codes.
+STORAGES = ("fp32", "fp16", "sq8")
+VECTOR_STORAGE = os.environ.get("VECTOR_STORAGE", "fp32")
+INDEX_MMAP = os.environ.get("INDEX_MMAP", "true").lower() == "true"
+_SQ_TYPES = {"fp16": faiss.ScalarQuantizer.QT_fp16, "sq8": faiss.ScalarQuantizer.QT_8bit}
+
+# faiss warns below ~39 training points per centroid
+_MIN_POINTS_PER_CENTROID = 39
+# IVF id lookups build the direct map on first use, which mutates the shared index
+_DIRECT_MAP_LOCK = threading.Lock()
+
+
+def index_config(kind: str = INDEX_TYPE, storage: str = VECTOR_STORAGE) -> Dict[str, Any]:
+    """Build-time parameters of `kind`, as recorded in the index manifest."""
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {kind!r}; expected one of {INDEX_TYPES}")
+    if storage not in STORAGES:
+        raise ValueError(f"Unknown vector storage {storage!r}; expected one of {STORAGES}")
+    cfg: Dict[str, Any] = {"type": kind}
+    if storage != "fp32" and kind != "ivfpq":
+        cfg["storage"] = storage  # absent for fp32, so older manifests still match
+    if kind in ("ivf", "ivfpq"):
+        cfg["nlist"] = IVF_NLIST
+    if kind == "hnsw":
+        cfg.update(M=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION)
+    if kind == "ivfpq":
+        cfg.update(pq_m=PQ_M, pq_nbits=PQ_NBITS)
+    return cfg
+
+
+def _auto_nlist(n: int, requested: int = 0) -> int:
+    nlist = requested or int(4 * math.sqrt(max(n, 1)))
+    return max(1, min(nlist, n // _MIN_POINTS_PER_CENTROID or 1))
+
+
+def _pq_m(dim: int, requested: int = 0) -> int:
+    m = requested or max(1, dim // 8)
+    while dim % m:  # sub-quantisers must split the vector evenly
+        m -= 1
+    return m
+
+
+def make_index(dim: int, n: int, cfg: Dict[str, Any]) -> faiss.Index:
+    """
+    Empty inner-product index for `n` vectors of `dim`. Flat and HNSW are wrapped in
+    IndexIDMap2; IVF variants store ids natively (IndexIDMap's remove_ids assumes the
+    sub-index renumbers on removal, which IVF does not).
+    """
+    kind = cfg["type"]
+    ip = faiss.METRIC_INNER_PRODUCT
+    sq = _SQ_TYPES.get(cfg.get("storage", "fp32"))  # None for fp32
+    if kind == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(dim) if sq is None else faiss.IndexScalarQuantizer(dim, sq, ip))
+    if kind == "hnsw":
+        m = int(cfg.get("M", HNSW_M))
+        base = faiss.IndexHNSWFlat(dim, m, ip) if sq is None else faiss.IndexHNSWSQ(dim, sq, m, ip)
+        base.hnsw.efConstruction = int(cfg.get("ef_construction", HNSW_EF_CONSTRUCTION))
+        return faiss.IndexIDMap2(base)
+    nlist = _auto_nlist(min(n, TRAIN_SAMPLE), int(cfg.get("nlist", 0)))
+    quantizer = faiss.IndexFlatIP(dim)
+    if kind == "ivf":
+        if sq is not None:
+            return faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, sq, ip)
+        return faiss.IndexIVFFlat(quantizer, dim, nlist, ip)
+    if kind == "ivfpq":
+        nbits = int(cfg.get("pq_nbits", PQ_NBITS))
+        # each sub-quantiser trains 2^nbits centroids on the same sample
+        nbits = max(1, min(nbits, int(math.log2(max(2, min(n, TRAIN_SAMPLE) // _MIN_POINTS_PER_CENTROID)))))
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_m(dim, int(cfg.get("pq_m", 0))), nbits, ip)
+    raise ValueError(f"Unknown index type {kind!r}; expected one of {INDEX_TYPES}")
+
+
+def build_index(X: np.ndarray, ids: np.ndarray, cfg: Dict[str, Any], seed: int = 0) -> faiss.Index:
+    """Create, train (on a random sample of at most TRAIN_SAMPLE vectors) and fill an index."""
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    index = make_index(X.shape[1], len(X), cfg)
+    if not index.is_trained:
+        sample = X
+        if len(X) > TRAIN_SAMPLE:
+            rng = np.random.default_rng(seed)
+            sample = X[rng.choice(len(X), TRAIN_SAMPLE, replace=False)]
+        index.train(sample)
+    index.add_with_ids(X, np.asarray(ids, dtype=np.int64))
+    return index
+
+
+def write_index(index: faiss.Index, path: str) -> None:
+    """Write to a temp file and rename, so processes that mapped the old file keep a valid copy."""
+    tmp = path + ".tmp"
+    faiss.write_index(index, tmp)
+    os.replace(tmp, path)
+
+
+def read_index(path: str, mmap: bool = INDEX_MMAP) -> faiss.Index:
+    """
+    Load an index for searching. With `mmap`, the stored vectors are used straight from
+    the file, so workers on one host share those pages through the page cache instead
+    of each holding a heap copy. IO_FLAG_MMAP_IFC (faiss >= 1.9) maps flat / SQ codes,
+    HNSW and IVF lists zero-copy; older faiss only maps IVF inverted lists and reads
+    other types into the heap. Memory-mapped indexes are read-only.
+    """
+    if mmap:
+        flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            return faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            log.info("Memory-mapped read of %s failed (%s); reading into memory", path, e)
+    return faiss.read_index(path)
+
+
+def supports_remove(index: faiss.Index) -> bool:
+    """Whether remove_ids keeps ids consistent (HNSW cannot delete)."""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    return not isinstance(base, faiss.IndexHNSW)
+
+
+def set_search_params(index: faiss.Index, nprobe: int = IVF_NPROBE, ef_search: int = HNSW_EF_SEARCH) -> None:
+    """Apply query-time knobs; no-op for index types they do not apply to."""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(base, faiss.IndexIVF):
+        base.nprobe = min(nprobe, base.nlist)
+    elif isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = ef_search
+
+
+def _base(index: faiss.Index) -> faiss.Index:
+    return faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+
+
+def filtered_params(
+    index: faiss.Index, ids: np.ndarray, nprobe: int = IVF_NPROBE, ef_search: int = HNSW_EF_SEARCH
+) -> faiss.SearchParameters:
+    """Search parameters restricting results to `ids`, carrying the type's query-time knobs."""
+    sel = faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype=np.int64))
+    base = _base(index)
+    if isinstance(base, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=sel, nprobe=min(nprobe, base.nlist))
+    elif isinstance(base, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=sel, efSearch=ef_search)
+    else:
+        params = faiss.SearchParameters(sel=sel)
+    params._sel = sel  # the params only hold a raw pointer; keep the selector alive
+    return params
+
+
+def reconstruct_ids(index: faiss.Index, ids: np.ndarray) -> np.ndarray:
+    """
+    Stored vectors (PQ: decoded approximations) for `ids`; enables an id lookup table on
+    IVF. Thread-safe: IVF lookups are serialised, since the table is filled in place.
+    """
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    base = _base(index)
+    if not isinstance(base, faiss.IndexIVF):
+        return index.reconstruct_batch(ids)
+    with _DIRECT_MAP_LOCK:
+        if base.direct_map.type == faiss.DirectMap.NoMap:
+            base.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return index.reconstruct_batch(ids)
+
+
+# ---------- Recall vs latency ----------
+def _latency_ms(index: faiss.Index, Q: np.ndarray, k: int) -> List[float]:
+    out = []
+    for i in range(len(Q)):
+        t0 = time.perf_counter()
+        index.search(Q[i : i + 1], k)
+        out.append((time.perf_counter() - t0) * 1000)
+    return out
+
+
+def recall_latency_report(
+    X: np.ndarray,
+    Q: np.ndarray,
+    k: int = 10,
+    kinds: Optional[List[str]] = None,
+    nprobes: tuple = (1, 4, 16, 64),
+    ef_searches: tuple = (16, 32, 64, 128),
+    storages: tuple = ("fp32",),
+) -> List[Dict[str, Any]]:
+    """
+    Build each index type (in each vector storage) over `X` and measure recall@k of
+    queries `Q` against the exact flat results, plus single-query latency and
+    serialized size per setting.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    Q = np.ascontiguousarray(Q, dtype=np.float32)
+    ids = np.arange(len(X), dtype=np.int64)
+    k = min(k, len(X))
+    rows: List[Dict[str, Any]] = []
+    truth = None
+    # flat first: its results are the ground truth
+    kinds = ["flat"] + [kd for kd in (kinds or INDEX_TYPES) if kd != "flat"]
+    storages = ("fp32",) + tuple(s for s in storages if s != "fp32")
+    builds = [(kd, s) for kd in kinds for s in (storages if kd != "ivfpq" else ("fp32",))]
+    for kind, storage in builds:
+        t0 = time.perf_counter()
+        index = build_index(X, ids, index_config(kind, storage))
+        build_s = time.perf_counter() - t0
+        size_mb = len(faiss.serialize_index(index)) / 1e6
+        if kind == "flat":
+            settings: List[Dict[str, int]] = [{}]
+        elif kind == "hnsw":
+            settings = [{"ef_search": ef} for ef in ef_searches]
+        else:
+            nlist = faiss.extract_index_ivf(index).nlist
+            settings = [{"nprobe": p} for p in nprobes if p <= nlist] or [{"nprobe": nlist}]
+        for knobs in settings:
+            set_search_params(index, **knobs)
+            _, I = index.search(Q, k)
+            if truth is None:  # flat runs first
+                truth = I
+            recall = float(np.mean([len(set(a) & set(b)) / k for a, b in zip(I, truth)]))
+            lat = _latency_ms(index, Q, k)
+            rows.append({
+                "type": kind,
+                "storage": "pq" if kind == "ivfpq" else storage,
+                **knobs,
+                "recall": round(recall, 4),
+                "p50_ms": round(float(np.percentile(lat, 50)), 3),
+                "p95_ms": round(float(np.percentile(lat, 95)), 3),
+                "build_s": round(build_s, 2),
+                "size_mb": round(size_mb, 2),
+            })
+    return rows
@@ -0,0 +1,120 @@
+# app/answer_cache.py
+from __future__ import annotations
+import os, re, time, threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Sequence, Tuple
+import numpy as np
+
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", 512))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 6 * 3600))  # seconds
+# Cosine similarity for near-duplicate question hits; 0 = exact (normalised) matches only
+ANSWER_CACHE_SIM = float(os.environ.get("ANSWER_CACHE_SIM", 0.0))
+
+
+def normalise_question(q: str) -> str:
+    return re.sub(r"\s+", " ", q).strip().lower().rstrip("?!. ")
+
+
+class AnswerCache:
+    """
+    Process-wide LLM answer cache shared by all sessions.
+
+    Entries are keyed by a context tuple (mode, model, temperature, patient id, profile
+    version, index version), the retrieved chunk ids, and the normalised question. With
+    a similarity threshold, a question embedding within that cosine of a cached one with
+    the same context and chunks also hits. Versions are tracked per patient: when a
+    patient's profile or the index version changes, only that patient's entries are
+    dropped. Otherwise entries expire after `ttl_s` and are evicted LRU-first.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = ANSWER_CACHE_SIZE,
+        ttl_s: float = ANSWER_CACHE_TTL,
+        sim_threshold: float = ANSWER_CACHE_SIM,
+    ):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.sim_threshold = sim_threshold
+        self._entries: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self._versions: Dict[str, Tuple[str, str]] = {}  # patient id -> (profile, index) version
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def context(
+        mode: str, model: str, temperature: float, patient_id: Optional[str], profile_version: str, index_version: str
+    ) -> Tuple:
+        return (mode, model, round(float(temperature), 3), patient_id or "", profile_version, index_version)
+
+    def _sync_versions(self, ctx: Tuple) -> None:
+        patient, versions = ctx[3], (ctx[4], ctx[5])
+        old = self._versions.get(patient)
+        if old is not None and versions != old:
+            # This patient's profile or the index changed: their answers may be stale
+            for k in [k for k in self._entries if k[0][3] == patient]:
+                del self._entries[k]
+        self._versions[patient] = versions
+
+    def get(
+        self, ctx: Tuple, chunk_ids: Sequence[Hashable], question: str, qvec: Optional[np.ndarray] = None
+    ) -> Optional[Dict[str, Any]]:
+        key = (ctx, tuple(chunk_ids), normalise_question(question))
+        now = time.time()
+        with self._lock:
+            self._sync_versions(ctx)
+            entry = self._entries.get(key)
+            if entry is None and qvec is not None and self.sim_threshold > 0:
+                entry, key = self._nearest(key, qvec)
+            if entry is not None and now - entry["created"] > self.ttl_s:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def _nearest(self, key: Tuple, qvec: np.ndarray):
+        best, best_key, best_sim = None, key, self.sim_threshold
+        q = np.asarray(qvec, dtype=np.float32).ravel()
+        for k, e in self._entries.items():
+            if k[:2] != key[:2] or e.get("qvec") is None:
+                continue
+            sim = float(np.dot(e["qvec"], q))  # both normalised
+            if sim >= best_sim:
+                best, best_key, best_sim = e, k, sim
+        return best, best_key
+
+    def put(
+        self,
+        ctx: Tuple,
+        chunk_ids: Sequence[Hashable],
+        question: str,
+        answer: str,
+        qvec: Optional[np.ndarray] = None,
+        **extra: Any,
+    ) -> None:
+        key = (ctx, tuple(chunk_ids), normalise_question(question))
+        entry = {
+            "answer": answer,
+            "created": time.time(),
+            "qvec": None if qvec is None else np.asarray(qvec, dtype=np.float32).ravel(),
+            **extra,
+        }
+        with self._lock:
+            self._sync_versions(ctx)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,269 @@
+# app/bench.py
+"""
+Retrieval quality and latency benchmark for app.rag.
+
+    python -m app.rag --bench                      # synthetic corpus, offline embedder
+    python -m app.rag --bench --bench-docs data/raw --bench-queries queries.jsonl
+
+Query files are JSON Lines (or a JSON list) of
+    {"query": "...", "expected_sources": ["leaflet.pdf"], "expected_chunks": [["leaflet.pdf", 3]]}
+where sources are matched by file name. Reports recall@k, MRR and nDCG@k, p50/p95/p99
+latency per stage (embed, search, rerank, assemble), build throughput and peak RSS.
+"""
+from __future__ import annotations
+import os, sys, json, math, time, zlib, random, resource, tempfile
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from app.lexical import tokenize
+from app.utils import glob_docs
+
+STAGES = ("embed", "search", "rerank", "assemble")
+
+
+class HashingEmbedder:
+    """
+    Deterministic, offline stand-in for SentenceTransformer: signed feature hashing of
+    word unigrams and bigrams. Lets the bench run without downloading a model.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def encode(self, texts, convert_to_numpy=True, normalize_embeddings=True, batch_size=32, **_):
+        X = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            toks = tokenize(text)
+            for feat in toks + [a + " " + b for a, b in zip(toks, toks[1:])]:
+                h = zlib.crc32(feat.encode("utf-8"))
+                X[row, h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        if normalize_embeddings:
+            X /= np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-9)
+        return X
+
+
+# ---------- Synthetic corpus ----------
+_SYLLABLES = ["zor", "vex", "tal", "mir", "pra", "dol", "ken", "sa", "lu", "fen", "tio", "rex", "qua", "bri"]
+_DEVICES = ["HandiHaler", "Respimat", "Ellipta", "Turbuhaler", "Breezhaler", "Diskus", "Genuair", "Spiromax"]
+_FORMS = ["capsules", "tablets", "inhalation powder", "oral solution", "nasal spray"]
+_STORAGE = ["below 25 °C", "in the fridge at 2–8 °C", "in the original blister", "away from direct sunlight"]
+_FILLER = (
+    "patient clinical study adverse events reported placebo treatment group observed trial "
+    "weeks baseline function respiratory symptoms physician information section label "
+    "warnings precautions overdose renal hepatic elderly paediatric pregnancy interaction"
+).split()
+
+
+def make_synthetic_corpus(out_dir: str, n_docs: int = 200, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Write `n_docs` leaflet-like .txt files into `out_dir` (one fictional drug each, facts
+    buried in filler paragraphs) and return queries with their expected source.
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    queries: List[Dict[str, Any]] = []
+    names = set()
+    while len(names) < n_docs:
+        names.add("".join(rng.choice(_SYLLABLES) for _ in range(3)).capitalize())
+    for i, name in enumerate(sorted(names)):
+        device, form = rng.choice(_DEVICES), rng.choice(_FORMS)
+        dose = f"{rng.choice([2.5, 5, 10, 18, 25, 50, 100, 250])} µg"
+        freq = rng.choice(["once daily", "twice daily", "every 6 hours"])
+        storage = rng.choice(_STORAGE)
+        facts = [
+            f"{name} {form} are used with the {device} device.",
+            f"The recommended dose of {name} is {dose} {freq}.",
+            f"Store {name} {storage}. Do not swallow {name} {form}.",
+        ]
+        paras = [" ".join(rng.choice(_FILLER) for _ in range(rng.randint(40, 90))) for _ in range(12)]
+        for f in facts:
+            paras.insert(rng.randrange(len(paras) + 1), f)
+        fname = f"leaflet_{i:04d}_{name.lower()}.txt"
+        with open(os.path.join(out_dir, fname), "w", encoding="utf-8") as fh:
+            fh.write(f"{name} patient information leaflet\n\n" + "\n\n".join(paras))
+        for q in (
+            f"What is the dose of {name}?",
+            f"Which inhaler device is used with {name}?",
+            f"How should {name} be stored?",
+        ):
+            queries.append({"query": q, "expected_sources": [fname]})
+    return queries
+
+
+def load_queries(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+# ---------- Metrics ----------
+def _relevance(results: List[Dict[str, Any]], q: Dict[str, Any]) -> Tuple[List[int], int]:
+    """Binary gain per result and the number of relevant items for the query."""
+    chunks = {(os.path.basename(s), int(c)) for s, c in q.get("expected_chunks", [])}
+    sources = {os.path.basename(s) for s in q.get("expected_sources", [])}
+    seen = set()
+    gains = []
+    for r in results:
+        name = os.path.basename(r["source"])
+        key = (name, r["chunk_id"]) if chunks else name
+        hit = (key in chunks) if chunks else (name in sources)
+        gains.append(int(hit and key not in seen))  # count each expected item once
+        if hit:
+            seen.add(key)
+    return gains, len(chunks) or len(sources)
+
+
+def score_run(gains: List[int], n_relevant: int, k: int) -> Dict[str, float]:
+    gains = gains[:k]
+    recall = sum(gains) / n_relevant if n_relevant else 0.0
+    mrr = next((1.0 / (i + 1) for i, g in enumerate(gains) if g), 0.0)
+    dcg = sum(g / math.log2(i + 2) for i, g in enumerate(gains))
+    idcg = sum(1.0 / math.log2(i + 2) for i in range(min(n_relevant, k)))
+    return {"recall": recall, "mrr": mrr, "ndcg": dcg / idcg if idcg else 0.0}
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024  # bytes on macOS, KiB on Linux
+
+
+def current_rss_mb() -> float:
+    """Resident set size now (Linux /proc); falls back to the peak elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def memory_mb() -> Dict[str, float]:
+    """
+    RSS plus, on Linux, PSS and anonymous (heap) memory. Anonymous memory is what each
+    extra worker really costs; file-backed pages (e.g. an mmapped index) are shared
+    through the page cache.
+    """
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            kb = {ln.split(":")[0]: int(ln.split()[1]) for ln in f if ln.rstrip().endswith("kB")}
+        return {
+            "rss": kb["Rss"] / 1024,
+            "pss": kb["Pss"] / 1024,
+            "anon": kb.get("Anonymous", 0) / 1024,
+        }
+    except (OSError, KeyError, ValueError):
+        rss = current_rss_mb()
+        return {"rss": rss, "pss": rss, "anon": rss}
+
+
+def _pcts(xs: List[float]) -> Dict[str, float]:
+    a = np.asarray(xs) * 1000
+    return {p: float(np.percentile(a, int(p[1:]))) for p in ("p50", "p95", "p99")}
+
+
+def evaluate(
+    idx,
+    queries: List[Dict[str, Any]],
+    k: int = 5,
+    mode: str = "hybrid",
+    rerank: bool = False,
+    pool: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Run every query through idx.retrieve and aggregate quality and per-stage latency.
+    Query-embedding and rerank caches are cleared first so runs do not depend on order.
+    """
+    idx.clear_query_cache()
+    idx.reranker.clear()
+    totals = {"recall": 0.0, "mrr": 0.0, "ndcg": 0.0}
+    lat: Dict[str, List[float]] = {s: [] for s in STAGES + ("total",)}
+    for q in queries:
+        timings: Dict[str, float] = {}
+        t0 = time.perf_counter()
+        results = idx.retrieve(q["query"], k=k, mode=mode, rerank=rerank, pool=pool, timings=timings)
+        lat["total"].append(time.perf_counter() - t0)
+        for s in STAGES:
+            lat[s].append(timings.get(s, 0.0))
+        gains, n_rel = _relevance(results, q)
+        for name, v in score_run(gains, n_rel, k).items():
+            totals[name] += v
+    n = max(1, len(queries))
+    return {
+        "mode": mode,
+        "rerank": rerank,
+        "k": k,
+        "queries": len(queries),
+        **{f"{m}@{k}": totals[m] / n for m in ("recall", "ndcg")},
+        "mrr": totals["mrr"] / n,
+        "latency_ms": {s: _pcts(v) for s, v in lat.items()},
+    }
+
+
+def run_bench(
+    docs_dir: str = "",
+    queries_path: str = "",
+    k: int = 5,
+    modes: Tuple[str, ...] = ("dense", "lexical", "hybrid"),
+    rerank: bool = False,
+    n_docs: int = 200,
+    embedder: str = "hash",
+    index_type: Optional[str] = None,
+    out_json: str = "",
+) -> Dict[str, Any]:
+    """Build a throwaway index in a temp dir and evaluate it. Nothing under data/index is touched."""
+    from app.rag import RAGIndex, DEFAULT_EMBEDDINGS_MODEL
+    from app.ann import INDEX_TYPE
+
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as work:
+        if docs_dir:
+            if not queries_path:
+                raise SystemExit("--bench-docs needs --bench-queries with expected sources/chunks")
+            paths = glob_docs(docs_dir)
+            queries = load_queries(queries_path)
+        else:
+            queries = make_synthetic_corpus(os.path.join(work, "raw"), n_docs=n_docs)
+            paths = glob_docs(os.path.join(work, "raw"))
+            if queries_path:
+                queries = load_queries(queries_path)
+
+        if embedder == "hash":
+            idx = RAGIndex(embed_model="hashing-384", index_dir=os.path.join(work, "index"), embedder=HashingEmbedder())
+        else:
+            idx = RAGIndex(embed_model=embedder or DEFAULT_EMBEDDINGS_MODEL, index_dir=os.path.join(work, "index"))
+        t0 = time.perf_counter()
+        idx.build(paths, index_type=index_type or INDEX_TYPE)
+        build_s = time.perf_counter() - t0
+        if rerank:
+            idx.reranker.warm_up()
+
+        report = {
+            "corpus": {"files": len(paths), "chunks": len(idx.metadata), "synthetic": not docs_dir},
+            "embedder": idx.embed_model,
+            "build": {"seconds": build_s, "chunks_per_s": len(idx.metadata) / build_s if build_s else 0.0},
+            "runs": [evaluate(idx, queries, k=k, mode=m, rerank=rerank) for m in modes],
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        _print_report(report)
+        if out_json:
+            with open(out_json, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        return report
+
+
+def _print_report(rep: Dict[str, Any]) -> None:
+    c, b = rep["corpus"], rep["build"]
+    print(
+        f"Corpus: {c['files']} files, {c['chunks']} chunks ({'synthetic' if c['synthetic'] else 'real'}), "
+        f"embedder {rep['embedder']}"
+    )
+    print(f"Build: {b['seconds']:.2f}s, {b['chunks_per_s']:.0f} chunks/s; peak RSS {rep['peak_rss_mb']:.0f} MB\n")
+    for r in rep["runs"]:
+        k = r["k"]
+        print(
+            f"[{r['mode']}{' +rerank' if r['rerank'] else ''}] {r['queries']} queries  "
+            f"recall@{k}={r[f'recall@{k}']:.3f}  MRR={r['mrr']:.3f}  nDCG@{k}={r[f'ndcg@{k}']:.3f}"
+        )
+        print(f"  {'stage':9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for stage, p in r["latency_ms"].items():
+            print(f"  {stage:9} {p['p50']:8.2f} {p['p95']:8.2f} {p['p99']:8.2f}")
+        print()
@@ -0,0 +1,133 @@
+# app/context.py
+from __future__ import annotations
+import os, re, hashlib
+from typing import Any, Dict, List, Tuple
+from app.utils import count_tokens, token_offsets
+
+CONTEXT_TOKENS = int(os.environ.get("CONTEXT_TOKENS", 2000))  # default budget for modes without one
+_MIN_TAIL_TOKENS = 64  # don't bother appending a truncated passage shorter than this
+_ELLIPSIS = " …"  # marks a truncated passage; counted against the budget
+
+
+def _score(r: Dict[str, Any]) -> float:
+    return float(r["rerank_score"]) if r.get("rerank_score") is not None else float(r.get("score", 0.0))
+
+
+def merge_overlaps(results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Collapse results from the same source whose character spans overlap or touch into
+    one passage covering their union, and drop passages whose text duplicates a better
+    one. Results without char offsets (old metadata) pass through unmerged.
+    Returns (passages, number of results absorbed).
+    """
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    singles: List[Dict[str, Any]] = []
+    for r in results:
+        if r.get("char_start") is None:
+            singles.append(_passage([r]))
+        else:
+            groups.setdefault(r["source"], []).append(r)
+
+    passages = singles
+    for members in groups.values():
+        members.sort(key=lambda r: r["char_start"])
+        run = [members[0]]
+        for r in members[1:]:
+            if r["char_start"] <= max(m["char_end"] for m in run):
+                run.append(r)
+            else:
+                passages.append(_passage(run))
+                run = [r]
+        passages.append(_passage(run))
+
+    # identical text from different files (e.g. the same leaflet uploaded twice)
+    passages.sort(key=lambda p: p["score"], reverse=True)
+    seen, unique = set(), []
+    for p in passages:
+        h = hashlib.sha1(re.sub(r"\s+", " ", p["text"]).strip().lower().encode("utf-8")).digest()
+        if h not in seen:
+            seen.add(h)
+            unique.append(p)
+    return unique, len(results) - len(unique)
+
+
+def _passage(run: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """One passage from spans sorted by start; text is the union of their texts."""
+    first = run[0]
+    text, end = first["text"], first.get("char_end")
+    for r in run[1:]:
+        if r["char_end"] > end:
+            text += r["text"][end - r["char_start"]:]
+            end = r["char_end"]
+    pages = [p for r in run for p in (r.get("page"), r.get("page_end")) if p is not None]
+    best = max(run, key=_score)
+    return {
+        "ids": [r["id"] for r in run],
+        "source": first["source"],
+        "chunk_ids": sorted(r["chunk_id"] for r in run),
+        "page": min(pages) if pages else None,
+        "page_end": max(pages) if pages else None,
+        "char_start": first.get("char_start"),
+        "char_end": end,
+        "score": _score(best),
+        "text": text,
+    }
+
+
+def _truncate(text: str, n_tokens: int) -> str:
+    """`text` cut to at most `n_tokens` tokens, the " …" marker included."""
+    offs = token_offsets(text)
+    if len(offs) <= n_tokens:
+        return text
+    # Re-encoding the cut can differ from the offsets by a token or so: step back until it fits
+    for keep in range(n_tokens - count_tokens(_ELLIPSIS), 0, -1):
+        out = text[: offs[keep]].rstrip() + _ELLIPSIS
+        if count_tokens(out) <= n_tokens:
+            return out
+    for keep in range(n_tokens, 0, -1):  # no room for the marker
+        out = text[: offs[keep]].rstrip()
+        if count_tokens(out) <= n_tokens:
+            return out
+    return ""
+
+
+def assemble_context(
+    results: List[Dict[str, Any]], budget_tokens: int = CONTEXT_TOKENS
+) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Fit retrieved chunks into `budget_tokens`: merge overlapping spans, then greedily
+    keep the highest-scoring passages that still fit (truncating the last one if enough
+    room remains). Passages get fresh cite ids [1..n] in score order. The report counts
+    tokens of the raw chunks versus what is sent.
+    """
+    raw_tokens = sum(count_tokens(r["text"]) for r in results)
+    passages, merged = merge_overlaps(results)
+
+    kept: List[Dict[str, Any]] = []
+    used = 0
+    dropped = 0
+    for p in passages:
+        n = count_tokens(p["text"])
+        left = budget_tokens - used
+        if n <= left:
+            kept.append(p)
+            used += n
+        elif left >= _MIN_TAIL_TOKENS or not kept:
+            p = dict(p, text=_truncate(p["text"], max(1, left)), truncated=True)
+            kept.append(p)
+            used += count_tokens(p["text"])
+        else:
+            dropped += 1
+
+    for i, p in enumerate(kept, start=1):
+        p["cite_id"] = f"[{i}]"
+    report = {
+        "chunks": len(results),
+        "passages": len(kept),
+        "merged": merged,
+        "dropped": dropped,
+        "tokens_raw": raw_tokens,
+        "tokens_sent": used,
+        "tokens_saved": max(0, raw_tokens - used),
+    }
+    return kept, report
@@ -1,8 +1,13 @@
 import json
 import os
-from typing import Any, Dict
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Tuple
 
 DATA_PATH = os.environ.get("PATIENT_JSON_PATH", os.path.join("data", "patient.json"))
+# "json": the single profile at DATA_PATH; "sqlite": many profiles in app.profile_store
+PROFILE_BACKEND = os.environ.get("PROFILE_BACKEND", "json")
+PATIENT_ID = os.environ.get("PATIENT_ID", "")  # default patient for the sqlite backend
 
 DEFAULT_PROFILE: Dict[str, Any] = {
     "patient_id": "demo-patient-uuid",
@@ -59,13 +64,228 @@ def ensure_file_exists(path: str = DATA_PATH) -> None:
             json.dump(DEFAULT_PROFILE, f, indent=2, ensure_ascii=False)
 
 
-def load_profile(path: str = DATA_PATH) -> Dict[str, Any]:
+_store = None
+_store_lock = threading.Lock()
+
+
+def profile_store():
+    """Shared ProfileStore for the sqlite backend; seeded from DATA_PATH (or the demo) if empty."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            from app.profile_store import ProfileStore
+
+            store = ProfileStore()
+            if len(store) == 0:
+                if os.path.exists(DATA_PATH):
+                    with open(DATA_PATH, "r", encoding="utf-8") as f:
+                        store.put(json.load(f))
+                else:
+                    store.put(DEFAULT_PROFILE)
+            _store = store
+    return _store
+
+
+def _patient_id(patient_id: Optional[str]) -> str:
+    pid = patient_id or PATIENT_ID or profile_store().first_id()
+    if not pid:
+        raise KeyError("No patient profiles in the store")
+    return pid
+
+
+def patient_exists(patient_id: str, path: str = DATA_PATH) -> bool:
+    """Whether `patient_id` names a stored profile (the json backend holds exactly one)."""
+    if PROFILE_BACKEND == "sqlite":
+        return profile_store().version(patient_id) is not None
+    return str(get_profile(path).get("patient_id", "")) == patient_id
+
+
+def load_profile(path: str = DATA_PATH, patient_id: Optional[str] = None) -> Dict[str, Any]:
+    if PROFILE_BACKEND == "sqlite":
+        pid = _patient_id(patient_id)
+        prof = profile_store().get(pid)
+        if prof is None:
+            raise KeyError(f"No profile for patient {pid}")
+        return prof
     ensure_file_exists(path)
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
 
 def save_profile(profile: Dict[str, Any], path: str = DATA_PATH) -> None:
+    if PROFILE_BACKEND == "sqlite":
+        profile_store().put(profile)
+        return
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(profile, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)  # readers never see a half-written file
+
+
+def find_patients(query: str = "", limit: int = 20) -> List[Dict[str, str]]:
+    """Name-prefix lookup (sqlite backend); the json backend has just its one patient."""
+    if PROFILE_BACKEND == "sqlite":
+        return profile_store().find_by_name(query, limit)
+    p = get_profile()
+    return [{"patient_id": p.get("patient_id", ""), "full_name": p["profile"].get("full_name", ""),
+             "dob": p["profile"].get("dob", "")}]
+
+
+# ---------- Process-wide cache ----------
+# key -> (freshness stamp, content version, parsed profile, prompt text)
+_cache: Dict[Any, Tuple[Any, str, Dict[str, Any], str]] = {}
+_cache_lock = threading.Lock()
+
+
+def _stamp(path: str) -> Tuple[int, int, int]:
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _cached_file(path: str):
+    """Entry for `path`, re-read only when its stat stamp changes (one stat per call)."""
+    try:
+        stamp = _stamp(path)
+    except FileNotFoundError:
+        ensure_file_exists(path)
+        stamp = _stamp(path)
+    entry = _cache.get(path)
+    if entry is not None and entry[0] == stamp:
+        return entry
+    with _cache_lock:
+        entry = _cache.get(path)
+        if entry is not None and entry[0] == stamp:
+            return entry
+        with open(path, "rb") as f:
+            raw = f.read()
+        digest = hashlib.sha1(raw).hexdigest()[:16]
+        if entry is not None and entry[1] == digest:  # touched, not changed
+            entry = (stamp,) + entry[1:]
+        else:
+            profile = json.loads(raw.decode("utf-8"))
+            entry = (stamp, digest, profile, format_profile(profile))
+        _cache[path] = entry
+        return entry
+
+
+def _cached_db(patient_id: Optional[str]):
+    """Entry for one stored patient, re-read only when its version changes (one indexed lookup)."""
+    store = profile_store()
+    pid = _patient_id(patient_id)
+    version = store.version(pid)
+    if version is None:
+        raise KeyError(f"No profile for patient {pid}")
+    key = ("db", pid)
+    entry = _cache.get(key)
+    if entry is None or entry[1] != version:
+        profile = store.get(pid) or {}
+        entry = (version, version, profile, format_profile(profile))
+        with _cache_lock:
+            _cache[key] = entry
+    return entry
+
+
+def _cached(path: str, patient_id: Optional[str] = None):
+    return _cached_db(patient_id) if PROFILE_BACKEND == "sqlite" else _cached_file(path)
+
+
+def get_profile(path: str = DATA_PATH, patient_id: Optional[str] = None) -> Dict[str, Any]:
+    """Parsed profile shared by all sessions; treat as read-only (use load_profile to edit)."""
+    return _cached(path, patient_id)[2]
+
+
+def get_emergency_profile(path: str = DATA_PATH, patient_id: Optional[str] = None) -> Dict[str, Any]:
+    """Only the emergency fields; the sqlite backend reads them without the full record."""
+    if PROFILE_BACKEND == "sqlite":
+        prof = profile_store().get_emergency(_patient_id(patient_id))
+        if prof is None:
+            raise KeyError(f"No profile for patient {patient_id}")
+        return prof
+    from app.profile_store import emergency_fields
+
+    return emergency_fields(get_profile(path))
+
+
+def profile_version(path: str = DATA_PATH, patient_id: Optional[str] = None) -> str:
+    """Content hash of the saved profile; changes whenever its contents do."""
+    return _cached(path, patient_id)[1]
+
+
+def profile_prompt(path: str = DATA_PATH, patient_id: Optional[str] = None) -> str:
+    """Compact plain-text profile for LLM prompts (see format_profile)."""
+    return _cached(path, patient_id)[3]
+
+
+def _join(*parts: Optional[str], sep: str = "; ") -> str:
+    return sep.join(p for p in parts if p)
+
+
+def format_profile(prof: Dict[str, Any]) -> str:
+    """
+    Dense, line-per-fact rendering of the fields that matter in an emergency:
+    demographics, allergies, conditions, medications (dose, device, storage, steps,
+    warnings), contacts and medical aid. Empty fields are omitted.
+    """
+    p = prof.get("profile", {})
+    lines: List[str] = [
+        "Patient: " + _join(p.get("full_name"), p.get("dob") and f"DOB {p['dob']}",
+                            p.get("blood_type") and f"blood {p['blood_type']}")
+    ]
+    allergies = [
+        a.get("substance", "") + (f" ({_join(a.get('reaction'), a.get('severity'))})" if _join(a.get("reaction"), a.get("severity")) else "")
+        for a in prof.get("allergies", [])
+    ]
+    lines.append("Allergies: " + (", ".join(allergies) or "none recorded"))
+    conditions = [
+        c.get("name", "") + (f" ({_join(c.get('severity'), c.get('notes'))})" if _join(c.get("severity"), c.get("notes")) else "")
+        for c in prof.get("conditions", [])
+    ]
+    if conditions:
+        lines.append("Conditions: " + ", ".join(conditions))
+    meds = prof.get("medications", [])
+    if meds:
+        lines.append("Medications:")
+    for m in meds:
+        d = m.get("device") or {}
+        device = _join(d.get("model"), d.get("type") and f"({d['type']})", sep=" ")
+        lines.append("- " + _join(
+            m.get("name"),
+            m.get("dosage") and f"dose {m['dosage']}",
+            device and f"device {device}",
+            m.get("storage_location") and f"kept: {m['storage_location']}",
+        ))
+        steps = m.get("how_to_use_steps") or []
+        if steps:
+            lines.append("  Use: " + " ".join(f"{i}) {s}" for i, s in enumerate(steps, 1)))
+        if m.get("warnings"):
+            lines.append("  Warnings: " + " ".join(m["warnings"]))
+    contacts = [_join(c.get("name"), c.get("relation") and f"({c['relation']})", c.get("phone"), sep=" ")
+                for c in prof.get("emergency_contacts", [])]
+    if contacts:
+        lines.append("Emergency contacts: " + ", ".join(contacts))
+    aid = p.get("medical_aid") or {}
+    aid_s = _join(aid.get("provider"), aid.get("plan"), aid.get("emergency_hotline") and f"hotline {aid['emergency_hotline']}")
+    if aid_s:
+        lines.append("Medical aid: " + aid_s)
+    prefs = prof.get("preferences") or {}
+    prefs_s = _join(prefs.get("preferred_hospital") and f"hospital {prefs['preferred_hospital']}",
+                    prefs.get("gp") and f"GP {prefs['gp']}")
+    if prefs_s:
+        lines.append("Preferences: " + prefs_s)
+    reviewed = (prof.get("meta") or {}).get("last_reviewed")
+    if reviewed:
+        lines.append(f"Last reviewed: {reviewed}")
+    return "\n".join(lines)
+
+
+def namespace_sources(profile: Dict[str, Any], medication: Optional[str] = None) -> List[str]:
+    """
+    Leaflet file names a patient's questions should search: those listed under every
+    medication in `profile`, or only under the medication named `medication`.
+    """
+    names = []
+    for med in profile.get("medications", []):
+        if medication is None or med.get("name") == medication:
+            names.extend(os.path.basename(p) for p in med.get("leaflets", []) if p)
+    return sorted(set(names))
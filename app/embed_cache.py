@@ -0,0 +1,150 @@
+# app/embed_cache.py
+from __future__ import annotations
+import os, re, json, hashlib
+from collections import OrderedDict
+from typing import Callable, List, Optional
+import numpy as np
+from app.utils import normalise_ws
+
+EMBED_CACHE_MAX_ROWS = int(os.environ.get("EMBED_CACHE_MAX_ROWS", 200_000))
+
+_INITIAL_ROWS = 1024
+
+
+class EmbeddingCache:
+    """
+    On-disk embedding cache keyed by (model name, hash of whitespace-normalised text).
+
+    Vectors live in a memory-mapped float32 matrix (`vectors.f32`); `index.json` maps
+    text hashes to rows in least-recently-used order. Once `max_rows` is reached the
+    least recently used rows are recycled. Single writer: call `save()` after encoding.
+    """
+
+    def __init__(self, model_name: str, root: str, max_rows: int = EMBED_CACHE_MAX_ROWS):
+        self.model_name = model_name
+        self.max_rows = max(1, max_rows)
+        self.dir = os.path.join(root, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+        self.vec_path = os.path.join(self.dir, "vectors.f32")
+        self.index_path = os.path.join(self.dir, "index.json")
+        self.dim: Optional[int] = None
+        self._rows: "OrderedDict[str, int]" = OrderedDict()  # key -> row, LRU first
+        self._free: List[int] = []
+        self._capacity = 0
+        self._mm: Optional[np.memmap] = None
+        self.hits = 0
+        self.misses = 0
+        self._open()
+
+    # ---------- Keys ----------
+    def key(self, text: str) -> str:
+        h = hashlib.sha1(self.model_name.encode("utf-8"))
+        h.update(b"\0")
+        h.update(normalise_ws(text).encode("utf-8"))
+        return h.hexdigest()
+
+    # ---------- Encode ----------
+    def encode(self, texts: List[str], encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Return embeddings for `texts`, calling `encode_fn` only on texts not cached yet."""
+        keys = [self.key(t) for t in texts]
+        out: Optional[np.ndarray] = None
+        if self.dim is not None:
+            out = np.empty((len(texts), self.dim), dtype=np.float32)
+
+        missing: "OrderedDict[str, str]" = OrderedDict()
+        miss_pos: List[int] = []
+        for i, (k, t) in enumerate(zip(keys, texts)):
+            row = self._rows.get(k)
+            if row is not None and out is not None:
+                out[i] = self._mm[row]
+                self._rows.move_to_end(k)
+                self.hits += 1
+            else:
+                missing.setdefault(k, t)
+                miss_pos.append(i)
+        if not missing:
+            return out
+
+        V = np.asarray(encode_fn(list(missing.values())), dtype=np.float32)
+        self.misses += len(missing)
+        if self.dim is None or out is None:
+            self._reset(V.shape[1])
+            out = np.empty((len(texts), self.dim), dtype=np.float32)
+        elif V.shape[1] != self.dim:
+            raise ValueError(f"Embedding dim changed ({self.dim} → {V.shape[1]}) for {self.model_name}")
+
+        by_key = dict(zip(missing.keys(), V))
+        for i in miss_pos:
+            out[i] = by_key[keys[i]]
+        for k, v in by_key.items():
+            self._put(k, v)
+        return out
+
+    # ---------- Storage ----------
+    def _open(self) -> None:
+        if not (os.path.exists(self.index_path) and os.path.exists(self.vec_path)):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("model") != self.model_name:
+                return
+            dim, capacity = int(data["dim"]), int(data["capacity"])
+            if os.path.getsize(self.vec_path) < capacity * dim * 4:
+                return
+            self._mm = np.memmap(self.vec_path, dtype=np.float32, mode="r+", shape=(capacity, dim))
+        except Exception:
+            return  # unreadable cache: start over on first write
+        self.dim, self._capacity = dim, capacity
+        rows = [(k, int(r)) for k, r in data["rows"]]
+        # Shrunk limit: keep only the most recently used rows
+        rows = rows[-self.max_rows:]
+        self._rows = OrderedDict(rows)
+        used = set(self._rows.values())
+        free = [r for r in range(capacity) if r not in used]
+        self._free = free[: max(0, self.max_rows - len(self._rows))]
+
+    def _reset(self, dim: int) -> None:
+        os.makedirs(self.dir, exist_ok=True)
+        self.dim = dim
+        self._rows.clear()
+        self._capacity = min(_INITIAL_ROWS, self.max_rows)
+        self._free = list(range(self._capacity))
+        self._mm = np.memmap(self.vec_path, dtype=np.float32, mode="w+", shape=(self._capacity, dim))
+
+    def _grow(self) -> None:
+        new_cap = min(self._capacity * 2, self.max_rows)
+        self._mm.flush()
+        self._mm = None
+        with open(self.vec_path, "r+b") as f:
+            f.truncate(new_cap * self.dim * 4)
+        self._mm = np.memmap(self.vec_path, dtype=np.float32, mode="r+", shape=(new_cap, self.dim))
+        self._free.extend(range(self._capacity, new_cap))
+        self._capacity = new_cap
+
+    def _put(self, key: str, vec: np.ndarray) -> None:
+        if not self._free and self._capacity < self.max_rows:
+            self._grow()
+        if self._free:
+            row = self._free.pop()
+        else:
+            _, row = self._rows.popitem(last=False)  # evict least recently used
+        self._mm[row] = vec
+        self._rows[key] = row
+
+    def save(self) -> None:
+        if self._mm is None:
+            return
+        self._mm.flush()
+        data = {
+            "model": self.model_name,
+            "dim": self.dim,
+            "capacity": self._capacity,
+            "rows": list(self._rows.items()),
+        }
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.index_path)
+
+    def __len__(self) -> int:
+        return len(self._rows)
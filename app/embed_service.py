@@ -0,0 +1,154 @@
+# app/embed_service.py
+"""
+Process-wide micro-batching for query embeddings.
+
+Every session used to call `embedder.encode([query])` on the shared model, so N users
+meant N batch-of-one forward passes contending for the same CPU. Callers now submit
+texts to one worker thread per model, which collects whatever arrives within
+EMBED_BATCH_WINDOW_MS (up to EMBED_MAX_BATCH texts) and encodes it as a single batch.
+The worker is the only thread that calls the model, so access is serialized by
+construction. The queue is bounded; when it stays full for EMBED_QUEUE_TIMEOUT_S,
+submit() raises EmbedBusy.
+
+    python -m app.embed_service --users 24 --queries 20     # direct vs batched throughput
+"""
+from __future__ import annotations
+import os, time, queue, argparse, threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+EMBED_BATCH_WINDOW_MS = float(os.environ.get("EMBED_BATCH_WINDOW_MS", 3))
+EMBED_MAX_BATCH = int(os.environ.get("EMBED_MAX_BATCH", 64))
+EMBED_QUEUE_SIZE = int(os.environ.get("EMBED_QUEUE_SIZE", 1024))
+EMBED_QUEUE_TIMEOUT_S = float(os.environ.get("EMBED_QUEUE_TIMEOUT_S", 10))
+
+
+class EmbedBusy(RuntimeError):
+    """Raised when the embedding queue stays full for EMBED_QUEUE_TIMEOUT_S."""
+
+
+class EmbedService:
+    """Coalesces concurrent encode requests for one model into micro-batches."""
+
+    def __init__(
+        self,
+        model: Any,
+        window_ms: float = EMBED_BATCH_WINDOW_MS,
+        max_batch: int = EMBED_MAX_BATCH,
+        queue_size: int = EMBED_QUEUE_SIZE,
+    ):
+        self.model = model  # anything with SentenceTransformer's encode()
+        self.window_s = max(window_ms, 0.0) / 1000
+        self.max_batch = max(1, max_batch)
+        self._q: "queue.Queue[tuple]" = queue.Queue(maxsize=queue_size)
+        self._stats = {"batches": 0, "texts": 0, "max_batch": 0, "encode_s": 0.0}
+        self._stats_lock = threading.Lock()
+        threading.Thread(target=self._run, name="embed-batcher", daemon=True).start()
+
+    def submit(self, text: str) -> Future:
+        f: Future = Future()
+        try:
+            self._q.put((text, f), timeout=EMBED_QUEUE_TIMEOUT_S)
+        except queue.Full:
+            raise EmbedBusy(f"Embedding queue full ({self._q.maxsize}) for {EMBED_QUEUE_TIMEOUT_S:.0f}s") from None
+        return f
+
+    def encode(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        """(len(texts), dim) normalised float32 embeddings, batched with other callers' texts."""
+        futures = [self.submit(t) for t in texts]
+        return np.stack([f.result(timeout) for f in futures]) if futures else np.zeros((0, 0), np.float32)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._q.get()]
+            deadline = time.perf_counter() + self.window_s
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait())
+                except queue.Empty:
+                    break
+            live = [(t, f) for t, f in batch if f.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            t0 = time.perf_counter()
+            try:
+                X = self.model.encode(
+                    [t for t, _ in live], convert_to_numpy=True, normalize_embeddings=True, batch_size=len(live)
+                )
+                X = np.asarray(X, dtype=np.float32)
+            except BaseException as e:
+                for _, f in live:
+                    f.set_exception(e)
+                continue
+            for (_, f), v in zip(live, X):
+                f.set_result(v)
+            with self._stats_lock:
+                s = self._stats
+                s["batches"] += 1
+                s["texts"] += len(live)
+                s["max_batch"] = max(s["max_batch"], len(live))
+                s["encode_s"] += time.perf_counter() - t0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            s = dict(self._stats)
+        s["mean_batch"] = s["texts"] / s["batches"] if s["batches"] else 0.0
+        s["queued"] = self._q.qsize()
+        return s
+
+
+_services: Dict[int, EmbedService] = {}
+_services_lock = threading.Lock()
+
+
+def get_service(model: Any) -> EmbedService:
+    """The process-wide EmbedService for `model` (one worker per model instance)."""
+    with _services_lock:
+        svc = _services.get(id(model))
+        if svc is None or svc.model is not model:
+            svc = _services[id(model)] = EmbedService(model)
+        return svc
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    ap = argparse.ArgumentParser(description="Query-embedding throughput: one encode per query vs micro-batched.")
+    ap.add_argument("--users", type=int, default=24, help="concurrent callers")
+    ap.add_argument("--queries", type=int, default=20, help="queries per caller")
+    ap.add_argument("--offline", action="store_true", help="use the bench's hashing embedder (no model download)")
+    args = ap.parse_args()
+
+    if args.offline:
+        from app.bench import HashingEmbedder
+
+        model: Any = HashingEmbedder()
+    else:
+        from app.inference import load_embedder
+        from app.rag import DEFAULT_EMBEDDINGS_MODEL
+
+        model = load_embedder(DEFAULT_EMBEDDINGS_MODEL)
+    texts = [f"how do I use inhaler number {i} safely" for i in range(args.users * args.queries)]
+    model.encode(texts[:8], convert_to_numpy=True, normalize_embeddings=True)  # warm up
+    lock = threading.Lock()
+
+    def direct(i: int) -> None:
+        for t in texts[i :: args.users]:
+            with lock:
+                model.encode([t], convert_to_numpy=True, normalize_embeddings=True)
+
+    svc = get_service(model)
+
+    def batched(i: int) -> None:
+        for t in texts[i :: args.users]:
+            svc.encode([t])
+
+    for name, fn in (("one at a time", direct), ("micro-batched", batched)):
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(args.users) as ex:
+            list(ex.map(fn, range(args.users)))
+        dt = time.perf_counter() - t0
+        print(f"{name:15} {len(texts) / dt:9.1f} queries/s  ({dt:.2f}s for {len(texts)})")
+    print("batcher:", svc.stats())
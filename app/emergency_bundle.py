@@ -0,0 +1,146 @@
+# app/emergency_bundle.py
+from __future__ import annotations
+import io, os, time, threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from app.data_store import get_emergency_profile, profile_version
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", REPO_ROOT)  # photo paths like /media/x.jpg resolve under here
+EMERGENCY_URL = os.environ.get("EMERGENCY_URL", "http://localhost:8501/app/pages/emergency")
+THUMB_PX = int(os.environ.get("EMERGENCY_THUMB_PX", 360))
+THUMB_QUALITY = int(os.environ.get("EMERGENCY_THUMB_QUALITY", 70))
+BUNDLE_CACHE_SIZE = int(os.environ.get("EMERGENCY_BUNDLE_CACHE", 256))
+
+
+@dataclass
+class EmergencyBundle:
+    """Everything Emergency Mode shows for one profile version, ready to render."""
+
+    patient_id: str
+    version: str
+    name: str
+    subtitle: str
+    allergies: List[str]
+    conditions: List[str]
+    med: Dict[str, Any]  # first medication: title, device, dosage, kept, steps, warnings, leaflets
+    photos: List[Any]  # JPEG thumbnail bytes, or URLs passed through
+    missing_photos: List[str]
+    contacts: List[str]
+    aid: List[str]
+    qr_png: Optional[bytes]
+    qr_url: str
+    build_ms: float = 0.0
+
+
+def _resolve(path: str) -> Optional[str]:
+    for cand in (path, os.path.join(MEDIA_ROOT, path.lstrip("/"))):
+        if os.path.isfile(cand):
+            return cand
+    return None
+
+
+def _thumbnail(path: str) -> Optional[bytes]:
+    from PIL import Image
+
+    with Image.open(path) as im:
+        im = im.convert("RGB")
+        im.thumbnail((THUMB_PX, THUMB_PX))
+        buf = io.BytesIO()
+        im.save(buf, format="JPEG", quality=THUMB_QUALITY, optimize=True)
+        return buf.getvalue()
+
+
+def _qr(url: str) -> Optional[bytes]:
+    try:
+        import qrcode
+    except ImportError:
+        return None
+    qr = qrcode.QRCode(version=2, box_size=8, border=2)  # same look as app/utils/qr_utils.py
+    qr.add_data(url)
+    qr.make(fit=True)
+    buf = io.BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def build_bundle(prof: Dict[str, Any], version: str) -> EmergencyBundle:
+    t0 = time.perf_counter()
+    p = prof.get("profile", {})
+    meds = prof.get("medications", [])
+    med: Dict[str, Any] = {}
+    photos: List[Any] = []
+    missing: List[str] = []
+    if meds:
+        m = meds[0]
+        device = m.get("device") or {}
+        med = {
+            "title": m.get("name", ""),
+            "device": f"{device.get('model', '')} · {device.get('type', '')}" if device else "",
+            "dosage": m.get("dosage", ""),
+            "kept": m.get("storage_location", ""),
+            "steps": list(m.get("how_to_use_steps", [])),
+            "warnings": "\n".join(f"⚠️ {w}" for w in m.get("warnings", [])),
+            "leaflets": list(m.get("leaflets", [])),
+        }
+        for img in device.get("photos", [])[:3]:
+            if img.startswith(("http://", "https://")):
+                photos.append(img)
+                continue
+            path = _resolve(img)
+            try:
+                thumb = _thumbnail(path) if path else None
+            except Exception:
+                thumb = None
+            if thumb:
+                photos.append(thumb)
+            else:
+                missing.append(img)
+    aid = p.get("medical_aid", {})
+    pid = str(prof.get("patient_id", ""))
+    qr_url = f"{EMERGENCY_URL}?patient={pid}" if pid else EMERGENCY_URL
+    return EmergencyBundle(
+        patient_id=pid,
+        version=version,
+        name=p.get("full_name", ""),
+        subtitle=f"DOB: {p.get('dob', '')} · Blood: {p.get('blood_type', '')}",
+        allergies=[f"• {a.get('substance')} — {a.get('severity', '')}" for a in prof.get("allergies", [])[:3]],
+        conditions=[f"• {c.get('name')} ({c.get('severity', '')})" for c in prof.get("conditions", [])[:3]],
+        med=med,
+        photos=photos,
+        missing_photos=missing,
+        contacts=[f"**{c.get('name')}** — {c.get('relation')} — {c.get('phone')}" for c in prof.get("emergency_contacts", [])],
+        aid=[
+            f"**Provider**: {aid.get('provider', '')}",
+            f"**Plan**: {aid.get('plan', '')}",
+            f"**Member #**: {aid.get('member_no', '')}",
+            f"**Emergency hotline**: {aid.get('emergency_hotline', '')}",
+        ],
+        qr_png=_qr(qr_url),
+        qr_url=qr_url,
+        build_ms=(time.perf_counter() - t0) * 1000,
+    )
+
+
+_bundles: "OrderedDict[Optional[str], EmergencyBundle]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_bundle(patient_id: Optional[str] = None) -> Tuple[EmergencyBundle, bool]:
+    """
+    The bundle for `patient_id` (default patient if None), rebuilt only when the
+    profile version changes. Returns (bundle, rebuilt). Shared by all sessions.
+    """
+    version = profile_version(patient_id=patient_id)
+    with _lock:
+        b = _bundles.get(patient_id)
+        if b is not None and b.version == version:
+            _bundles.move_to_end(patient_id)
+            return b, False
+    b = build_bundle(get_emergency_profile(patient_id=patient_id), version)
+    with _lock:
+        _bundles[patient_id] = b
+        while len(_bundles) > BUNDLE_CACHE_SIZE:
+            _bundles.popitem(last=False)
+    return b, True
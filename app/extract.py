@@ -0,0 +1,70 @@
+# app/extract.py
+from __future__ import annotations
+import os, time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Tuple
+
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", 0))  # 0 = one per CPU
+
+
+@dataclass
+class Extracted:
+    """Text of one source, page by page (MD/TXT files are a single page)."""
+    path: str
+    pages: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+    error: Optional[str] = None  # whole-file failure (unreadable/corrupt)
+    page_errors: List[Tuple[int, str]] = field(default_factory=list)  # (page_no, message)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def records(self) -> Iterator[Tuple[str, int, str]]:
+        """(path, page_no, text) with 1-based page numbers."""
+        for i, text in enumerate(self.pages, start=1):
+            yield self.path, i, text
+
+
+def extract_pages(path: str) -> Extracted:
+    """Extract one file. Errors are recorded on the result instead of being swallowed."""
+    t0 = time.perf_counter()
+    res = Extracted(path=path)
+    try:
+        if path.lower().endswith(".pdf"):
+            from pypdf import PdfReader
+
+            reader = PdfReader(path)
+            for page_no, page in enumerate(reader.pages, start=1):
+                try:
+                    res.pages.append(page.extract_text() or "")
+                except Exception as e:
+                    res.pages.append("")
+                    res.page_errors.append((page_no, f"{type(e).__name__}: {e}"))
+        elif path.lower().endswith((".md", ".txt")):
+            with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                res.pages.append(f.read())
+        else:
+            res.error = "unsupported file type"
+    except Exception as e:
+        res.error = f"{type(e).__name__}: {e}"
+    res.seconds = time.perf_counter() - t0
+    return res
+
+
+def extract_many(paths: List[str], workers: int = EXTRACT_WORKERS) -> Iterator[Extracted]:
+    """
+    Extract `paths` on a process pool, yielding results in input order as they complete.
+    `workers <= 0` means one per CPU; `workers == 1` (or a single path) runs in-process.
+    """
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(paths))
+    if workers <= 1:
+        for p in paths:
+            yield extract_pages(p)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        # map() keeps input order; chunksize=1 balances uneven PDF sizes
+        yield from ex.map(extract_pages, paths, chunksize=1)
@@ -0,0 +1,232 @@
+# app/inference.py
+"""
+CPU inference backends for the embedder and the cross-encoder, chosen by environment:
+
+    EMBED_BACKEND=torch   fp32 PyTorch (default)
+    EMBED_BACKEND=onnx    ONNX Runtime through sentence-transformers' backend="onnx";
+                          ONNX_FILE=onnx/model_qint8_avx512_vnni.onnx picks a quantised export
+    EMBED_BACKEND=int8    PyTorch dynamic int8 quantisation of the Linear layers
+    RERANK_BACKEND        same choices for the cross-encoder (defaults to EMBED_BACKEND)
+
+A backend that fails to load (e.g. onnxruntime not installed) logs a warning and
+falls back to torch. Before switching a deployment, check it against fp32:
+
+    python -m app.inference --compare             # agreement, recall delta, latency, memory
+"""
+from __future__ import annotations
+import os, time, logging, argparse
+from typing import Any, Dict, List, Tuple
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "onnx", "int8")
+EMBED_BACKEND = os.environ.get("EMBED_BACKEND", "torch")
+RERANK_BACKEND = os.environ.get("RERANK_BACKEND", EMBED_BACKEND)
+ONNX_FILE = os.environ.get("ONNX_FILE", "")  # e.g. onnx/model_qint8_avx512_vnni.onnx
+RERANK_ONNX_FILE = os.environ.get("RERANK_ONNX_FILE", "")
+
+
+def _check(backend: str) -> None:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend!r}; expected one of {BACKENDS}")
+
+
+def _quantize(module):
+    import torch
+
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_embedder(name: str, backend: str = EMBED_BACKEND):
+    """A SentenceTransformer for `name` running on `backend`."""
+    _check(backend)
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "onnx":
+        try:
+            kw = {"model_kwargs": {"file_name": ONNX_FILE}} if ONNX_FILE else {}
+            return SentenceTransformer(name, device="cpu", backend="onnx", **kw)
+        except Exception as e:
+            log.warning("ONNX embedder for %s unavailable (%s); using torch", name, e)
+            return SentenceTransformer(name)
+    if backend == "int8":
+        model = SentenceTransformer(name, device="cpu")
+        model[0].auto_model = _quantize(model[0].auto_model)
+        return model
+    return SentenceTransformer(name)
+
+
+def load_cross_encoder(name: str, backend: str = RERANK_BACKEND):
+    """A CrossEncoder for `name` running on `backend`."""
+    _check(backend)
+    from sentence_transformers.cross_encoder import CrossEncoder
+
+    if backend == "onnx":
+        try:
+            kw = {"model_kwargs": {"file_name": RERANK_ONNX_FILE}} if RERANK_ONNX_FILE else {}
+            return CrossEncoder(name, device="cpu", backend="onnx", **kw)
+        except Exception as e:
+            log.warning("ONNX cross-encoder for %s unavailable (%s); using torch", name, e)
+            return CrossEncoder(name)
+    if backend == "int8":
+        model = CrossEncoder(name, device="cpu")
+        model.model = _quantize(model.model)
+        return model
+    return CrossEncoder(name)
+
+
+# ---------- Equivalence check ----------
+def _corpus(n_docs: int) -> Tuple[List[str], List[str], List[Dict[str, Any]]]:
+    """Synthetic bench corpus as (paragraph chunks, their file names, queries)."""
+    import tempfile
+    from app.bench import make_synthetic_corpus
+
+    chunks, names = [], []
+    with tempfile.TemporaryDirectory(prefix="inference-compare-") as d:
+        queries = make_synthetic_corpus(d, n_docs=n_docs)
+        for fname in sorted(os.listdir(d)):
+            with open(os.path.join(d, fname), "r", encoding="utf-8") as f:
+                for para in f.read().split("\n\n"):
+                    chunks.append(para)
+                    names.append(fname)
+    return chunks, names, queries
+
+
+def _recall(Q: np.ndarray, X: np.ndarray, names: List[str], queries: List[Dict[str, Any]], k: int) -> float:
+    top = np.argsort(-(Q @ X.T), axis=1)[:, :k]
+    hits = [any(names[j] in q["expected_sources"] for j in row) for row, q in zip(top, queries)]
+    return float(np.mean(hits))
+
+
+def _timed_encode(model, texts: List[str], batch_size: int = 32) -> Tuple[np.ndarray, float]:
+    t0 = time.perf_counter()
+    X = model.encode(texts, convert_to_numpy=True, normalize_embeddings=True, batch_size=batch_size)
+    return np.asarray(X, dtype=np.float32), time.perf_counter() - t0
+
+
+def _memory_probe(backend: str, embed_model: str, rerank_model: str, rerank: bool) -> Dict[str, Any]:
+    """RSS and load time of this (fresh) process after loading `backend`'s models."""
+    from app.bench import current_rss_mb
+
+    out: Dict[str, Any] = {"before_mb": current_rss_mb()}
+    t0 = time.perf_counter()
+    model = load_embedder(embed_model, backend)
+    model.encode(["warm up"], convert_to_numpy=True)
+    out["load_s"], out["embed_mb"] = time.perf_counter() - t0, current_rss_mb()
+    if rerank:
+        t0 = time.perf_counter()
+        ce = load_cross_encoder(rerank_model, backend)
+        ce.predict([("warm up", "warm up")])
+        out["rerank_load_s"], out["rerank_mb"] = time.perf_counter() - t0, current_rss_mb()
+    return out
+
+
+def _probe(backend: str, embed_model: str, rerank_model: str, rerank: bool) -> Dict[str, Any]:
+    import json, subprocess, sys
+
+    cmd = [sys.executable, "-m", "app.inference", "--memory-probe", backend, embed_model, rerank_model]
+    cmd += [] if rerank else ["--no-rerank"]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode:
+        raise RuntimeError(f"Memory probe for {backend} failed:\n{proc.stderr.strip()[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def compare(
+    backends: List[str],
+    embed_model: str,
+    rerank_model: str,
+    n_docs: int = 100,
+    k: int = 5,
+    rerank: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Load the fp32 torch models and each backend in turn; report load time and RSS (each
+    measured in a fresh process, so imports and freed memory don't skew later rows),
+    single-query latency, batch throughput, cosine agreement with fp32, recall@k on
+    the bench corpus (own index and fp32 index) and, with `rerank`, cross-encoder
+    score correlation and top-1 agreement.
+    """
+    chunks, names, queries = _corpus(n_docs)
+    qtexts = [q["query"] for q in queries]
+    rows: List[Dict[str, Any]] = []
+    ref: Dict[str, Any] = {}
+    for backend in ["torch"] + [b for b in backends if b != "torch"]:
+        row: Dict[str, Any] = {"backend": backend}
+        mem = _probe(backend, embed_model, rerank_model, rerank)
+        row["load_s"], row["rss_mb"] = mem["load_s"], mem["embed_mb"]
+        if rerank:
+            row["rerank_load_s"], row["rerank_rss_mb"] = mem["rerank_load_s"], mem["rerank_mb"] - mem["embed_mb"]
+        model = load_embedder(embed_model, backend)
+        model.encode(["warm up"], convert_to_numpy=True)
+        lat = [_timed_encode(model, [q], 1)[1] for q in qtexts[:100]]
+        row["query_p50_ms"] = float(np.percentile(lat, 50) * 1000)
+        row["query_p95_ms"] = float(np.percentile(lat, 95) * 1000)
+        X, dt = _timed_encode(model, chunks)
+        row["chunks_per_s"] = len(chunks) / dt
+        Q, _ = _timed_encode(model, qtexts)
+        if backend == "torch":
+            ref.update(X=X, Q=Q)
+        row["cos_mean"] = float(np.mean(np.sum(X * ref["X"], axis=1)))
+        row["cos_min"] = float(np.min(np.sum(X * ref["X"], axis=1)))
+        row["recall"] = _recall(Q, X, names, queries, k)
+        row["recall_fp32_index"] = _recall(Q, ref["X"], names, queries, k)  # new queries, old index
+        row["recall_delta"] = row["recall"] - _recall(ref["Q"], ref["X"], names, queries, k)
+        del model
+
+        if rerank:
+            ce = load_cross_encoder(rerank_model, backend)
+            cand = np.argsort(-(ref["Q"] @ ref["X"].T), axis=1)[:, :20][:50]
+            pairs = [(qtexts[i], chunks[j]) for i, row_ids in enumerate(cand) for j in row_ids]
+            t0 = time.perf_counter()
+            S = np.asarray(ce.predict(pairs, batch_size=32), dtype=np.float32).reshape(len(cand), -1)
+            row["rerank_pairs_per_s"] = len(pairs) / (time.perf_counter() - t0)
+            if backend == "torch":
+                ref["S"] = S
+            with np.errstate(invalid="ignore", divide="ignore"):  # constant score rows have no correlation
+                row["rerank_corr"] = float(np.nanmean([np.corrcoef(a, b)[0, 1] for a, b in zip(S, ref["S"])]))
+            row["rerank_top1_agree"] = float(np.mean(S.argmax(1) == ref["S"].argmax(1)))
+            del ce
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Compare CPU inference backends against fp32 torch.")
+    ap.add_argument("--compare", action="store_true", help="run the side-by-side comparison")
+    ap.add_argument("--backends", default="onnx,int8", help="comma-separated, compared against torch")
+    ap.add_argument("--n-docs", type=int, default=100, help="synthetic bench corpus size")
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--no-rerank", action="store_true", help="skip the cross-encoder")
+    ap.add_argument("--memory-probe", nargs=3, metavar=("BACKEND", "EMBED", "RERANK"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.memory_probe:  # child of compare(): nothing but this module and the models is imported
+        import json
+
+        backend, embed_name, rerank_name = args.memory_probe
+        print(json.dumps(_memory_probe(backend, embed_name, rerank_name, not args.no_rerank)))
+        raise SystemExit(0)
+    if not args.compare:
+        ap.error("nothing to do; pass --compare")
+
+    from app.rag import DEFAULT_EMBEDDINGS_MODEL
+    from app.reranker import RERANK_MODEL
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    for b in backends:
+        _check(b)
+    rows = compare(backends, DEFAULT_EMBEDDINGS_MODEL, RERANK_MODEL, args.n_docs, args.k, not args.no_rerank)
+    cols = [
+        ("backend", "{:>8}"), ("load_s", "{:8.2f}"), ("rss_mb", "{:8.0f}"), ("query_p50_ms", "{:8.2f}"),
+        ("query_p95_ms", "{:8.2f}"), ("chunks_per_s", "{:8.0f}"), ("cos_mean", "{:8.4f}"), ("cos_min", "{:8.4f}"),
+        ("recall", "{:8.3f}"), ("recall_fp32_index", "{:8.3f}"), ("recall_delta", "{:+8.3f}"),
+    ]
+    if not args.no_rerank:
+        cols += [
+            ("rerank_load_s", "{:8.2f}"), ("rerank_rss_mb", "{:8.0f}"), ("rerank_pairs_per_s", "{:8.0f}"),
+            ("rerank_corr", "{:8.4f}"), ("rerank_top1_agree", "{:8.3f}"),
+        ]
+    for name, fmt in cols:
+        print(f"{name:20}" + " ".join(fmt.format(r[name]) for r in rows))
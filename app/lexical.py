@@ -0,0 +1,148 @@
+# app/lexical.py
+from __future__ import annotations
+import os, re, json
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+# Words, numbers and dotted/comma'd numbers ("2.5", "1,000"); keeps "µg", "handihaler".
+TOKEN_RE = re.compile(r"\w+(?:[.,]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+class LexicalIndex:
+    """
+    BM25 over a prebuilt inverted index stored as flat numpy arrays in `index_dir`:
+
+      terms.json     vocabulary, term id = position
+      offsets.npy    postings of term t are [offsets[t], offsets[t+1])
+      postings.npy   row (document position) of each posting
+      tf.npy         term frequency of each posting
+      weights.npy    precomputed BM25 contribution of each posting
+      doc_len.npy    tokens per document; idf.npy per term; ids.npy vector id per row
+
+    Arrays are memory-mapped on first search, so loading is lazy and pages are shared
+    between processes. A query only touches the postings of its own terms.
+    """
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        self._vocab: Optional[Dict[str, int]] = None
+        self._arrays: Dict[str, np.ndarray] = {}
+        self.params: Dict[str, float] = {}
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.index_dir, "lexical.json"))
+
+    # ---------- Build ----------
+    @classmethod
+    def build(
+        cls, index_dir: str, docs: List[str], ids: List[int], k1: float = 1.5, b: float = 0.75
+    ) -> "LexicalIndex":
+        os.makedirs(index_dir, exist_ok=True)
+        marker = os.path.join(index_dir, "lexical.json")
+        if os.path.exists(marker):
+            os.remove(marker)
+        vocab: Dict[str, int] = {}
+        term_ids: List[int] = []
+        rows: List[int] = []
+        tfs: List[int] = []
+        doc_len = np.zeros(len(docs), dtype=np.float32)
+        for row, doc in enumerate(docs):
+            toks = tokenize(doc)
+            doc_len[row] = len(toks)
+            for term, tf in Counter(toks).items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                rows.append(row)
+                tfs.append(tf)
+
+        t = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(t, kind="stable")  # group postings by term, rows stay ascending
+        postings = np.asarray(rows, dtype=np.int32)[order]
+        tf = np.asarray(tfs, dtype=np.float32)[order]
+        df = np.bincount(t, minlength=len(vocab))
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(df, out=offsets[1:])
+
+        n = len(docs)
+        avgdl = float(doc_len.mean()) if n else 0.0
+        idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * doc_len[postings] / max(avgdl, 1e-9))
+        term_of_posting = np.repeat(np.arange(len(vocab)), df)
+        weights = (idf[term_of_posting] * tf * (k1 + 1) / (tf + norm)).astype(np.float32)
+
+        arrays = {
+            "offsets": offsets, "postings": postings, "tf": tf, "weights": weights,
+            "doc_len": doc_len, "idf": idf, "ids": np.asarray(ids, dtype=np.int64),
+        }
+        for name, arr in arrays.items():
+            np.save(os.path.join(index_dir, f"{name}.npy"), arr)
+        terms = [""] * len(vocab)
+        for term, i in vocab.items():
+            terms[i] = term
+        with open(os.path.join(index_dir, "terms.json"), "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+        # Written last: its presence marks a complete index
+        with open(marker, "w", encoding="utf-8") as f:
+            json.dump({"k1": k1, "b": b, "avgdl": avgdl, "n_docs": n, "n_terms": len(vocab)}, f)
+
+        idx = cls(index_dir)
+        idx._vocab = vocab
+        idx._arrays = arrays
+        idx.params = {"k1": k1, "b": b, "avgdl": avgdl, "n_docs": n}
+        return idx
+
+    # ---------- Load ----------
+    def _ensure_loaded(self) -> None:
+        if self._vocab is not None:
+            return
+        if not self.exists():
+            raise FileNotFoundError(f"No lexical index in {self.index_dir}")
+        with open(os.path.join(self.index_dir, "lexical.json"), "r", encoding="utf-8") as f:
+            self.params = json.load(f)
+        arrays = {}
+        for name in ("offsets", "postings", "weights", "ids"):
+            arrays[name] = np.load(os.path.join(self.index_dir, f"{name}.npy"), mmap_mode="r")
+        with open(os.path.join(self.index_dir, "terms.json"), "r", encoding="utf-8") as f:
+            terms = json.load(f)
+        self._arrays = arrays
+        self._vocab = {term: i for i, term in enumerate(terms)}
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return int(self.params["n_docs"])
+
+    # ---------- Search ----------
+    def search(self, query: str, k: int = 10, allowed_ids: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Top-k (vector id, BM25 score) for `query`, best first; optionally only among `allowed_ids`."""
+        self._ensure_loaded()
+        vocab, a = self._vocab, self._arrays
+        offsets, postings, weights = a["offsets"], a["postings"], a["weights"]
+        scores = np.zeros(int(self.params["n_docs"]), dtype=np.float32)
+        touched = []
+        for term in set(tokenize(query)):
+            t = vocab.get(term)
+            if t is None:
+                continue
+            lo, hi = int(offsets[t]), int(offsets[t + 1])
+            rows = postings[lo:hi]
+            scores[rows] += weights[lo:hi]  # rows are unique within a term
+            touched.append(rows)
+        if not touched:
+            return []
+        cand = np.unique(np.concatenate(touched))
+        if allowed_ids is not None:
+            cand = cand[np.isin(a["ids"][cand], allowed_ids)]
+            if not len(cand):
+                return []
+        cs = scores[cand]
+        if len(cand) > k:
+            top = np.argpartition(-cs, k - 1)[:k]
+        else:
+            top = np.arange(len(cand))
+        top = top[np.argsort(-cs[top], kind="stable")]
+        ids = a["ids"]
+        return [(int(ids[cand[i]]), float(cs[i])) for i in top]
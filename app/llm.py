@@ -0,0 +1,314 @@
+# app/llm.py
+from __future__ import annotations
+import os, time, random, logging, argparse, threading
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import httpx
+import openai
+from openai import OpenAI
+
+log = logging.getLogger(__name__)
+
+# OPENAI_BASE_URL points the client at any OpenAI-compatible server, e.g. scripts/openai_stub.py
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL") or None
+
+LLM_TIMEOUT_S = float(os.environ.get("LLM_TIMEOUT_S", 60))  # per read/write
+LLM_CONNECT_TIMEOUT_S = float(os.environ.get("LLM_CONNECT_TIMEOUT_S", 5))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 3))
+LLM_BACKOFF_S = float(os.environ.get("LLM_BACKOFF_S", 0.5))  # base of the jittered exponential backoff
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 8))  # in-flight calls per process
+LLM_QUEUE_TIMEOUT_S = float(os.environ.get("LLM_QUEUE_TIMEOUT_S", 30))
+LLM_POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", 20))  # keep-alive connections
+# If set, a primary call that has not produced its first byte within the budget is
+# abandoned and repeated once on the fallback model.
+LLM_FALLBACK_MODEL = os.environ.get("LLM_FALLBACK_MODEL", "")
+LLM_LATENCY_BUDGET_S = float(os.environ.get("LLM_LATENCY_BUDGET_S", 0))  # 0 = no budget
+
+_RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_TIMEOUTS = (openai.APITimeoutError, httpx.TimeoutException)
+
+_clients: Dict[Tuple[Optional[str], Optional[str]], OpenAI] = {}
+_clients_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(1, LLM_MAX_CONCURRENCY))
+
+
+class LLMBusy(RuntimeError):
+    """Raised when no concurrency slot frees up within LLM_QUEUE_TIMEOUT_S."""
+
+
+# ---------- Accounting ----------
+class LLMStats:
+    """Process-wide per-model call counts, retries, fallbacks, tokens and latencies."""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._models: Dict[str, Dict[str, Any]] = {}
+        self.window = window
+
+    def _m(self, model: str) -> Dict[str, Any]:
+        return self._models.setdefault(model, {
+            "calls": 0, "errors": 0, "retries": 0, "fallbacks": 0,
+            "prompt_tokens": 0, "completion_tokens": 0,
+            "latency_s": deque(maxlen=self.window), "ttft_s": deque(maxlen=self.window),
+        })
+
+    def record(self, model: str, **kw: Any) -> None:
+        with self._lock:
+            m = self._m(model)
+            for key in ("calls", "errors", "retries", "fallbacks", "prompt_tokens", "completion_tokens"):
+                m[key] += int(kw.get(key) or 0)
+            for key in ("latency_s", "ttft_s"):
+                if kw.get(key) is not None:
+                    m[key].append(float(kw[key]))
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        out = {}
+        with self._lock:
+            for model, m in self._models.items():
+                row = {k: v for k, v in m.items() if not isinstance(v, deque)}
+                for key in ("latency_s", "ttft_s"):
+                    xs = sorted(m[key])
+                    if xs:
+                        row[f"{key[:-2]}_p50_s"] = xs[len(xs) // 2]
+                        row[f"{key[:-2]}_p95_s"] = xs[min(len(xs) - 1, int(len(xs) * 0.95))]
+                out[model] = row
+        return out
+
+
+STATS = LLMStats()
+
+
+# ---------- Client ----------
+def get_client(api_key: Optional[str] = None, base_url: Optional[str] = None) -> OpenAI:
+    """
+    One OpenAI client per (key, base URL) for the whole process, sharing a keep-alive
+    connection pool. SDK retries are off; retries happen in `_with_retries`.
+    """
+    key = (api_key, base_url or OPENAI_BASE_URL)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            http = httpx.Client(
+                limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE),
+                timeout=httpx.Timeout(LLM_TIMEOUT_S, connect=LLM_CONNECT_TIMEOUT_S),
+            )
+            client = OpenAI(api_key=api_key, base_url=key[1], http_client=http, max_retries=0)
+            _clients[key] = client
+    return client
+
+
+def _retryable(e: Exception) -> bool:
+    if isinstance(e, (openai.APIConnectionError, httpx.TransportError)):  # includes timeouts
+        return True
+    return isinstance(e, openai.APIStatusError) and e.status_code in _RETRY_STATUS
+
+
+def _backoff(attempt: int, e: Exception) -> float:
+    resp = getattr(e, "response", None)
+    retry_after = resp.headers.get("retry-after") if resp is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), 30.0)
+        except ValueError:
+            pass
+    return LLM_BACKOFF_S * (2 ** attempt) * random.uniform(0.5, 1.5)  # jitter spreads retry storms
+
+
+def _with_retries(fn: Callable[[], Any], model: str, retry_timeouts: bool = True) -> Any:
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            return fn()
+        except Exception as e:
+            last = attempt == LLM_MAX_RETRIES
+            if last or not _retryable(e) or (not retry_timeouts and isinstance(e, _TIMEOUTS)):
+                raise
+            delay = _backoff(attempt, e)
+            log.info("LLM call to %s failed (%s); retry %d in %.2fs", model, e, attempt + 1, delay)
+            STATS.record(model, retries=1)
+            time.sleep(delay)
+
+
+class _Slot:
+    """Concurrency slot held for the duration of one call (or stream)."""
+
+    def __enter__(self):
+        if not _slots.acquire(timeout=LLM_QUEUE_TIMEOUT_S):
+            raise LLMBusy(f"All {LLM_MAX_CONCURRENCY} LLM slots busy for {LLM_QUEUE_TIMEOUT_S:.0f}s")
+        return self
+
+    def __exit__(self, *exc):
+        _slots.release()
+
+
+def _messages(system_prompt: str, user_prompt: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def _plan(model: str) -> List[Tuple[str, Optional[float]]]:
+    """(model, read timeout) attempts: the primary under the latency budget, then the fallback."""
+    if LLM_FALLBACK_MODEL and LLM_FALLBACK_MODEL != model and LLM_LATENCY_BUDGET_S > 0:
+        return [(model, LLM_LATENCY_BUDGET_S), (LLM_FALLBACK_MODEL, None)]
+    return [(model, None)]
+
+
+def _timeout(read_s: Optional[float]) -> httpx.Timeout:
+    return httpx.Timeout(read_s or LLM_TIMEOUT_S, connect=LLM_CONNECT_TIMEOUT_S)
+
+
+def complete(
+    system_prompt: str,
+    user_prompt: str,
+    temperature: float,
+    model: str,
+    api_key: Optional[str] = None,
+    stats: Optional[Dict[str, Any]] = None,
+) -> str:
+    """Blocking chat completion; `stats` (if given) receives model, total_s and token usage."""
+    t0 = time.perf_counter()
+    client = get_client(api_key)
+    plan = _plan(model)
+    with _Slot():
+        for i, (m, read_s) in enumerate(plan):
+            budgeted = i < len(plan) - 1
+            try:
+                resp = _with_retries(
+                    lambda: client.chat.completions.create(
+                        model=m,
+                        temperature=temperature,
+                        messages=_messages(system_prompt, user_prompt),
+                        timeout=_timeout(read_s),
+                    ),
+                    m,
+                    retry_timeouts=not budgeted,
+                )
+                break
+            except _TIMEOUTS:
+                if not budgeted:
+                    STATS.record(m, calls=1, errors=1)
+                    raise
+                log.warning("%s exceeded its %.2fs budget; falling back to %s", m, read_s, plan[i + 1][0])
+                STATS.record(m, calls=1, fallbacks=1)
+            except Exception:
+                STATS.record(m, calls=1, errors=1)
+                raise
+    total = time.perf_counter() - t0
+    usage = getattr(resp, "usage", None)
+    pt, ct = (usage.prompt_tokens, usage.completion_tokens) if usage else (0, 0)
+    STATS.record(m, calls=1, latency_s=total, prompt_tokens=pt, completion_tokens=ct)
+    if stats is not None:
+        stats.update(model=m, fallback=m != model, ttft_s=None, total_s=total, prompt_tokens=pt, completion_tokens=ct)
+    return resp.choices[0].message.content or ""
+
+
+def stream(
+    system_prompt: str,
+    user_prompt: str,
+    temperature: float,
+    model: str,
+    api_key: Optional[str] = None,
+    stats: Optional[Dict[str, Any]] = None,
+) -> Iterator[str]:
+    """
+    Yield the completion as text deltas while it is generated. `stats` (if given) is
+    filled with ttft_s (request start to first non-empty delta), total_s, the number
+    of deltas and token usage once the stream ends or the consumer stops early.
+    Failures before the first delta are retried (and may fall back); later ones raise.
+    """
+    t0 = time.perf_counter()
+    client = get_client(api_key)
+    plan = _plan(model)
+    ttft: Optional[float] = None
+    n = 0
+    usage = None
+    used = model
+    try:
+        with _Slot():
+            for i, (m, read_s) in enumerate(plan):
+                used = m
+                budgeted = i < len(plan) - 1
+
+                def first() -> Tuple[Iterator[Any], Any]:
+                    resp = client.chat.completions.create(
+                        model=m,
+                        temperature=temperature,
+                        messages=_messages(system_prompt, user_prompt),
+                        stream=True,
+                        stream_options={"include_usage": True},
+                        timeout=_timeout(read_s),
+                    )
+                    it = iter(resp)
+                    return it, next(it, None)  # the first chunk is where a slow model stalls
+
+                try:
+                    it, head = _with_retries(first, m, retry_timeouts=not budgeted)
+                except _TIMEOUTS:
+                    if not budgeted:
+                        raise
+                    log.warning("%s exceeded its %.2fs budget; falling back to %s", m, read_s, plan[i + 1][0])
+                    STATS.record(m, calls=1, fallbacks=1)
+                    continue
+                chunks = [head] if head is not None else []
+                for chunk in _chain(chunks, it):
+                    if getattr(chunk, "usage", None):
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    if ttft is None:
+                        ttft = time.perf_counter() - t0
+                    n += 1
+                    yield delta
+                break
+    except Exception:
+        STATS.record(used, calls=1, errors=1)
+        raise
+    else:
+        pt, ct = (usage.prompt_tokens, usage.completion_tokens) if usage else (0, 0)
+        STATS.record(used, calls=1, latency_s=time.perf_counter() - t0, ttft_s=ttft,
+                     prompt_tokens=pt, completion_tokens=ct)
+    finally:
+        if stats is not None:
+            stats.update(model=used, fallback=used != model, ttft_s=ttft, total_s=time.perf_counter() - t0, deltas=n)
+            if usage:
+                stats.update(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+
+
+def _chain(head: List[Any], rest: Iterator[Any]) -> Iterator[Any]:
+    yield from head
+    yield from rest
+
+
+def format_stats(stats: Dict[str, Any]) -> str:
+    parts = []
+    if stats.get("ttft_s") is not None:
+        parts.append(f"first token {stats['ttft_s']:.2f}s")
+    if stats.get("total_s") is not None:
+        parts.append(f"total {stats['total_s']:.2f}s")
+    if stats.get("completion_tokens"):
+        parts.append(f"{stats.get('prompt_tokens', 0)}+{stats['completion_tokens']} tokens")
+    if stats.get("context_tokens") is not None:
+        parts.append(f"context {stats['context_tokens']} tokens ({stats.get('context_saved', 0)} saved)")
+    if stats.get("fallback"):
+        parts.append(f"fallback model {stats['model']}")
+    return " · ".join(parts)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Stream completions and report time-to-first-token.")
+    ap.add_argument("--prompt", default="How do I use the HandiHaler?")
+    ap.add_argument("--model", default=os.environ.get("MODEL_NAME", "gpt-4o-mini"))
+    ap.add_argument("--temperature", type=float, default=0.5)
+    ap.add_argument("--n", type=int, default=1, help="sequential calls (to see connection reuse)")
+    args = ap.parse_args()
+
+    for _ in range(args.n):
+        st: Dict[str, Any] = {}
+        for delta in stream("You are a concise assistant.", args.prompt, args.temperature, args.model, stats=st):
+            print(delta, end="", flush=True)
+        print(f"\n\n[{format_stats(st)}; {st.get('deltas', 0)} deltas]")
+    print(STATS.summary())
@@ -1,9 +1,9 @@
 from __future__ import annotations
-import os, sys, pathlib, re
-from typing import List, Dict, Any
+import os, sys, pathlib, re, time
+_T0 = time.perf_counter()
+from typing import TYPE_CHECKING, List, Dict, Any
 import streamlit as st
 from dotenv import load_dotenv
-from openai import OpenAI
 
 # --- path bootstrap (top of app/main.py) ---
 THIS_FILE = pathlib.Path(__file__).resolve()
@@ -13,15 +13,33 @@ if str(REPO_ROOT) not in sys.path:
 
 # Prefer absolute import; fall back to relative if needed
 try:
-    from app.rag import RAGIndex
+    # app.rag (faiss, sentence-transformers, torch) is imported by the warm-up thread, not here
     from app.modes import MODES
     from app.voice import PERSONA
-    from app.data_store import load_profile
+    from app.data_store import (
+        get_profile, profile_version, profile_prompt, find_patients, namespace_sources, PROFILE_BACKEND,
+    )
+    from app.answer_cache import AnswerCache
+    from app import llm
+    from app.context import assemble_context
+    from app.warmup import WARMUP
+    from app.retrieval_server import RETRIEVAL_URL, RetrievalClient, RetrievalUnavailable
 except Exception:
-    from .rag import RAGIndex
     from .modes import MODES
     from .voice import PERSONA
-    from .data_store import load_profile
+    from .data_store import (
+        get_profile, profile_version, profile_prompt, find_patients, namespace_sources, PROFILE_BACKEND,
+    )
+    from .answer_cache import AnswerCache
+    from . import llm
+    from .context import assemble_context
+    from .warmup import WARMUP
+    from .retrieval_server import RETRIEVAL_URL, RetrievalClient, RetrievalUnavailable
+
+if TYPE_CHECKING:
+    from app.rag import RAGIndex
+
+WARMUP.record("app imports", time.perf_counter() - _T0)
 
 load_dotenv()  # loads EMERGENCY_PIN_HASH, PATIENT_JSON_PATH, etc.
 
@@ -38,6 +56,23 @@ st.set_page_config(page_title="Emergency Medical Profile Agent", page_icon="🚑
 with st.sidebar:
     st.markdown("## Settings")
 
+    # Multi-patient store: pick the patient this session is about
+    if PROFILE_BACKEND == "sqlite":
+        name_q = st.text_input("Find patient", placeholder="Name starts with…")
+        try:
+            matches = find_patients(name_q, limit=50)
+        except Exception as e:
+            matches = []
+            st.warning(f"Profile store unavailable: {e}")
+        if matches:
+            labels = {m["patient_id"]: f"{m['full_name']} ({m['dob']})" for m in matches}
+            ids = list(labels)
+            current = st.session_state.get("patient_id")
+            st.session_state.patient_id = st.selectbox(
+                "Patient", ids, index=ids.index(current) if current in ids else 0, format_func=labels.get
+            )
+    patient_id = st.session_state.get("patient_id")
+
     # Prefer the emergency-focused modes if present
     modes_list = list(MODES.keys())
     default_index = modes_list.index("Emergency guidance") if "Emergency guidance" in modes_list else 0
@@ -47,10 +82,57 @@ with st.sidebar:
         "Use RAG (retrieval)",
         value=os.environ.get("RAG_ENABLED", "true").lower() == "true",
     )
+    retrieval_modes = ["hybrid", "dense", "lexical"]
+    retrieval_mode = st.selectbox(
+        "Retrieval mode",
+        retrieval_modes,
+        index=retrieval_modes.index(os.environ.get("RETRIEVAL_MODE", "hybrid"))
+        if os.environ.get("RETRIEVAL_MODE", "hybrid") in retrieval_modes else 0,
+        help="Hybrid fuses embedding search with exact-term search (drug names, doses, device models).",
+    )
+    # Namespaces: search only the leaflets listed in the patient's medications
+    try:
+        med_names = [m.get("name", "") for m in get_profile(patient_id=patient_id).get("medications", [])]
+    except Exception:
+        med_names = []
+    doc_scopes = ["This patient's leaflets", "All documents"] + [f"Leaflets: {n}" for n in med_names if n]
+    doc_scope = st.selectbox(
+        "Search documents",
+        doc_scopes,
+        index=0 if os.environ.get("SCOPE_TO_PATIENT", "true").lower() == "true" else 1,
+        help="Restricting to the patient's (or one medication's) leaflets keeps unrelated leaflets out.",
+    )
+    rerank_enabled = st.toggle(
+        "Re-rank passages (cross-encoder)",
+        value=os.environ.get("RERANK_ENABLED", "true").lower() == "true",
+        help="Falls back to retrieval order while the model loads or if it exceeds its latency budget.",
+    )
     top_k = st.slider("Top-k passages", 1, 10, int(os.environ.get("TOP_K", 5)))
     temperature = st.slider("Temperature", 0.0, 1.0, float(os.environ.get("TEMPERATURE", 0.5)))
     model_name = st.text_input("Model name", os.environ.get("MODEL_NAME", "gpt-4o-mini"))
+    stream_enabled = st.toggle(
+        "Stream responses",
+        value=os.environ.get("STREAM_RESPONSES", "true").lower() == "true",
+        help="Show the answer token by token as it is generated.",
+    )
+    answer_cache_enabled = st.toggle(
+        "Reuse cached answers",
+        value=os.environ.get("ANSWER_CACHE", "true").lower() == "true",
+        help="Repeat questions with the same mode, model, profile and passages skip the LLM call.",
+    )
     st.caption("Chat answers about the patient use RAG when enabled (for leaflets/notes).")
+    with st.expander("LLM usage (this server)"):
+        usage = llm.STATS.summary()
+        if usage:
+            st.json(usage)
+        else:
+            st.caption("No LLM calls yet.")
+
+    with st.expander("Startup timings"):
+        rep = WARMUP.report()
+        st.caption(f"Retrieval warm-up: {rep['state']}" + (f" — {rep['error']}" if rep["error"] else ""))
+        for stage, sec in rep["seconds"].items():
+            st.write(f"{stage}: {sec * 1000:.0f} ms")
 
     # --- Emergency shortcuts ---
     st.markdown("## 🚑 Emergency")
@@ -77,7 +159,7 @@ st.title("Emergency Medical Profile Agent")
 
 # ---------- Patient summary card (always visible on home) ----------
 try:
-    prof = load_profile()
+    prof = get_profile(patient_id=patient_id)
     colA, colB, colC = st.columns([2, 1, 1])
     with colA:
         st.subheader(prof["profile"].get("full_name", ""))
@@ -104,38 +186,54 @@ st.divider()
 # ---------- Chat about the patient’s health profile ----------
 st.markdown("### Ask a question about the patient’s medical history, meds, or device usage")
 
-# Ensure index availability (lazy)
+# Shared retrieval service (RETRIEVAL_URL), if configured; None means in-process retrieval
 @st.cache_resource(show_spinner=False)
-def load_index() -> RAGIndex:
-    idx = RAGIndex()
+def get_retrieval_client() -> RetrievalClient | None:
+    return RetrievalClient(RETRIEVAL_URL) if RETRIEVAL_URL else None
+
+def remote_retrieval() -> bool:
+    client = get_retrieval_client()
+    return client is not None and client.available()
+
+# Ensure index availability (lazy): the shared service, else loaded once per process by the warm-up thread
+def load_index() -> "RAGIndex | RetrievalClient":
+    if remote_retrieval():
+        return get_retrieval_client()
     try:
-        idx.load()
+        if not WARMUP.ready:
+            with st.spinner("Loading retrieval models…"):
+                return WARMUP.index()
+        return WARMUP.index()
     except Exception as e:
         st.info("Index not found or failed to load. Upload docs to `data/raw/` and run `make reindex`.")
         raise e
-    return idx
+
+# One answer cache per process, shared by every session
+@st.cache_resource(show_spinner=False)
+def get_answer_cache() -> AnswerCache:
+    return AnswerCache()
 
 # Simple chat state
 if "messages" not in st.session_state:
-    st.session_state.messages = []  # list of dicts: {role, content}
+    st.session_state.messages = []  # list of dicts: {role, content[, stats]}
 
-def llm_respond(system_prompt: str, user_prompt: str, temperature: float, model: str) -> str:
-    api_key = os.environ.get("OPENAI_API_KEY") or (
+def _api_key() -> str | None:
+    return os.environ.get("OPENAI_API_KEY") or (
         st.secrets.get("OPENAI_API_KEY") if hasattr(st, "secrets") else None
     )
+
+def llm_respond(system_prompt: str, user_prompt: str, temperature: float, model: str, stats: Dict[str, Any] | None = None) -> str:
+    api_key = _api_key()
     if not api_key:
         return "⚠️ OPENAI_API_KEY not set. Please configure your .env file."
+    return llm.complete(system_prompt, user_prompt, temperature, model, api_key=api_key, stats=stats)
 
-    client = OpenAI(api_key=api_key)
-    resp = client.chat.completions.create(
-        model=model,
-        temperature=temperature,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-    )
-    return resp.choices[0].message.content or ""
+def llm_stream(system_prompt: str, user_prompt: str, temperature: float, model: str, stats: Dict[str, Any] | None = None):
+    api_key = _api_key()
+    if not api_key:
+        yield "⚠️ OPENAI_API_KEY not set. Please configure your .env file."
+        return
+    yield from llm.stream(system_prompt, user_prompt, temperature, model, api_key=api_key, stats=stats)
 
 with st.container(border=True):
     q = st.chat_input('e.g., "How do I use the HandiHaler?" or "Where is the inhaler kept?"')
@@ -146,6 +244,8 @@ with st.container(border=True):
 for m in st.session_state.messages:
     with st.chat_message(m["role"]):
         st.markdown(m["content"])
+        if m.get("stats"):
+            st.caption(llm.format_stats(m["stats"]))
 
 # On new user input, answer
 if st.session_state.messages and st.session_state.messages[-1]["role"] == "user":
@@ -153,17 +253,41 @@ if st.session_state.messages and st.session_state.messages[-1]["role"] == "user"
     mode = MODES[mode_name]
 
     retrieved: List[Dict[str, Any]] = []
+    passages: List[Dict[str, Any]] = []
+    ctx_report: Dict[str, int] = {}
     citations = ""
+    idx = None
 
     if rag_enabled:
         try:
+            def _retrieve(idx):
+                sources = None
+                if doc_scope != "All documents":
+                    med = doc_scope[len("Leaflets: "):] if doc_scope.startswith("Leaflets: ") else None
+                    sources = namespace_sources(get_profile(patient_id=patient_id), med)
+                    if not len(idx.namespace_ids(tuple(s.lower() for s in sources))):
+                        st.caption("None of the patient's leaflets are indexed; searching all documents.")
+                        sources = None
+                return idx.retrieve(last_q, k=top_k, rerank=rerank_enabled, mode=retrieval_mode, sources=sources)
+
             idx = load_index()
-            retrieved = idx.retrieve(last_q, k=top_k, rerank=False)
-            if retrieved:
+            try:
+                retrieved = _retrieve(idx)
+            except RetrievalUnavailable as e:
+                st.caption(f"Retrieval service unavailable ({e}); using this worker's index.")
+                idx = load_index()
+                retrieved = _retrieve(idx)
+            # Merge overlapping chunks and fit the mode's token budget
+            passages, ctx_report = assemble_context(retrieved, mode.context_tokens)
+            if passages:
                 preview = []
                 import os as _os
-                for r in retrieved:
-                    head = f"{r['cite_id']} {_os.path.basename(r.get('source_name') or r['source'])} · chunk {r['chunk_id']}"
+                for r in passages:
+                    ids = r["chunk_ids"]
+                    chunk = f"chunk {ids[0]}" if len(ids) == 1 else f"chunks {ids[0]}–{ids[-1]}"
+                    head = f"{r['cite_id']} {_os.path.basename(r.get('source_name') or r['source'])} · {chunk}"
+                    if r.get("page"):
+                        head += f" · p. {r['page']}" if r.get("page_end") in (None, r["page"]) else f" · pp. {r['page']}–{r['page_end']}"
                     body = r["text"].replace("\n", " ").strip()
                     if len(body) > 300:
                         body = body[:300] + "…"
@@ -182,11 +306,15 @@ if st.session_state.messages and st.session_state.messages[-1]["role"] == "user"
         "If confidence is low or instructions are incomplete, say so and advise seeking professional help. "
         "Do not invent facts."
     )
+    try:
+        sys_prompt += f"\n\nPatient profile:\n{profile_prompt(patient_id=patient_id)}"
+    except Exception as e:
+        st.warning(f"Patient profile unavailable to the assistant: {e}")
 
     user_prompt = last_q
 
-    if rag_enabled and retrieved:
-        ctx = "\n\n".join(f"{r['cite_id']} {r['text']}" for r in retrieved)
+    if rag_enabled and passages:
+        ctx = "\n\n".join(f"{r['cite_id']} {r['text']}" for r in passages)
         user_prompt = (
             f"Question: {last_q}\n\n"
             f"Use the following context if relevant. Cite using the bracketed ids [#].\n\n{ctx}\n\n"
@@ -200,18 +328,66 @@ if st.session_state.messages and st.session_state.messages[-1]["role"] == "user"
             f"Style hint: {mode.style_hint}."
         )
 
-    with st.chat_message("assistant"):
-        with st.spinner("Thinking…"):
-            answer = llm_respond(
-                sys_prompt, user_prompt, temperature=temperature, model=model_name
+    cache = get_answer_cache() if answer_cache_enabled else None
+    cached = None
+    if cache is not None:
+        try:
+            cache_ctx = AnswerCache.context(
+                mode_name,
+                model_name,
+                temperature,
+                patient_id,
+                profile_version(patient_id=patient_id),
+                idx.version if idx is not None else "",
             )
+            chunk_ids = [r["id"] for r in retrieved]
+            qvec = idx.embed_query(last_q) if (idx is not None and cache.sim_threshold > 0) else None
+            cached = cache.get(cache_ctx, chunk_ids, last_q, qvec)
+        except Exception as e:
+            st.caption(f"Answer cache unavailable: {e}")
+            cache = None
 
-            if answer.strip():
+    with st.chat_message("assistant"):
+        stats: Dict[str, Any] = {}
+        if cached is not None:
+            answer = cached["answer"]
+            st.markdown(answer)
+            st.caption("⚡ Cached answer")
+        elif stream_enabled:
+            try:
+                answer = st.write_stream(
+                    llm_stream(sys_prompt, user_prompt, temperature=temperature, model=model_name, stats=stats)
+                ) or ""
+            except Exception as e:
+                answer = f"⚠️ LLM request failed: {e}"
                 st.markdown(answer)
-                if citations:
-                    with st.expander("Retrieved context & citations"):
-                        st.markdown(citations)
-            else:
-                st.markdown("(No response)")
+        else:
+            with st.spinner("Thinking…"):
+                try:
+                    answer = llm_respond(
+                        sys_prompt, user_prompt, temperature=temperature, model=model_name, stats=stats
+                    )
+                except Exception as e:
+                    answer = f"⚠️ LLM request failed: {e}"
+            st.markdown(answer if answer.strip() else "(No response)")
+
+        if isinstance(answer, list):  # write_stream returns a list if it rendered non-text chunks
+            answer = "".join(str(a) for a in answer)
+        if cached is None and cache is not None and answer.strip() and not answer.startswith("⚠️"):
+            cache.put(cache_ctx, chunk_ids, last_q, answer, qvec)
+        if ctx_report:
+            stats.update(context_tokens=ctx_report["tokens_sent"], context_saved=ctx_report["tokens_saved"])
+        if stats:
+            st.caption(llm.format_stats(stats))
+        # Citations only once generation has finished
+        if answer.strip() and citations:
+            with st.expander("Retrieved context & citations"):
+                st.markdown(citations)
+
+        st.session_state.messages.append({"role": "assistant", "content": answer, "stats": stats})
+        st.session_state.setdefault("turn_stats", []).append(stats)
 
-            st.session_state.messages.append({"role": "assistant", "content": answer})
+# After first paint: load faiss/torch, the index and the embedder in the background
+# (not needed while a shared retrieval service answers for this worker)
+if rag_enabled and not remote_retrieval():
+    WARMUP.start(rerank=rerank_enabled)
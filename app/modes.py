@@ -7,6 +7,7 @@ class Mode:
     name: str
     system: str
     style_hint: str
+    context_tokens: int = 2000  # budget for retrieved passages in the prompt
 
 MODES: Dict[str, Mode] = {
     # Default for the home/chat page: quick, safe instructions + storage locations.
@@ -21,6 +22,7 @@ MODES: Dict[str, Mode] = {
             "Prefer British English."
         ),
         style_hint="Bulleted steps (≤12 words), bold key items, include warnings (⚠️).",
+        context_tokens=1500,  # short prompt, fast first token
     ),
 
     # For clinicians (or when not in a live emergency): fuller, structured summaries.
@@ -33,6 +35,7 @@ MODES: Dict[str, Mode] = {
             "No diagnosis beyond recorded conditions."
         ),
         style_hint="Short sections with headings; crisp sentences; no speculation.",
+        context_tokens=3500,
     ),
 
     # General Q&A when someone asks about history/meds without immediate action.
@@ -1,78 +1,95 @@
 import os
+import hmac
+import time
+import hashlib
+import logging
 import streamlit as st
-from app.data_store import load_profile
-from app.utils.tts_utils import speak_steps_button
+from app.data_store import patient_exists
+from app.emergency_bundle import get_bundle
 
+_T0 = time.perf_counter()
 EMERGENCY_PIN_HASH = os.environ.get("EMERGENCY_PIN_HASH", "")  # optional
+EMERGENCY_RENDER_BUDGET_MS = float(os.environ.get("EMERGENCY_RENDER_BUDGET_MS", 150))
+log = logging.getLogger(__name__)
 
 st.set_page_config(page_title="Emergency Mode", page_icon="🚑", layout="wide")
 
 st.title("🚑 Emergency Mode")
 
-# Minimal read-only until PIN entered
-pin_ok = False
-if EMERGENCY_PIN_HASH:
+# Minimal read-only until PIN entered. The form only reruns on submit, and the
+# unlocked state lives in the session, so the PIN is hashed once, not per rerun.
+pin_ok = not EMERGENCY_PIN_HASH or st.session_state.get("emergency_unlocked", False)
+if not pin_ok:
     with st.expander("Unlock additional details (PIN)"):
-        pin = st.text_input("Enter 6-digit PIN", type="password")
-        if pin:
-            import hashlib
-            if hashlib.sha256(pin.encode()).hexdigest() == EMERGENCY_PIN_HASH:
-                st.success("Unlocked emergency details.")
-                pin_ok = True
-            else:
-                st.error("Incorrect PIN")
-else:
-    pin_ok = True  # no PIN set
+        with st.form("emergency_pin", clear_on_submit=True):
+            pin = st.text_input("Enter 6-digit PIN", type="password")
+            if st.form_submit_button("Unlock") and pin:
+                digest = hashlib.sha256(pin.encode()).hexdigest()
+                if hmac.compare_digest(digest, EMERGENCY_PIN_HASH):
+                    st.session_state.emergency_unlocked = pin_ok = True
+                    st.success("Unlocked emergency details.")
+                else:
+                    st.error("Incorrect PIN")
 
-prof = load_profile()
+# Patient chosen on the home page, or ?patient=<id> (e.g. from a QR code). Another
+# patient's record via the URL needs the PIN (and so a configured PIN), so editing
+# the link exposes nothing.
+patient_id = st.session_state.get("patient_id")
+requested = st.query_params.get("patient")
+if requested and requested != patient_id:
+    if not EMERGENCY_PIN_HASH:
+        st.warning("Opening patients by link needs EMERGENCY_PIN_HASH; showing the selected patient.")
+    elif not pin_ok:
+        st.warning("Enter the PIN above to open the patient in this link; showing the selected patient.")
+    elif patient_exists(requested):
+        patient_id = requested
+    else:
+        st.error(f"Patient {requested!r} not found; showing the selected patient instead.")
+bundle, rebuilt = get_bundle(patient_id)  # precomputed; rebuilt only when the profile changes
 
 # Top strip: name + key flags
 col1, col2, col3 = st.columns([2, 1, 1])
 with col1:
-    st.subheader(prof["profile"].get("full_name", ""))
-    st.caption(f"DOB: {prof['profile'].get('dob', '')} · Blood: {prof['profile'].get('blood_type', '')}")
+    st.subheader(bundle.name)
+    st.caption(bundle.subtitle)
 with col2:
     st.markdown("**Allergies**")
-    for a in prof.get("allergies", [])[:3]:
-        st.write(f"• {a.get('substance')} — {a.get('severity','')}")
+    st.markdown("  \n".join(bundle.allergies))
 with col3:
     st.markdown("**Conditions**")
-    for c in prof.get("conditions", [])[:3]:
-        st.write(f"• {c.get('name')} ({c.get('severity','')})")
+    st.markdown("  \n".join(bundle.conditions))
 
 st.divider()
 
 # Current meds: show first as primary tile
-meds = prof.get("medications", [])
-if meds:
-    med = meds[0]
+med = bundle.med
+if med:
     left, right = st.columns([2, 1])
     with left:
-        st.markdown(f"### Current Med: **{med.get('name','')}**")
-        device = med.get("device", {})
-        if device:
-            st.write(f"**Device**: {device.get('model','')} · {device.get('type','')}")
-        st.write(f"**Dosage**: {med.get('dosage','')}")
-        st.write(f"**Where kept**: **{med.get('storage_location','')}**")
+        st.markdown(f"### Current Med: **{med['title']}**")
+        if med["device"]:
+            st.write(f"**Device**: {med['device']}")
+        st.write(f"**Dosage**: {med['dosage']}")
+        st.write(f"**Where kept**: **{med['kept']}**")
         st.markdown("#### How to use")
-        steps = med.get("how_to_use_steps", [])
-        for i, s in enumerate(steps, 1):
-            st.write(f"{i}. {s}")
-        speak_steps_button(steps)
-        if med.get("warnings"):
-            st.warning("\n".join(f"⚠️ {w}" for w in med["warnings"]))
-        if pin_ok and med.get("leaflets"):
+        st.markdown("\n".join(f"{i}. {s}" for i, s in enumerate(med["steps"], 1)))
+        try:  # TTS (pyttsx3) is optional and loaded only here
+            from app.utils.tts_utils import speak_steps_button
+            speak_steps_button(med["steps"])
+        except Exception:
+            pass
+        if med["warnings"]:
+            st.warning(med["warnings"])
+        if pin_ok and med["leaflets"]:
             with st.expander("Leaflets / Guides"):
                 for lf in med["leaflets"]:
                     st.write(lf)
     with right:
         st.markdown("#### Device photos")
-        device = med.get("device", {})
-        for img in device.get("photos", [])[:3]:
-            try:
-                st.image(img, use_column_width=True)
-            except Exception:
-                st.caption(img)
+        if bundle.photos:
+            st.image(bundle.photos, use_column_width=True)
+        for img in bundle.missing_photos:
+            st.caption(img)
 
 st.divider()
 
@@ -80,14 +97,20 @@ st.divider()
 cols = st.columns(2)
 with cols[0]:
     st.markdown("### ICE Contacts")
-    for c in prof.get("emergency_contacts", []):
-        st.write(f"**{c.get('name')}** — {c.get('relation')} — {c.get('phone')}")
+    st.markdown("  \n".join(bundle.contacts))
 with cols[1]:
     st.markdown("### Medical Aid")
-    aid = prof["profile"].get("medical_aid", {})
-    st.write(f"**Provider**: {aid.get('provider','')}")
-    st.write(f"**Plan**: {aid.get('plan','')}")
-    st.write(f"**Member #**: {aid.get('member_no','')}")
-    st.write(f"**Emergency hotline**: {aid.get('emergency_hotline','')}")
+    st.markdown("  \n".join(bundle.aid))
 
-st.caption("This view shows only what’s essential during emergencies.")
+if bundle.qr_png:
+    with st.expander("QR code for this page"):
+        st.image(bundle.qr_png, caption=bundle.qr_url, width=200)
+
+render_ms = (time.perf_counter() - _T0) * 1000
+if render_ms > EMERGENCY_RENDER_BUDGET_MS:
+    log.warning("Emergency view took %.0f ms (budget %.0f ms)", render_ms, EMERGENCY_RENDER_BUDGET_MS)
+st.caption(
+    "This view shows only what’s essential during emergencies. "
+    f"Rendered in {render_ms:.0f} ms"
+    + (f" (bundle rebuilt in {bundle.build_ms:.0f} ms)." if rebuilt else " from the cached bundle.")
+)
@@ -0,0 +1,218 @@
+# app/profile_store.py
+from __future__ import annotations
+import os, sys, json, time, glob, sqlite3, hashlib, argparse, threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+PROFILE_DB_PATH = os.environ.get("PROFILE_DB_PATH", os.path.join("data", "profiles.db"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    patient_id  TEXT PRIMARY KEY,
+    name_key    TEXT NOT NULL DEFAULT '',  -- lower-cased full name, for lookup
+    full_name   TEXT NOT NULL DEFAULT '',
+    dob         TEXT NOT NULL DEFAULT '',
+    data        TEXT NOT NULL,             -- full profile JSON
+    emergency   TEXT NOT NULL,             -- emergency subset JSON, read without parsing `data`
+    version     TEXT NOT NULL,             -- sha1 of `data`
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS profiles_name ON profiles(name_key);
+"""
+
+_UPSERT = """
+INSERT INTO profiles (patient_id, name_key, full_name, dob, data, emergency, version, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(patient_id) DO UPDATE SET
+    name_key=excluded.name_key, full_name=excluded.full_name, dob=excluded.dob, data=excluded.data,
+    emergency=excluded.emergency, version=excluded.version, updated_at=excluded.updated_at
+"""
+
+_MED_FIELDS = ("name", "dosage", "device", "storage_location", "how_to_use_steps", "warnings", "leaflets")
+
+
+class VersionConflict(RuntimeError):
+    """The stored profile changed since the caller read it."""
+
+
+def emergency_fields(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """The subset Emergency Mode needs: identity, medical aid, allergies, conditions, meds, contacts."""
+    p = profile.get("profile", {})
+    return {
+        "patient_id": profile.get("patient_id", ""),
+        "profile": {
+            "full_name": p.get("full_name", ""),
+            "dob": p.get("dob", ""),
+            "blood_type": p.get("blood_type", ""),
+            "medical_aid": p.get("medical_aid", {}),
+        },
+        "allergies": profile.get("allergies", []),
+        "conditions": profile.get("conditions", []),
+        "medications": [{k: m[k] for k in _MED_FIELDS if k in m} for m in profile.get("medications", [])],
+        "emergency_contacts": profile.get("emergency_contacts", []),
+    }
+
+
+def _row(profile: Dict[str, Any]) -> Tuple:
+    pid = profile.get("patient_id")
+    if not pid:
+        raise ValueError("Profile has no patient_id")
+    data = json.dumps(profile, ensure_ascii=False, separators=(",", ":"))
+    name = (profile.get("profile") or {}).get("full_name", "")
+    return (
+        pid,
+        name.strip().lower(),
+        name,
+        (profile.get("profile") or {}).get("dob", ""),
+        data,
+        json.dumps(emergency_fields(profile), ensure_ascii=False, separators=(",", ":")),
+        hashlib.sha1(data.encode("utf-8")).hexdigest()[:16],
+        time.time(),
+    )
+
+
+class ProfileStore:
+    """
+    Many patient profiles in one SQLite database (WAL mode, so readers never block the
+    writer). Each thread gets its own connection; writes are short IMMEDIATE
+    transactions, so concurrent sessions serialize instead of interleaving.
+    """
+
+    def __init__(self, path: str = PROFILE_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, sql: str, rows: Iterable[Tuple], expected: Optional[Tuple[str, Optional[str]]] = None) -> int:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")  # take the write lock up front
+        try:
+            if expected is not None:
+                pid, version = expected
+                cur = conn.execute("SELECT version FROM profiles WHERE patient_id = ?", (pid,)).fetchone()
+                if (cur[0] if cur else None) != version:
+                    raise VersionConflict(f"Profile {pid} changed (expected {version}, found {cur and cur[0]})")
+            n = conn.executemany(sql, rows).rowcount
+            conn.execute("COMMIT")
+            return n
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ---------- Writes ----------
+    def put(self, profile: Dict[str, Any], expected_version: Optional[str] = None) -> str:
+        """
+        Insert or replace one profile and return its new version. With
+        `expected_version`, raise VersionConflict if the stored version differs.
+        """
+        row = _row(profile)
+        self._write(_UPSERT, [row], expected=(row[0], expected_version) if expected_version else None)
+        return row[6]
+
+    def put_many(self, profiles: Iterable[Dict[str, Any]], batch_size: int = 1000) -> int:
+        """Bulk upsert in transactions of `batch_size` rows; returns the number written."""
+        n = 0
+        batch: List[Tuple] = []
+        for prof in profiles:
+            batch.append(_row(prof))
+            if len(batch) >= batch_size:
+                n += self._write(_UPSERT, batch)
+                batch = []
+        if batch:
+            n += self._write(_UPSERT, batch)
+        return n
+
+    def delete(self, patient_id: str) -> bool:
+        return self._write("DELETE FROM profiles WHERE patient_id = ?", [(patient_id,)]) > 0
+
+    # ---------- Reads ----------
+    def get(self, patient_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT data FROM profiles WHERE patient_id = ?", (patient_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_emergency(self, patient_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT emergency FROM profiles WHERE patient_id = ?", (patient_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def version(self, patient_id: str) -> Optional[str]:
+        row = self._conn().execute("SELECT version FROM profiles WHERE patient_id = ?", (patient_id,)).fetchone()
+        return row[0] if row else None
+
+    def find_by_name(self, query: str, limit: int = 20) -> List[Dict[str, str]]:
+        """Patients whose full name starts with `query` (case-insensitive; uses the name index)."""
+        q = query.strip().lower()
+        if q:
+            sql = ("SELECT patient_id, full_name, dob FROM profiles WHERE name_key >= ? AND name_key < ? "
+                   "ORDER BY name_key LIMIT ?")
+            args: Tuple = (q, q + "\uffff", limit)
+        else:
+            sql, args = "SELECT patient_id, full_name, dob FROM profiles ORDER BY name_key LIMIT ?", (limit,)
+        return [{"patient_id": r[0], "full_name": r[1], "dob": r[2]} for r in self._conn().execute(sql, args)]
+
+    def first_id(self) -> Optional[str]:
+        row = self._conn().execute("SELECT patient_id FROM profiles ORDER BY name_key LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def __len__(self) -> int:
+        return int(self._conn().execute("SELECT COUNT(*) FROM profiles").fetchone()[0])
+
+
+def iter_profile_files(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    """Profiles from .json files (one profile or a list) and .jsonl/.ndjson files (one per line)."""
+    for p in paths:
+        files = sorted(glob.glob(os.path.join(p, "**", "*.*json*"), recursive=True)) if os.path.isdir(p) else [p]
+        for fp in files:
+            with open(fp, "r", encoding="utf-8") as f:
+                if fp.endswith((".jsonl", ".ndjson")):
+                    for line in f:
+                        if line.strip():
+                            yield json.loads(line)
+                    continue
+                obj = json.load(f)
+            yield from (obj if isinstance(obj, list) else [obj])
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Multi-patient profile store (SQLite)")
+    ap.add_argument("--db", default=PROFILE_DB_PATH)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    imp = sub.add_parser("import", help="bulk import profile .json/.jsonl files or directories")
+    imp.add_argument("paths", nargs="+")
+    imp.add_argument("--batch", type=int, default=1000)
+    find = sub.add_parser("find", help="look up patients by name prefix")
+    find.add_argument("name", nargs="?", default="")
+    show = sub.add_parser("show", help="print one profile")
+    show.add_argument("patient_id")
+    show.add_argument("--emergency", action="store_true", help="only the emergency fields")
+    sub.add_parser("count")
+    args = ap.parse_args()
+
+    store = ProfileStore(args.db)
+    if args.cmd == "import":
+        t0 = time.perf_counter()
+        n = store.put_many(iter_profile_files(args.paths), batch_size=args.batch)
+        dt = time.perf_counter() - t0
+        print(f"Imported {n} profiles in {dt:.2f}s ({n / dt if dt else 0:.0f}/s); store has {len(store)}")
+    elif args.cmd == "find":
+        for r in store.find_by_name(args.name):
+            print(f"{r['patient_id']}\t{r['full_name']}\t{r['dob']}")
+    elif args.cmd == "show":
+        prof = store.get_emergency(args.patient_id) if args.emergency else store.get(args.patient_id)
+        if prof is None:
+            sys.exit(f"No profile {args.patient_id}")
+        print(json.dumps(prof, indent=2, ensure_ascii=False))
+    else:
+        print(len(store))
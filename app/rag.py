@@ -1,165 +1,1006 @@
 # app/rag.py
 from __future__ import annotations
-import os, json, argparse
-from typing import List, Dict, Any
+import os, json, time, shutil, logging, argparse, threading
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
-from sentence_transformers.cross_encoder import CrossEncoder
-from rank_bm25 import BM25Okapi
-from app.utils import ensure_dirs, glob_docs, load_text_from_path, chunk_text
+from app.utils import (
+    ensure_dirs, glob_docs, chunk_text, chunk_spans, join_pages, file_sha256,
+)
+from app.embed_cache import EmbeddingCache
+from app.embed_service import EmbedService, get_service
+from app.inference import EMBED_BACKEND, load_embedder
+from app.extract import extract_many, extract_pages, EXTRACT_WORKERS
+from app.text_store import TextStore
+from app.lexical import LexicalIndex
+from app.reranker import Reranker
+from app.ann import (
+    INDEX_TYPE, INDEX_TYPES, IVF_NPROBE, HNSW_EF_SEARCH,
+    index_config, build_index, supports_remove, set_search_params, recall_latency_report,
+    filtered_params, reconstruct_ids, STORAGES, VECTOR_STORAGE, INDEX_MMAP, read_index, write_index,
+)
+
+log = logging.getLogger(__name__)
 
+# Each build is written to INDEX_DIR/versions/<version>/ and published by atomically
+# replacing INDEX_DIR/CURRENT, which names the live version. Indexes from before
+# versioning (files directly in INDEX_DIR) still load until the first new build.
 INDEX_DIR = "data/index"
-META_PATH = os.path.join(INDEX_DIR, "metadata.jsonl")
-FAISS_PATH = os.path.join(INDEX_DIR, "faiss.index")
-BM25_PATH = os.path.join(INDEX_DIR, "bm25.json")
+CURRENT_FILE = "CURRENT"
+INDEX_KEEP_VERSIONS = int(os.environ.get("INDEX_KEEP_VERSIONS", 3))  # complete builds kept on disk
+_ABANDONED_BUILD_S = 24 * 3600  # unpublished build dirs older than this are crashed builds
+
+# Bump when the on-disk layout changes so incremental builds fall back to a full rebuild.
+MANIFEST_VERSION = 3
 
 DEFAULT_EMBEDDINGS_MODEL = os.environ.get(
     "EMBEDDINGS_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
 )
+EMBED_CACHE_ENABLED = os.environ.get("EMBED_CACHE", "true").lower() == "true"
+
+# "dense": FAISS only; "lexical": inverted index only; "hybrid": both, fused with weighted RRF.
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+DEFAULT_RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "hybrid")
+CANDIDATE_POOL = int(os.environ.get("CANDIDATE_POOL", 30))  # candidates per retriever before fusion/rerank
+HYBRID_DENSE_WEIGHT = float(os.environ.get("HYBRID_DENSE_WEIGHT", 1.0))
+HYBRID_LEXICAL_WEIGHT = float(os.environ.get("HYBRID_LEXICAL_WEIGHT", 1.0))
+RRF_K = int(os.environ.get("RRF_K", 60))
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", 256))  # recent query embeddings kept in memory
+# Namespaces up to this many chunks are searched exactly over their own (cached) vectors;
+# larger ones use a FAISS ID selector on the main index.
+NAMESPACE_EXACT_MAX = int(os.environ.get("NAMESPACE_EXACT_MAX", 4096))
+NAMESPACE_CACHE_SIZE = 64
+
+# Lexical candidates are generated here while the calling thread embeds + searches FAISS
+_LEXICAL_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="lexical")
+
+# "paragraph": token-exact windows ending on paragraph breaks; "token": plain token windows;
+# "legacy": the original per-paragraph chunk_text.
+CHUNKERS = ("paragraph", "token", "legacy")
+DEFAULT_CHUNKER = os.environ.get("CHUNKER", "paragraph")
+
+
+def _chunk_spans(
+    doc: str, max_tokens: int = 900, overlap_tokens: int = 180, chunker: str = DEFAULT_CHUNKER
+) -> List[Tuple[int, int]]:
+    """(char_start, char_end) of each chunk of `doc`, a document produced by join_pages()."""
+    if chunker == "legacy":
+        # chunk_text output is a substring of an already-normalised document; locate it
+        spans: List[Tuple[int, int]] = []
+        cursor = 0
+        for ch in chunk_text(doc, max_tokens=max_tokens, overlap_tokens=overlap_tokens):
+            start = doc.find(ch, cursor)
+            start = cursor if start < 0 else start
+            spans.append((start, start + len(ch)))
+            cursor = start
+        return spans
+    if chunker not in CHUNKERS:
+        raise ValueError(f"Unknown chunker {chunker!r}; expected one of {CHUNKERS}")
+    return chunk_spans(
+        doc, max_tokens=max_tokens, overlap_tokens=overlap_tokens, paragraph_aware=chunker == "paragraph"
+    )
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[Tuple[int, float]]],
+    weights: List[float],
+    rrf_k: int = RRF_K,
+) -> List[Tuple[int, float]]:
+    """Fuse ranked (id, score) lists: score(id) = sum_i w_i / (rrf_k + rank_i(id))."""
+    fused: Dict[int, float] = {}
+    for ranking, w in zip(rankings, weights):
+        for rank, (vid, _) in enumerate(ranking, start=1):
+            fused[vid] = fused.get(vid, 0.0) + w / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
+
+
+# ---------- Versions ----------
+def read_current(index_dir: str = INDEX_DIR) -> Optional[str]:
+    """The published version name, or None if nothing has been published."""
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def version_dir(index_dir: str, version: str) -> str:
+    return os.path.join(index_dir, "versions", version)
+
+
+def published_dir(index_dir: str = INDEX_DIR) -> Optional[str]:
+    """Directory of the live build: versions/<CURRENT>, or `index_dir` itself for the old flat layout."""
+    version = read_current(index_dir)
+    if version:
+        return version_dir(index_dir, version)
+    return index_dir if os.path.exists(os.path.join(index_dir, "faiss.index")) else None
+
+
+def _build_mtime(d: str) -> int:
+    for path in (os.path.join(d, "manifest.json"), d):
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:  # incomplete build, or removed by a concurrent gc
+            continue
+    return 0
+
+
+def list_versions(index_dir: str = INDEX_DIR) -> List[str]:
+    """Version names, oldest first by manifest mtime (names alone don't order builds within a second)."""
+    root = os.path.join(index_dir, "versions")
+    if not os.path.isdir(root):
+        return []
+    dirs = [d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d))]
+    return sorted(dirs, key=lambda d: (_build_mtime(os.path.join(root, d)), d))
+
+
+def publish(index_dir: str, version: str) -> None:
+    """
+    Make `version` the live build. CURRENT is written to a temp file and renamed over
+    the old one, so readers always see either the previous or the new name.
+    """
+    if not os.path.exists(os.path.join(version_dir(index_dir, version), "manifest.json")):
+        raise FileNotFoundError(f"No complete build {version!r} in {index_dir}")
+    path = os.path.join(index_dir, CURRENT_FILE)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def gc_versions(index_dir: str = INDEX_DIR, keep: int = INDEX_KEEP_VERSIONS) -> List[str]:
+    """
+    Keep the live build and the newest others, `keep` in all; delete the remaining
+    complete builds and directories abandoned by crashed runs. Processes still serving a deleted build keep
+    their open and mapped files; they move to the live one at their next swap check.
+    """
+    live = read_current(index_dir)
+    complete, removed = [], []
+    for v in list_versions(index_dir):
+        d = version_dir(index_dir, v)
+        if os.path.exists(os.path.join(d, "manifest.json")):
+            complete.append(v)
+        elif time.time() - os.path.getmtime(d) > _ABANDONED_BUILD_S:
+            removed.append(v)
+    others = [v for v in complete if v != live]
+    n_keep = max(0, max(1, keep) - (live in complete))
+    removed += others[: max(0, len(others) - n_keep)]
+    for v in removed:
+        shutil.rmtree(version_dir(index_dir, v), ignore_errors=True)
+    return removed
+
+
+def _build_params(manifest: Dict[str, Any]) -> Dict[str, Any]:
+    """A manifest's build params; builds from before backends were recorded used torch."""
+    params = manifest.get("params")
+    return {"embed_backend": "torch", **params} if params else {}
+
+
+def _new_version() -> str:
+    return time.strftime("%Y%m%d-%H%M%S", time.gmtime()) + "-" + os.urandom(3).hex()
 
 
 class RAGIndex:
-    def __init__(self, embed_model: str = DEFAULT_EMBEDDINGS_MODEL):
-        self.embedder = SentenceTransformer(embed_model)
+    def __init__(
+        self,
+        embed_model: str = DEFAULT_EMBEDDINGS_MODEL,
+        index_dir: str = INDEX_DIR,
+        embed_cache: bool = EMBED_CACHE_ENABLED,
+        nprobe: int = IVF_NPROBE,
+        ef_search: int = HNSW_EF_SEARCH,
+        embedder: Any = None,
+        embed_backend: str = EMBED_BACKEND,
+        mmap: bool = INDEX_MMAP,
+    ):
+        self.embed_model = embed_model
+        self.embed_backend = embed_backend  # torch, onnx or int8 (see app.inference)
+        self.nprobe = nprobe  # IVF query-time knob
+        self.ef_search = ef_search  # HNSW query-time knob
+        self.mmap = mmap  # map the FAISS file on load where supported (see app.ann.read_index)
+        # Any object with SentenceTransformer's encode() works (e.g. the bench's offline embedder)
+        self._embedder = embedder
+        self._embedder_lock = threading.Lock()
+        self.index_dir = index_dir
+        self.embed_cache_dir = os.environ.get("EMBED_CACHE_DIR", os.path.join(index_dir, "embed_cache"))
+        self.use_embed_cache = embed_cache
+        self.current_path = os.path.join(index_dir, CURRENT_FILE)
+        self._current_stat: Optional[Tuple[int, int, int]] = None
+        self._published: Optional[str] = None
+        self._use_dir(index_dir)
+        self.texts: Optional[TextStore] = None
+        self._legacy_docs: Optional[List[str]] = None  # chunk texts from a pre-text-store bm25.json
+        self._source_docs: Dict[str, str] = {}  # joined source text, for metadata without offsets
         self.index = None  # type: ignore
         self.metadata: List[Dict[str, Any]] = []
-        self.bm25 = None
-        self._bm25_docs = None
+        self._pos: Dict[int, int] = {}  # vector id -> row in metadata
+        self.lexical: Optional[LexicalIndex] = None
+        self.reranker = Reranker()  # model loads lazily, once, on first rerank
+        self.extract_report: List[Dict[str, Any]] = []  # per-file timings/failures of last build
+        self.version = ""  # changes whenever a build is written; keys downstream caches
+        self._query_vecs: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._query_lock = threading.Lock()
+        self._ids_by_source: Dict[str, np.ndarray] = {}  # lower-cased file name -> vector ids
+        self._ns_vecs: "OrderedDict[Tuple[str, ...], Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+
+    def _use_dir(self, d: str) -> None:
+        """Point the file paths at one build directory."""
+        self.data_dir = d
+        self.meta_path = os.path.join(d, "metadata.jsonl")
+        self.faiss_path = os.path.join(d, "faiss.index")
+        self.lexical_dir = os.path.join(d, "lexical")
+        self.manifest_path = os.path.join(d, "manifest.json")
+        self.texts_path = os.path.join(d, "texts.bin")
+
+    @property
+    def embedder(self):
+        """The embedding model, loaded (importing sentence-transformers and torch) on first use."""
+        if self._embedder is None:
+            with self._embedder_lock:
+                if self._embedder is None:
+                    self._embedder = load_embedder(self.embed_model, self.embed_backend)
+        return self._embedder
 
     # ---------- Build ----------
-    def build(self, paths: List[str], max_tokens=900, overlap_tokens=180) -> None:
-        ensure_dirs()
-        chunks: List[str] = []
-        metas: List[Dict[str, Any]] = []
+    def build(
+        self,
+        paths: List[str],
+        max_tokens=900,
+        overlap_tokens=180,
+        incremental: bool = False,
+        workers: int = EXTRACT_WORKERS,
+        chunker: str = DEFAULT_CHUNKER,
+        index_type: str = INDEX_TYPE,
+        storage: str = VECTOR_STORAGE,
+    ) -> Dict[str, int]:
+        """
+        Build the index from `paths`. With `incremental=True`, sources whose content hash
+        and chunking parameters match the manifest keep their vectors; only new or changed
+        files are extracted and embedded, and vectors of changed/deleted files are removed.
+        Extraction runs on a pool of `workers` processes (0 = one per CPU). `index_type`
+        selects flat, IVF-Flat, HNSW or IVF-PQ and `storage` their vector format (fp32,
+        fp16 or sq8); changing either, or deleting from an HNSW index, rebuilds the
+        vector index from cached embeddings without re-extracting.
+        The build goes to a new versions/ directory and is published when complete;
+        the live build is never modified.
+        """
+        ensure_dirs(self.index_dir)
+        prev_dir = published_dir(self.index_dir)
+        if incremental and prev_dir:
+            self._use_dir(prev_dir)
+        params = {
+            "embed_model": self.embed_model,
+            "embed_backend": self.embed_backend,  # int8/onnx vectors differ from fp32 ones
+            "max_tokens": max_tokens,
+            "overlap_tokens": overlap_tokens,
+            "chunker": chunker,
+        }
+        index_cfg = index_config(index_type, storage)
+        prev = self._read_manifest() if incremental else None
+        if prev and (prev.get("version") != MANIFEST_VERSION or _build_params(prev) != params):
+            prev = None  # layout, chunking or embedder changed: everything is stale
 
+        index = None
+        old_meta: List[Dict[str, Any]] = []
+        old_docs: List[str] = []
+        if prev:
+            try:
+                index, old_meta, old_docs = self._read_previous()
+            except Exception:
+                prev = None
+        prev_sources: Dict[str, Dict[str, Any]] = prev["sources"] if prev else {}
+        next_id = int(prev["next_id"]) if prev else 0
+
+        # Decide which sources are unchanged (hash match) and which need (re)processing.
+        sources: Dict[str, Dict[str, Any]] = {}
+        todo: List[str] = []
         for path in paths:
-            raw = load_text_from_path(path)
-            if not raw:
+            st = os.stat(path)
+            rec = prev_sources.get(path)
+            if rec and rec["size"] == st.st_size and rec["mtime_ns"] == st.st_mtime_ns:
+                digest = rec["sha256"]
+            else:
+                digest = file_sha256(path)
+            entry = {"sha256": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+            if rec and rec["sha256"] == digest:
+                sources[path] = {**rec, **entry}
+            else:
+                sources[path] = {**entry, "n_chunks": 0}
+                todo.append(path)
+
+        metas: List[Dict[str, Any]] = []
+        chunks: List[str] = []
+        stale_ids: List[int] = []
+        changed = set(todo)
+        for m, doc in zip(old_meta, old_docs):
+            if m["source"] in sources and m["source"] not in changed:
+                metas.append(m)
+                chunks.append(doc)
+            else:
+                stale_ids.append(int(m["id"]))
+        reused = len(metas)
+
+        files_removed = len(set(prev_sources) - set(sources))
+        new_chunks: List[str] = []
+        new_ids: List[int] = []
+        self.extract_report = []
+        for res in extract_many(todo, workers=workers):
+            path = res.path
+            self.extract_report.append({
+                "source": path,
+                "seconds": round(res.seconds, 3),
+                "pages": len(res.pages),
+                "error": res.error,
+                "page_errors": res.page_errors,
+            })
+            if not res.ok:
+                del sources[path]  # not recorded, so the next incremental run retries it
+                continue
+            doc, page_starts = join_pages(res.pages)
+            if not doc:
                 continue
-            chs = chunk_text(raw, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
-            for i, ch in enumerate(chs):
-                chunks.append(ch)
+            spans = _chunk_spans(doc, max_tokens=max_tokens, overlap_tokens=overlap_tokens, chunker=chunker)
+            for i, (c0, c1) in enumerate(spans):
+                new_chunks.append(doc[c0:c1])
+                new_ids.append(next_id)
+                page = bisect_right(page_starts, c0)
                 metas.append({
-                     "source": path,
-                    "source_name": os.path.basename(path),   # <— add
+                    "id": next_id,
+                    "source": path,
+                    "source_name": os.path.basename(path),
                     "chunk_id": i,
-                    # Optional: quick & dirty page guess from chunk index
-                    "page_hint": i + 1
+                    "page_hint": page,
+                    "page_start": page,
+                    "page_end": bisect_right(page_starts, max(c0, c1 - 1)),
+                    "char_start": c0,
+                    "char_end": c1,
                 })
+                next_id += 1
+            sources[path]["n_chunks"] = len(spans)
 
+        chunks.extend(new_chunks)
         if not chunks:
             raise RuntimeError("No text found. Add documents to data/raw/")
 
-        X = self.embedder.encode(chunks, convert_to_numpy=True, normalize_embeddings=True)
-        self.index = faiss.IndexFlatIP(X.shape[1])
-        self.index.add(X.astype(np.float32))
+        if index is not None and (
+            prev.get("index") != index_cfg or (stale_ids and not supports_remove(index))
+        ):
+            index = None  # rebuild from embeddings (mostly embedding-cache hits)
+        rebuilt = index is None
+        cache_stats = {"hits": 0, "misses": 0}
+        if rebuilt:
+            X = self._embed(chunks, cache_stats)
+            index = build_index(X, np.array([m["id"] for m in metas], dtype=np.int64), index_cfg)
+        else:
+            if stale_ids:
+                index.remove_ids(np.array(stale_ids, dtype=np.int64))
+            if new_chunks:
+                X = self._embed(new_chunks, cache_stats)
+                index.add_with_ids(X.astype(np.float32), np.array(new_ids, dtype=np.int64))
+        set_search_params(index, self.nprobe, self.ef_search)
+        self.index = index
         self.metadata = metas
+        self._pos = {int(m["id"]): i for i, m in enumerate(metas)}
+        self._index_sources()
 
-        # Save index + metadata
-        faiss.write_index(self.index, FAISS_PATH)
-        with open(META_PATH, "w", encoding="utf-8") as f:
+        # Save texts, index + metadata into a fresh version directory
+        version = _new_version()
+        self._use_dir(version_dir(self.index_dir, version))
+        ensure_dirs(self.data_dir)
+        if self.texts is not None:
+            self.texts.close()
+        for m, (offset, length) in zip(metas, TextStore.write(self.texts_path, chunks)):
+            m["offset"], m["length"] = offset, length
+        self.texts = TextStore(self.texts_path).open()
+        write_index(self.index, self.faiss_path)
+        with open(self.meta_path, "w", encoding="utf-8") as f:
             for m in metas:
                 f.write(json.dumps(m) + "\n")
 
-        # BM25 for lexical fallback / quick text access
-        tokenized = [c.split() for c in chunks]
-        self.bm25 = BM25Okapi(tokenized)
-        with open(BM25_PATH, "w", encoding="utf-8") as f:
-            json.dump({"docs": chunks}, f)
+        # Inverted index for lexical (BM25) search; replaces the old bm25.json
+        self.lexical = LexicalIndex.build(self.lexical_dir, chunks, [int(m["id"]) for m in metas])
+        legacy_bm25 = os.path.join(self.index_dir, "bm25.json")
+        if os.path.exists(legacy_bm25):
+            os.remove(legacy_bm25)
+
+        # Manifest last: a crash before this point leaves the next run doing a full rebuild
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "params": params,
+            "index": index_cfg,
+            "next_id": next_id,
+            "sources": sources,
+        }
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, self.manifest_path)
+        publish(self.index_dir, version)
+        self.version = version
+        gc_versions(self.index_dir)
+
+        return {
+            "files": len(paths),
+            "files_processed": len(todo),
+            "files_removed": files_removed,
+            "files_failed": sum(1 for r in self.extract_report if r["error"]),
+            "chunks_added": len(new_chunks),
+            "chunks_removed": len(stale_ids),
+            "chunks_reused": reused,
+            "index_rebuilt": int(rebuilt),
+            "embed_cache_hits": cache_stats["hits"],
+            "embed_cache_misses": cache_stats["misses"],
+        }
+
+    def _embed(self, texts: List[str], stats: Optional[Dict[str, int]] = None) -> np.ndarray:
+        """Embed chunk texts, reusing vectors from the on-disk cache where possible."""
+        def encode(xs: List[str]) -> np.ndarray:
+            return self.embedder.encode(xs, convert_to_numpy=True, normalize_embeddings=True)
+
+        if not self.use_embed_cache:
+            return encode(texts)
+        # Quantised backends get their own cache rows; their vectors differ slightly from fp32
+        key = self.embed_model if self.embed_backend == "torch" else f"{self.embed_model}@{self.embed_backend}"
+        cache = EmbeddingCache(key, root=self.embed_cache_dir)
+        X = cache.encode(texts, encode)
+        cache.save()
+        if stats is not None:
+            stats["hits"] += cache.hits
+            stats["misses"] += cache.misses
+        return X
+
+    def _stat_version(self) -> str:
+        """Identity of an unversioned (old layout) index: manifest (or faiss file) mtime and size."""
+        path = self.manifest_path if os.path.exists(self.manifest_path) else self.faiss_path
+        st = os.stat(path)
+        return f"{st.st_mtime_ns}-{st.st_size}"
+
+    def _read_manifest(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.manifest_path):
+            return None
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _read_previous(self):
+        index = faiss.read_index(self.faiss_path)
+        metas = [json.loads(line) for line in open(self.meta_path, "r", encoding="utf-8")]
+        if any("id" not in m or "offset" not in m for m in metas):
+            raise ValueError("Index files are inconsistent")
+        store = TextStore(self.texts_path).open()
+        try:
+            docs = [store.get(m["offset"], m["length"]) for m in metas]
+        finally:
+            store.close()
+        return index, metas, docs
 
     # ---------- Load ----------
     def load(self) -> None:
-        ensure_dirs()
-        if not (os.path.exists(FAISS_PATH) and os.path.exists(META_PATH)):
+        """Load the published build. A loaded RAGIndex is never modified; see reload()."""
+        ensure_dirs(self.index_dir)
+        self.stale()  # records CURRENT's stat for later checks
+        d = published_dir(self.index_dir)
+        if d is None:
             raise FileNotFoundError("Index not found. Run: python -m app.rag --reindex")
+        self._use_dir(d)
+        if not (os.path.exists(self.faiss_path) and os.path.exists(self.meta_path)):
+            raise FileNotFoundError(f"Index files missing in {d}. Run: python -m app.rag --reindex")
+
+        self.version = os.path.basename(d) if d != self.index_dir else self._stat_version()
+        self.index = read_index(self.faiss_path, self.mmap)
+        set_search_params(self.index, self.nprobe, self.ef_search)
+        self.metadata = [json.loads(line) for line in open(self.meta_path, "r", encoding="utf-8")]
+        # Indexes built before ID mapping use the row number as the vector id
+        self._pos = {int(m.get("id", i)): i for i, m in enumerate(self.metadata)}
+        self._index_sources()
+        if os.path.exists(self.texts_path):
+            self.texts = TextStore(self.texts_path).open()
+        else:
+            bm25_path = os.path.join(d, "bm25.json")
+            if os.path.exists(bm25_path):  # built before the text store: serve the stored chunk texts
+                with open(bm25_path, "r", encoding="utf-8") as f:
+                    self._legacy_docs = json.load(f)["docs"]
+            log.warning("Index %s has no chunk text store; run python -m app.rag --reindex", d)
 
-        self.index = faiss.read_index(FAISS_PATH)
-        self.metadata = [json.loads(line) for line in open(META_PATH, "r", encoding="utf-8")]
+        built = _build_params(self._read_manifest() or {})
+        for key, ours in (("embed_model", self.embed_model), ("embed_backend", self.embed_backend)):
+            if built.get(key, ours) != ours:
+                log.warning(
+                    "Index %s was embedded with %s=%s but queries use %s; run python -m app.rag --reindex",
+                    d, key, built[key], ours,
+                )
 
-        if os.path.exists(BM25_PATH):
-            data = json.load(open(BM25_PATH, "r", encoding="utf-8"))
-            tokenized = [d.split() for d in data["docs"]]
-            self.bm25 = BM25Okapi(tokenized)
-            self._bm25_docs = data["docs"]
+        # Arrays are only mapped on the first lexical search
+        self.lexical = LexicalIndex(self.lexical_dir)
+
+    def stale(self) -> bool:
+        """Whether another build has been published since load(); one stat() unless CURRENT changed."""
+        try:
+            st = os.stat(self.current_path)
+        except FileNotFoundError:
+            return False
+        key = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if key != self._current_stat:
+            self._current_stat = key
+            self._published = read_current(self.index_dir)
+        return self._published is not None and self._published != self.version
+
+    def reload(self) -> "RAGIndex":
+        """
+        A new RAGIndex on the published build, sharing this one's models and query
+        cache. Callers swap their reference; queries already running here finish on
+        the old build undisturbed.
+        """
+        new = RAGIndex(
+            self.embed_model, self.index_dir, self.use_embed_cache, self.nprobe, self.ef_search,
+            embedder=self._embedder, embed_backend=self.embed_backend, mmap=self.mmap,
+        )
+        new.reranker = self.reranker  # its score cache is keyed by chunk text, not vector id
+        new._query_vecs, new._query_lock = self._query_vecs, self._query_lock
+        new.load()
+        return new
 
     # ---------- Retrieve ----------
-    def retrieve(self, query: str, k: int = 5, rerank: bool = False) -> List[Dict[str, Any]]:
+    def retrieve(
+        self,
+        query: str,
+        k: int = 5,
+        rerank: bool = False,
+        mode: str = DEFAULT_RETRIEVAL_MODE,
+        pool: Optional[int] = None,
+        weights: Optional[Tuple[float, float]] = None,
+        timings: Optional[Dict[str, float]] = None,
+        sources: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Top-k chunks for `query`. `mode` picks dense, lexical or hybrid candidate
+        generation; hybrid runs both concurrently and fuses them with reciprocal rank
+        fusion using (dense, lexical) `weights`. `pool` is the number of candidates
+        each retriever contributes (and the re-rank depth), independent of `k`.
+        `sources` restricts the search to chunks of those files (matched by file name,
+        see data_store.namespace_sources); an empty selection returns no results.
+        If `timings` is given, it is filled with per-stage seconds: embed, search,
+        rerank and assemble.
+        """
+        return self.retrieve_many([query], k, rerank, mode, pool, weights, timings, sources)[0]
+
+    def retrieve_many(
+        self,
+        queries: List[str],
+        k: int = 5,
+        rerank: bool = False,
+        mode: str = DEFAULT_RETRIEVAL_MODE,
+        pool: Optional[int] = None,
+        weights: Optional[Tuple[float, float]] = None,
+        timings: Optional[Dict[str, float]] = None,
+        sources: Optional[List[str]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        retrieve() for several queries at once: one batched encode and one FAISS
+        search cover all of them. Returns one result list per query; `timings` are
+        summed over the batch.
+        """
+        t = timings if timings is not None else {}
+        for stage in ("embed", "search", "rerank", "assemble"):
+            t[stage] = 0.0
         assert self.index is not None, "Index not loaded. Call load() first."
-        q = self.embedder.encode([query], convert_to_numpy=True, normalize_embeddings=True).astype(np.float32)
-        scores, idxs = self.index.search(q, k)
-        idxs = idxs[0]
-        scores = scores[0]
-
-        docs = self._bm25_docs  # may be None if BM25 not loaded
-        results: List[Dict[str, Any]] = []
-
-        for rank, (i, s) in enumerate(zip(idxs, scores), start=1):
-            meta = self.metadata[int(i)]
-            text = docs[int(i)] if docs else ""
-
-            if not text:
-                # Fallback: re-read source and re-chunk, then pick chunk_id
-                raw = load_text_from_path(meta["source"]) or ""
-                chs = chunk_text(raw)
-                text = chs[meta["chunk_id"]] if meta["chunk_id"] < len(chs) else raw[:1200]
-
-            results.append(
-                {
-                    "rank": rank,
-                    "score": float(s),
-                    "text": text,
-                    "source": meta["source"],
-                    "chunk_id": meta["chunk_id"],
-                }
-            )
-
-        # Optional cross-encoder re-rank
-        if rerank and len(results) > 1:
-            try:
-                ce = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
-                pairs = [(query, r["text"]) for r in results]
-                rr = ce.predict(pairs)
-                for r, sc in zip(results, rr):
-                    r["rerank_score"] = float(sc)
-                results.sort(key=lambda x: x.get("rerank_score", 0.0), reverse=True)
-            except Exception:
-                pass
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {mode!r}; expected one of {RETRIEVAL_MODES}")
+        if mode != "dense" and (self.lexical is None or not self.lexical.exists()):
+            mode = "dense"  # index built before the inverted index existed
+        n = max(k, pool or CANDIDATE_POOL) if (mode == "hybrid" or rerank) else k
+        depth = n if rerank else k
+        ns = None
+        if sources is not None:
+            ns = tuple(sorted({os.path.basename(s).lower() for s in sources}))
+            if not ns or not len(self.namespace_ids(ns)):
+                return [[] for _ in queries]
+
+        extras: List[Dict[int, Dict[str, float]]] = [{} for _ in queries]
+        if mode == "dense":
+            all_cands = self._dense_search_many(queries, n, t, ns)
+        elif mode == "lexical":
+            t0 = time.perf_counter()
+            all_cands = [self.lexical.search(q, n, self._allowed(ns)) for q in queries]
+            t["search"] += time.perf_counter() - t0
+        else:
+            allowed = self._allowed(ns)
+            lex_futures = [_LEXICAL_POOL.submit(self.lexical.search, q, n, allowed) for q in queries]
+            dense_all = self._dense_search_many(queries, n, t, ns)
+            t0 = time.perf_counter()
+            lexical_all = [f.result() for f in lex_futures]
+            t["search"] += time.perf_counter() - t0  # only the part not hidden behind dense
+            w = weights or (HYBRID_DENSE_WEIGHT, HYBRID_LEXICAL_WEIGHT)
+            all_cands = []
+            for dense, lexical, ex in zip(dense_all, lexical_all, extras):
+                all_cands.append(reciprocal_rank_fusion([dense, lexical], list(w)))
+                for vid, s in dense:
+                    ex.setdefault(vid, {})["dense_score"] = s
+                for vid, s in lexical:
+                    ex.setdefault(vid, {})["lexical_score"] = s
+
+        out: List[List[Dict[str, Any]]] = []
+        for query, cands, ex in zip(queries, all_cands, extras):
+            t0 = time.perf_counter()
+            results: List[Dict[str, Any]] = []
+            for vid, s in cands[:depth]:
+                r = self._result(vid, s, rank=len(results) + 1)
+                r.update(ex.get(vid, {}))
+                results.append(r)
+            t["assemble"] += time.perf_counter() - t0
+
+            # Optional cross-encoder re-rank (keeps retrieval order if over budget/unavailable)
+            if rerank and len(results) > 1:
+                t0 = time.perf_counter()
+                self.reranker.rerank(query, results)
+                t["rerank"] += time.perf_counter() - t0
+            results = results[:k]
+
+            # Add simple citation id
+            for i, r in enumerate(results, start=1):
+                r["cite_id"] = f"[{i}]"
+            out.append(results)
+        return out
+
+    def _dense_search_many(
+        self,
+        queries: List[str],
+        n: int,
+        timings: Optional[Dict[str, float]] = None,
+        ns: Optional[Tuple[str, ...]] = None,
+    ) -> List[List[Tuple[int, float]]]:
+        t0 = time.perf_counter()
+        Q = self.embed_queries(queries)
+        t1 = time.perf_counter()
+        if ns is None:
+            scores, idxs = self.index.search(Q, n)
+        else:
+            scores, idxs = self._namespace_search(Q, n, ns)
+        if timings is not None:
+            timings["embed"] = timings.get("embed", 0.0) + t1 - t0
+            timings["search"] = timings.get("search", 0.0) + time.perf_counter() - t1
+        # -1 ids pad the result when the index holds fewer than n vectors
+        return [[(int(i), float(s)) for i, s in zip(ir, sr) if i >= 0] for ir, sr in zip(idxs, scores)]
+
+    # ---------- Namespaces ----------
+    def _index_sources(self) -> None:
+        by_name: Dict[str, List[int]] = {}
+        for i, m in enumerate(self.metadata):
+            by_name.setdefault(os.path.basename(m["source"]).lower(), []).append(int(m.get("id", i)))
+        self._ids_by_source = {name: np.asarray(ids, dtype=np.int64) for name, ids in by_name.items()}
+        self._ns_vecs.clear()
+
+    def namespace_ids(self, ns: Tuple[str, ...]) -> np.ndarray:
+        """Vector ids of all chunks from the files named in `ns`."""
+        parts = [self._ids_by_source[name] for name in ns if name in self._ids_by_source]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    def _allowed(self, ns: Optional[Tuple[str, ...]]) -> Optional[np.ndarray]:
+        return None if ns is None else self.namespace_ids(ns)
+
+    def _namespace_search(self, Q: np.ndarray, n: int, ns: Tuple[str, ...]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Search only the chunks in `ns` for each row of `Q`. Small namespaces are scanned
+        exactly over their own vectors (fetched once from the index, then cached); large
+        ones go through the main index with an ID selector.
+        """
+        with self._query_lock:
+            entry = self._ns_vecs.get(ns)
+            if entry is not None:
+                self._ns_vecs.move_to_end(ns)
+        if entry is None:
+            ids = self.namespace_ids(ns)
+            if len(ids) > NAMESPACE_EXACT_MAX:
+                return self.index.search(Q, n, params=filtered_params(self.index, ids, self.nprobe, self.ef_search))
+            entry = (ids, reconstruct_ids(self.index, ids))
+            with self._query_lock:
+                self._ns_vecs[ns] = entry
+                while len(self._ns_vecs) > NAMESPACE_CACHE_SIZE:
+                    self._ns_vecs.popitem(last=False)
+        ids, X = entry
+        sims = Q @ X.T
+        if sims.shape[1] > n:
+            top = np.argpartition(-sims, n - 1, axis=1)[:, :n]
+        else:
+            top = np.broadcast_to(np.arange(sims.shape[1]), sims.shape)
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(sims, top, 1), axis=1, kind="stable"), 1)
+        return np.take_along_axis(sims, top, 1), ids[top]
+
+    @property
+    def embed_service(self) -> EmbedService:
+        """The process-wide micro-batcher for this index's embedder (see app.embed_service)."""
+        return get_service(self.embedder)
 
-        # Add simple citation id
+    def embed_query(self, query: str) -> np.ndarray:
+        """Normalised float32 embedding of `query`; recent queries are served from an LRU."""
+        return self.embed_queries([query])[0]
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """(len(queries), dim) embeddings; LRU misses are encoded together via the embed service."""
+        vecs: Dict[str, np.ndarray] = {}
+        with self._query_lock:
+            for q in queries:
+                v = self._query_vecs.get(q)
+                if v is not None:
+                    self._query_vecs.move_to_end(q)
+                    vecs[q] = v
+        misses = [q for q in dict.fromkeys(queries) if q not in vecs]
+        if misses:
+            X = self.embed_service.encode(misses)
+            with self._query_lock:
+                for q, v in zip(misses, X):
+                    vecs[q] = self._query_vecs[q] = v
+                while len(self._query_vecs) > QUERY_CACHE_SIZE:
+                    self._query_vecs.popitem(last=False)
+        return np.stack([vecs[q] for q in queries])
+
+    def clear_query_cache(self) -> None:
+        """Forget cached query embeddings (e.g. between benchmark runs)."""
+        with self._query_lock:
+            self._query_vecs.clear()
+
+    def lexical_search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """BM25 search over the persisted inverted index (no embedding involved)."""
+        assert self.lexical is not None, "Index not loaded. Call load() first."
+        results = [
+            self._result(vid, score, rank=rank)
+            for rank, (vid, score) in enumerate(self.lexical.search(query, k), start=1)
+        ]
         for i, r in enumerate(results, start=1):
             r["cite_id"] = f"[{i}]"
         return results
 
+    def _result(self, vid: int, score: float, rank: int) -> Dict[str, Any]:
+        pos = self._pos[vid]
+        meta = self.metadata[pos]
+        return {
+            "id": vid,
+            "rank": rank,
+            "score": score,
+            "text": self._chunk_text(meta, pos),
+            "source": meta["source"],
+            "chunk_id": meta["chunk_id"],
+            "page": meta.get("page_start"),
+            "page_end": meta.get("page_end"),
+            "char_start": meta.get("char_start"),
+            "char_end": meta.get("char_end"),
+        }
+
+    def _chunk_text(self, meta: Dict[str, Any], pos: int) -> str:
+        if self.texts is not None and "offset" in meta:
+            return self.texts.get(meta["offset"], meta["length"])
+        if self._legacy_docs is not None and pos < len(self._legacy_docs):
+            return self._legacy_docs[pos]
+        # Fallback: re-read the source once and slice (or re-chunk old metadata the way it was built)
+        doc = self._source_docs.get(meta["source"])
+        if doc is None:
+            doc = self._source_docs[meta["source"]] = join_pages(extract_pages(meta["source"]).pages)[0]
+        if "char_start" in meta:
+            return doc[meta["char_start"]:meta["char_end"]]
+        spans = _chunk_spans(doc, chunker="legacy")
+        if meta["chunk_id"] < len(spans):
+            a, b = spans[meta["chunk_id"]]
+            return doc[a:b]
+        return doc[:1200]
+
 
 # ---------- CLI ----------
-def _reindex():
+def _reindex(
+    incremental: bool = False,
+    embed_cache: bool = EMBED_CACHE_ENABLED,
+    workers: int = EXTRACT_WORKERS,
+    chunker: str = DEFAULT_CHUNKER,
+    index_type: str = INDEX_TYPE,
+    storage: str = VECTOR_STORAGE,
+):
     ensure_dirs()
     paths = glob_docs("data/raw")
-    idx = RAGIndex()
-    idx.build(paths)
-    print(f"Indexed {len(idx.metadata)} chunks from {len(paths)} files → {FAISS_PATH}")
+    idx = RAGIndex(embed_cache=embed_cache)
+    stats = idx.build(
+        paths, incremental=incremental, workers=workers, chunker=chunker, index_type=index_type, storage=storage
+    )
+    print(f"Indexed {len(idx.metadata)} chunks from {len(paths)} files → {idx.data_dir} ({index_type}, {storage})")
+    report = idx.extract_report
+    if report:
+        total = sum(r["seconds"] for r in report)
+        print(f"  extracted {len(report)} files in {total:.1f}s CPU")
+        for r in sorted(report, key=lambda r: r["seconds"], reverse=True)[:5]:
+            print(f"    {r['seconds']:7.2f}s  {r['pages']:4d} pages  {r['source']}")
+        for r in report:
+            if r["error"]:
+                print(f"  FAILED {r['source']}: {r['error']}")
+            for page_no, err in r["page_errors"]:
+                print(f"  page {page_no} of {r['source']} failed: {err}")
+    if embed_cache:
+        print(
+            f"  embedding cache: {stats['embed_cache_hits']} hits, "
+            f"{stats['embed_cache_misses']} embedded"
+        )
+    if incremental:
+        print(
+            f"  processed {stats['files_processed']} new/changed files, "
+            f"removed {stats['files_removed']} deleted files; "
+            f"chunks +{stats['chunks_added']} -{stats['chunks_removed']} "
+            f"(reused {stats['chunks_reused']})"
+        )
 
 
-def _test(query: str, k: int = 5):
-    idx = RAGIndex()
+def _test(
+    query: str,
+    k: int = 5,
+    mode: str = DEFAULT_RETRIEVAL_MODE,
+    pool: Optional[int] = None,
+    rerank: bool = False,
+    nprobe: int = IVF_NPROBE,
+    ef_search: int = HNSW_EF_SEARCH,
+):
+    idx = RAGIndex(nprobe=nprobe, ef_search=ef_search)
     idx.load()
-    res = idx.retrieve(query, k=k)
+    if rerank:
+        idx.reranker.warm_up()
+    res = idx.retrieve(query, k=k, mode=mode, pool=pool, rerank=rerank)
     for r in res:
-        print(r["cite_id"], r["source"], f"(chunk {r['chunk_id']})", "score=", round(r["score"], 3))
+        extra = f" rerank={r['rerank_score']:.3f}" if "rerank_score" in r else ""
+        print(r["cite_id"], r["source"], f"(chunk {r['chunk_id']}, p. {r['page']})", "score=", round(r["score"], 3), extra)
         print(r["text"][:200].replace("\n", " "), "...\n")
 
 
+def _ann_report(k: int = 10, queries_path: str = "", n_queries: int = 200, kinds: Optional[List[str]] = None):
+    """Recall@k vs latency of each index type against the flat baseline, on the current corpus."""
+    idx = RAGIndex()
+    idx.load()
+    texts = [idx._chunk_text(m, i) for i, m in enumerate(idx.metadata)]
+    X = idx._embed(texts)
+    if queries_path:
+        with open(queries_path, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        # Short pseudo-queries: the opening words of randomly sampled chunks
+        rng = np.random.default_rng(0)
+        picks = rng.choice(len(texts), min(n_queries, len(texts)), replace=False)
+        queries = [" ".join(texts[i].split()[:12]) for i in picks]
+    Q = idx.embedder.encode(queries, convert_to_numpy=True, normalize_embeddings=True)
+    rows = recall_latency_report(X, Q, k=k, kinds=kinds, storages=STORAGES)
+    print(f"{len(X)} vectors, {len(Q)} queries, recall@{min(k, len(X))} vs flat")
+    print(f"{'type':6} {'storage':>7} {'knob':>14} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'build s':>8} {'MB':>7}")
+    for r in rows:
+        knob = f"nprobe={r['nprobe']}" if "nprobe" in r else f"efSearch={r['ef_search']}" if "ef_search" in r else "-"
+        print(
+            f"{r['type']:6} {r['storage']:>7} {knob:>14} {r['recall']:7.3f} {r['p50_ms']:8.3f} "
+            f"{r['p95_ms']:8.3f} {r['build_s']:8.2f} {r['size_mb']:7.2f}"
+        )
+
+
+def _memory_probe(mmap: bool, n_queries: int = 200) -> Dict[str, Any]:
+    """Memory of this process before and after loading the index and running searches."""
+    from app.bench import memory_mb
+
+    before = memory_mb()
+    idx = RAGIndex(mmap=mmap)
+    idx.load()
+    loaded = memory_mb()
+    Q = np.random.default_rng(0).standard_normal((n_queries, idx.index.d)).astype(np.float32)
+    for i in range(n_queries):  # touch pages the way queries do (no embedder needed)
+        idx.index.search(Q[i : i + 1], 10)
+    return {"before": before, "loaded": loaded, "searched": memory_mb(), "index": type(idx.index).__name__}
+
+
+def _memory_report():
+    """Per-worker memory of heap vs memory-mapped index loading, each in a fresh process."""
+    import subprocess, sys
+
+    d = published_dir(INDEX_DIR)
+    if d is None:
+        raise SystemExit("Index not found. Run: python -m app.rag --reindex")
+    idx = RAGIndex()
+    idx._use_dir(d)
+    cfg = (idx._read_manifest() or {}).get("index", {})
+    print(
+        f"{idx.faiss_path}: {os.path.getsize(idx.faiss_path) / 1e6:.1f} MB "
+        f"({cfg.get('type', '?')}, {cfg.get('storage', 'fp32')})"
+    )
+    print(f"{'load':6} {'index':>24} {'RSS +MB':>9} {'heap +MB':>9} {'heap after search':>18}")
+    for mode in ("heap", "mmap"):
+        out = subprocess.run(
+            [sys.executable, "-m", "app.rag", "--memory-probe", mode], capture_output=True, text=True, check=True
+        ).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        b, l, s = r["before"], r["loaded"], r["searched"]
+        print(
+            f"{mode:6} {r['index']:>24} {l['rss'] - b['rss']:9.1f} {l['anon'] - b['anon']:9.1f} "
+            f"{s['anon'] - b['anon']:18.1f}"
+        )
+    print("heap = anonymous memory each worker pays for; mapped index pages live once in the page cache")
+
+
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("--reindex", action="store_true")
+    ap.add_argument("--incremental", action="store_true",
+                    help="with --reindex: only embed new/changed files, drop deleted ones")
+    ap.add_argument("--no-embed-cache", action="store_true",
+                    help="with --reindex: embed every chunk, bypassing the on-disk cache")
+    ap.add_argument("--workers", type=int, default=EXTRACT_WORKERS,
+                    help="with --reindex: extraction processes (0 = one per CPU)")
+    ap.add_argument("--chunker", choices=CHUNKERS, default=DEFAULT_CHUNKER,
+                    help="with --reindex: chunking strategy")
+    ap.add_argument("--index-type", choices=INDEX_TYPES, default=INDEX_TYPE,
+                    help="with --reindex: flat (exact), ivf, hnsw or ivfpq")
+    ap.add_argument("--storage", choices=STORAGES, default=VECTOR_STORAGE,
+                    help="with --reindex: stored vector format (fp32, fp16 or int8 scalar-quantised sq8)")
+    ap.add_argument("--memory-report", action="store_true",
+                    help="per-worker memory of loading the index into the heap vs memory-mapped")
+    ap.add_argument("--memory-probe", choices=("heap", "mmap"), help=argparse.SUPPRESS)
+    ap.add_argument("--versions", action="store_true", help="list index builds (* = published)")
+    ap.add_argument("--publish", type=str, default="", metavar="VERSION",
+                    help="publish an existing build, e.g. to roll back")
     ap.add_argument("--test", type=str, default="")
     ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--mode", choices=RETRIEVAL_MODES, default=DEFAULT_RETRIEVAL_MODE,
+                    help="with --test: dense, lexical or hybrid retrieval")
+    ap.add_argument("--rerank", action="store_true", help="with --test: cross-encoder re-rank")
+    ap.add_argument("--pool", type=int, default=None,
+                    help=f"with --test: candidates per retriever (default {CANDIDATE_POOL})")
+    ap.add_argument("--nprobe", type=int, default=IVF_NPROBE, help="IVF lists probed per query")
+    ap.add_argument("--ef-search", type=int, default=HNSW_EF_SEARCH, help="HNSW search breadth")
+    ap.add_argument("--ann-report", action="store_true",
+                    help="recall-vs-latency of each index type against flat on the current corpus")
+    ap.add_argument("--queries", type=str, default="",
+                    help="with --ann-report: file with one query per line (default: sampled chunks)")
+    ap.add_argument("--bench", action="store_true",
+                    help="retrieval quality/latency benchmark (offline synthetic corpus by default)")
+    ap.add_argument("--bench-docs", type=str, default="", help="with --bench: real corpus directory")
+    ap.add_argument("--bench-queries", type=str, default="",
+                    help="with --bench: JSONL queries with expected_sources / expected_chunks")
+    ap.add_argument("--bench-n-docs", type=int, default=200, help="with --bench: synthetic corpus size")
+    ap.add_argument("--bench-embedder", type=str, default="hash",
+                    help="with --bench: 'hash' (offline) or a sentence-transformers model name")
+    ap.add_argument("--bench-json", type=str, default="", help="with --bench: also write the report here")
     args = ap.parse_args()
 
     if args.reindex:
-        _reindex()
+        _reindex(
+            incremental=args.incremental,
+            embed_cache=EMBED_CACHE_ENABLED and not args.no_embed_cache,
+            workers=args.workers,
+            chunker=args.chunker,
+            index_type=args.index_type,
+            storage=args.storage,
+        )
+    elif args.bench:
+        from app.bench import run_bench
+
+        run_bench(
+            docs_dir=args.bench_docs,
+            queries_path=args.bench_queries,
+            k=args.k,
+            rerank=args.rerank,
+            n_docs=args.bench_n_docs,
+            embedder=args.bench_embedder,
+            index_type=args.index_type,
+            out_json=args.bench_json,
+        )
+    elif args.ann_report:
+        _ann_report(k=args.k, queries_path=args.queries)
+    elif args.versions:
+        live = read_current(INDEX_DIR)
+        for v in list_versions(INDEX_DIR):
+            complete = os.path.exists(os.path.join(version_dir(INDEX_DIR, v), "manifest.json"))
+            print(("* " if v == live else "  ") + v + ("" if complete else "  (incomplete)"))
+    elif args.publish:
+        publish(INDEX_DIR, args.publish)
+        print(f"Published {args.publish}")
+    elif args.memory_report:
+        _memory_report()
+    elif args.memory_probe:
+        print(json.dumps(_memory_probe(args.memory_probe == "mmap")))
     elif args.test:
-        _test(args.test, k=args.k)
+        _test(
+            args.test, k=args.k, mode=args.mode, pool=args.pool, rerank=args.rerank,
+            nprobe=args.nprobe, ef_search=args.ef_search,
+        )
     else:
         ap.print_help()
@@ -0,0 +1,127 @@
+# app/reranker.py
+from __future__ import annotations
+import os, time, hashlib, logging, threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from app.inference import RERANK_BACKEND, load_cross_encoder
+
+log = logging.getLogger(__name__)
+
+RERANK_MODEL = os.environ.get("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_BATCH_SIZE = int(os.environ.get("RERANK_BATCH_SIZE", 16))
+RERANK_CACHE_SIZE = int(os.environ.get("RERANK_CACHE_SIZE", 4096))
+RERANK_BUDGET_MS = float(os.environ.get("RERANK_BUDGET_MS", 300))  # <= 0 disables the budget
+
+
+class Reranker:
+    """
+    Long-lived cross-encoder reranker. The model is loaded once, in the background on
+    first use; pairs are scored in batches; scores are kept in a bounded LRU keyed by
+    (query, chunk text hash), so they stay valid across index builds that renumber ids. If the model is not ready, fails, or scoring runs past the latency
+    budget, `rerank` leaves the candidate order untouched.
+    """
+
+    def __init__(
+        self,
+        model_name: str = RERANK_MODEL,
+        batch_size: int = RERANK_BATCH_SIZE,
+        cache_size: int = RERANK_CACHE_SIZE,
+        budget_ms: float = RERANK_BUDGET_MS,
+        backend: str = RERANK_BACKEND,
+    ):
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = max(1, batch_size)
+        self.cache_size = cache_size
+        self.budget_ms = budget_ms
+        self._model = None
+        self._error: Optional[str] = None
+        self._loading = False
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, bytes], float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    # ---------- Model ----------
+    def _load(self) -> None:
+        try:
+            model = load_cross_encoder(self.model_name, self.backend)
+            with self._lock:
+                self._model = model
+        except Exception as e:
+            log.warning("Reranker %s failed to load: %s", self.model_name, e)
+            with self._lock:
+                self._error = f"{type(e).__name__}: {e}"
+        finally:
+            with self._lock:
+                self._loading = False
+
+    def warm_up(self, wait: bool = True) -> bool:
+        """Start loading the model (once); with `wait`, block until it is ready."""
+        with self._lock:
+            start = self._model is None and self._error is None and not self._loading
+            if start:
+                self._loading = True
+        if start:
+            if wait:
+                self._load()
+            else:
+                threading.Thread(target=self._load, name="reranker-load", daemon=True).start()
+        elif wait:
+            while self._loading:
+                time.sleep(0.05)
+        return self.ready
+
+    @property
+    def ready(self) -> bool:
+        return self._model is not None
+
+    # ---------- Scoring ----------
+    @staticmethod
+    def _text_key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def rerank(self, query: str, results: List[Dict[str, Any]]) -> bool:
+        """
+        Score `results` against `query` and sort them in place by "rerank_score".
+        Returns False, leaving the order unchanged, when the model is unavailable or
+        the budget is exceeded.
+        """
+        if not self.warm_up(wait=False):
+            return False
+        t0 = time.perf_counter()
+        scores: Dict[int, float] = {}
+        todo: List[int] = []
+        keys = [(query, self._text_key(r["text"])) for r in results]
+        with self._cache_lock:
+            for i, ck in enumerate(keys):
+                if ck in self._cache:
+                    self._cache.move_to_end(ck)
+                    scores[i] = self._cache[ck]
+                else:
+                    todo.append(i)
+
+        for b in range(0, len(todo), self.batch_size):
+            if self.budget_ms > 0 and (time.perf_counter() - t0) * 1000 > self.budget_ms:
+                log.info("Rerank budget of %.0f ms exceeded; keeping retrieval order", self.budget_ms)
+                return False
+            batch = todo[b : b + self.batch_size]
+            try:
+                out = self._model.predict([(query, results[i]["text"]) for i in batch], batch_size=self.batch_size)
+            except Exception as e:
+                log.warning("Rerank failed: %s", e)
+                return False
+            with self._cache_lock:
+                for i, sc in zip(batch, out):
+                    scores[i] = float(sc)
+                    self._cache[keys[i]] = float(sc)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        for i, r in enumerate(results):
+            r["rerank_score"] = scores[i]
+        results.sort(key=lambda x: x["rerank_score"], reverse=True)
+        return True
+
+    def clear(self) -> None:
+        with self._cache_lock:
+            self._cache.clear()
@@ -0,0 +1,291 @@
+# app/retrieval_server.py
+"""
+Retrieval as a local service shared by every Streamlit worker on a host.
+
+One process owns the embedder, FAISS index, inverted index and reranker; UI workers
+talk to it over keep-alive HTTP instead of each loading their own copy:
+
+    python -m app.retrieval_server --port 8765          # make retrieval-server
+    RETRIEVAL_URL=http://127.0.0.1:8765 streamlit run app/main.py
+
+JSON endpoints: GET /health, POST /retrieve, /retrieve_many, /embed, /namespace.
+Requests are read by an asyncio loop; retrieval runs on a thread pool, where
+concurrent query encodes are micro-batched by app.embed_service.
+
+RetrievalClient mirrors the parts of RAGIndex the app uses. When the service is
+down, `available()` turns False (rechecked every RETRIEVAL_RETRY_S) and the app
+falls back to its in-process index.
+"""
+from __future__ import annotations
+import os, json, time, socket, asyncio, logging, argparse, threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+RETRIEVAL_URL = os.environ.get("RETRIEVAL_URL", "")  # empty = retrieve in-process
+RETRIEVAL_TIMEOUT_S = float(os.environ.get("RETRIEVAL_TIMEOUT_S", 15))
+RETRIEVAL_RETRY_S = float(os.environ.get("RETRIEVAL_RETRY_S", 30))  # wait before retrying a down service
+RETRIEVAL_WORKERS = int(os.environ.get("RETRIEVAL_WORKERS", 8))
+MAX_BODY_BYTES = 1 << 20
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class RetrievalUnavailable(RuntimeError):
+    """The retrieval service could not be reached."""
+
+
+def _jsonable(o: Any) -> Any:
+    if isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    raise TypeError(f"{type(o).__name__} is not JSON serializable")
+
+
+# ---------- Server ----------
+class RetrievalServer:
+    """
+    HTTP/1.1 front end for a RAGIndex. `get_index` is called once per request (e.g.
+    WARMUP.index), so a newly published build is picked up without a restart.
+    """
+
+    def __init__(self, get_index: Callable[[], Any], workers: int = RETRIEVAL_WORKERS):
+        self.get_index = get_index
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="retrieval")
+        self.routes = {
+            ("GET", "/health"): self._health,
+            ("POST", "/retrieve"): self._retrieve,
+            ("POST", "/retrieve_many"): self._retrieve_many,
+            ("POST", "/embed"): self._embed,
+            ("POST", "/namespace"): self._namespace,
+        }
+
+    # ---------- Handlers (run on the pool) ----------
+    def _health(self, _: Dict[str, Any]) -> Dict[str, Any]:
+        idx = self.get_index()
+        return {"status": "ok", "version": idx.version, "chunks": len(idx.metadata), "pid": os.getpid()}
+
+    @staticmethod
+    def _opts(p: Dict[str, Any]) -> Dict[str, Any]:
+        opts = {key: p[key] for key in ("k", "rerank", "mode", "pool", "sources") if p.get(key) is not None}
+        if p.get("weights"):
+            opts["weights"] = tuple(p["weights"])
+        return opts
+
+    def _retrieve(self, p: Dict[str, Any]) -> Dict[str, Any]:
+        idx, timings = self.get_index(), {}
+        results = idx.retrieve(p["query"], timings=timings, **self._opts(p))
+        return {"results": results, "timings": timings, "version": idx.version}
+
+    def _retrieve_many(self, p: Dict[str, Any]) -> Dict[str, Any]:
+        idx, timings = self.get_index(), {}
+        results = idx.retrieve_many(p["queries"], timings=timings, **self._opts(p))
+        return {"results": results, "timings": timings, "version": idx.version}
+
+    def _embed(self, p: Dict[str, Any]) -> Dict[str, Any]:
+        idx = self.get_index()
+        return {"vectors": idx.embed_queries(p["queries"]), "version": idx.version}
+
+    def _namespace(self, p: Dict[str, Any]) -> Dict[str, Any]:
+        idx = self.get_index()
+        return {"ids": idx.namespace_ids(tuple(p["sources"])), "version": idx.version}
+
+    # ---------- Protocol ----------
+    async def _dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, Dict[str, Any]]:
+        fn = self.routes.get((method, path.split("?", 1)[0]))
+        if fn is None:
+            return 404, {"error": f"No route {method} {path}"}
+        try:
+            payload = json.loads(body) if body else {}
+            out = await asyncio.get_running_loop().run_in_executor(self.pool, fn, payload)
+            return 200, out
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {"error": f"{type(e).__name__}: {e}"}
+        except Exception as e:
+            log.exception("%s %s failed", method, path)
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, path, _ = line.decode("latin-1").split(" ", 2)
+                headers: Dict[str, str] = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = h.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                n = int(headers.get("content-length", 0))
+                if n > MAX_BODY_BYTES:
+                    status, out, keep = 413, {"error": f"Body over {MAX_BODY_BYTES} bytes"}, False
+                else:
+                    status, out = await self._dispatch(method, path, await reader.readexactly(n) if n else b"")
+                    keep = headers.get("connection", "").lower() != "close"
+                data = json.dumps(out, default=_jsonable).encode("utf-8")
+                head = (
+                    f"HTTP/1.1 {status} {_REASONS[status]}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n" + ("" if keep else "Connection: close\r\n") + "\r\n"
+                )
+                writer.write(head.encode("latin-1") + data)
+                await writer.drain()
+                if not keep:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # client went away or sent garbage
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        server = await asyncio.start_server(self.handle, host, port)
+        log.info("Retrieval server on %s", ", ".join(str(s.getsockname()) for s in server.sockets))
+        async with server:
+            await server.serve_forever()
+
+
+# ---------- Client ----------
+class RetrievalClient:
+    """
+    RAGIndex look-alike backed by the retrieval server: retrieve, retrieve_many,
+    embed_query, namespace_ids and version. One keep-alive connection per thread.
+    """
+
+    def __init__(self, url: str = RETRIEVAL_URL, timeout: float = RETRIEVAL_TIMEOUT_S):
+        u = urlsplit(url)
+        self.host, self.port, self.prefix = u.hostname or "127.0.0.1", u.port or 80, u.path.rstrip("/")
+        self.timeout = timeout
+        self.version = ""
+        self._local = threading.local()
+        self._down_until = 0.0
+        self._checked = False
+
+    def _conn(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def _drop(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+        self._local.conn = None
+
+    def _call(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        body = json.dumps(payload, default=_jsonable).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in range(2):
+            conn = self._conn()
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+                break
+            except (socket.timeout, TimeoutError) as e:
+                self._drop()
+                self._mark_down()
+                raise RetrievalUnavailable(f"Retrieval service timed out after {self.timeout:.0f}s") from e
+            except (OSError, http.client.HTTPException) as e:
+                self._drop()  # a keep-alive connection the server closed: reconnect once
+                if attempt:
+                    self._mark_down()
+                    raise RetrievalUnavailable(f"Retrieval service at {self.host}:{self.port}: {e}") from e
+        out = json.loads(data)
+        if resp.status != 200:
+            raise RuntimeError(out.get("error") or f"Retrieval service returned {resp.status}")
+        self.version = out.get("version", self.version)
+        return out
+
+    def _mark_down(self) -> None:
+        self._down_until = time.monotonic() + RETRIEVAL_RETRY_S
+        self._checked = False
+
+    def available(self) -> bool:
+        """Whether to use the service; a failed check is not repeated for RETRIEVAL_RETRY_S."""
+        if time.monotonic() < self._down_until:
+            return False
+        if not self._checked:
+            try:
+                self.health()
+            except (RetrievalUnavailable, RuntimeError, ValueError) as e:
+                log.warning("Retrieval service unavailable: %s", e)
+                self._mark_down()
+                return False
+            self._checked = True
+        return True
+
+    def health(self) -> Dict[str, Any]:
+        return self._call("GET", "/health")
+
+    @staticmethod
+    def _payload(k, rerank, mode, pool, weights, sources) -> Dict[str, Any]:
+        return {"k": k, "rerank": rerank, "mode": mode, "pool": pool, "weights": weights, "sources": sources}
+
+    def retrieve(
+        self,
+        query: str,
+        k: int = 5,
+        rerank: bool = False,
+        mode: Optional[str] = None,
+        pool: Optional[int] = None,
+        weights: Optional[Tuple[float, float]] = None,
+        timings: Optional[Dict[str, float]] = None,
+        sources: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        out = self._call("POST", "/retrieve", {"query": query, **self._payload(k, rerank, mode, pool, weights, sources)})
+        if timings is not None:
+            timings.update(out["timings"])
+        return out["results"]
+
+    def retrieve_many(
+        self,
+        queries: List[str],
+        k: int = 5,
+        rerank: bool = False,
+        mode: Optional[str] = None,
+        pool: Optional[int] = None,
+        weights: Optional[Tuple[float, float]] = None,
+        timings: Optional[Dict[str, float]] = None,
+        sources: Optional[List[str]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        payload = {"queries": queries, **self._payload(k, rerank, mode, pool, weights, sources)}
+        out = self._call("POST", "/retrieve_many", payload)
+        if timings is not None:
+            timings.update(out["timings"])
+        return out["results"]
+
+    def embed_query(self, query: str) -> np.ndarray:
+        return np.asarray(self._call("POST", "/embed", {"queries": [query]})["vectors"][0], dtype=np.float32)
+
+    def namespace_ids(self, ns: Tuple[str, ...]) -> np.ndarray:
+        return np.asarray(self._call("POST", "/namespace", {"sources": list(ns)})["ids"], dtype=np.int64)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Serve one RAG index to all app workers on this host.")
+    ap.add_argument("--host", default=os.environ.get("RETRIEVAL_HOST", "127.0.0.1"))
+    ap.add_argument("--port", type=int, default=int(os.environ.get("RETRIEVAL_PORT", 8765)))
+    ap.add_argument("--workers", type=int, default=RETRIEVAL_WORKERS, help="retrieval threads")
+    ap.add_argument("--rerank", action="store_true", help="load the cross-encoder up front")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    logging.getLogger("faiss").setLevel(logging.WARNING)  # CPU-feature probing noise
+
+    from app.warmup import WARMUP
+
+    WARMUP.start(rerank=args.rerank)
+    WARMUP.index()
+    for stage, s in WARMUP.timings.items():
+        log.info("%-40s %9.1f ms", stage, s * 1000)
+    try:
+        asyncio.run(RetrievalServer(WARMUP.index, args.workers).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,52 @@
+# app/text_store.py
+from __future__ import annotations
+import os, mmap
+from typing import List, Optional, Tuple
+
+
+class TextStore:
+    """
+    Chunk texts as one UTF-8 blob (`texts.bin`); each chunk is addressed by the
+    (offset, length) byte pair kept in its metadata, so reading a chunk is an O(1)
+    slice of a shared memory map instead of a re-parse of the source document.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = None
+        self._mm: Optional[mmap.mmap] = None
+
+    @staticmethod
+    def write(path: str, texts: List[str]) -> List[Tuple[int, int]]:
+        """Write `texts` to `path` and return their (offset, length) byte spans."""
+        spans: List[Tuple[int, int]] = []
+        offset = 0
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            for t in texts:
+                b = t.encode("utf-8")
+                f.write(b)
+                spans.append((offset, len(b)))
+                offset += len(b)
+        os.replace(tmp, path)
+        return spans
+
+    def open(self) -> "TextStore":
+        self.close()
+        self._f = open(self.path, "rb")
+        if os.fstat(self._f.fileno()).st_size:
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self
+
+    def get(self, offset: int, length: int) -> str:
+        if self._mm is None:
+            return ""
+        return self._mm[offset : offset + length].decode("utf-8", errors="replace")
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._f is not None:
+            self._f.close()
+            self._f = None
@@ -1,9 +1,13 @@
 # app/utils.py
 from __future__ import annotations
-import os, re, json, math, glob
-from typing import List
+import os, re, json, math, glob, hashlib, logging
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from typing import List, Tuple
 
 
+log = logging.getLogger(__name__)
+
 # Try importing tiktoken, fallback to None if not installed
 try:
     import tiktoken
@@ -27,15 +31,90 @@ def split_into_paragraphs(text: str) -> List[str]:
     return [normalise_ws(p) for p in paras if normalise_ws(p)]
 
 
+@lru_cache(maxsize=None)
+def get_encoder(model: str = "cl100k_base"):
+    """
+    Cached tiktoken encoding. None if tiktoken is not installed, or the encoding is not
+    cached locally and cannot be downloaded (e.g. offline); callers then use the
+    ~4-chars-per-token heuristic.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(model)
+    except Exception as e:
+        log.warning("tiktoken encoding %s unavailable (%s); using the approximate token counter", model, e)
+        return None
+
+
 def count_tokens(s: str, model: str = "cl100k_base") -> int:
     """Count tokens using tiktoken if available, else fallback heuristic."""
-    if tiktoken is None:
+    enc = get_encoder(model)
+    if enc is None:
         # crude fallback: ~4 chars per token
         return max(1, math.ceil(len(s) / 4))
-    enc = tiktoken.get_encoding(model)
     return len(enc.encode(s))
 
 
+# Fallback "tokens" without tiktoken: runs of up to 4 non-space chars (~4 chars per token)
+_FALLBACK_TOKEN_RE = re.compile(r"\S{1,4}\s*|\s+")
+
+
+def token_offsets(text: str, model: str = "cl100k_base") -> List[int]:
+    """Start character offset of every token in `text`, from a single encode."""
+    enc = get_encoder(model)
+    if enc is None:
+        return [m.start() for m in _FALLBACK_TOKEN_RE.finditer(text)]
+    _, offsets = enc.decode_with_offsets(enc.encode_ordinary(text))
+    return offsets
+
+
+def chunk_spans(
+    text: str,
+    max_tokens: int = 900,
+    overlap_tokens: int = 180,
+    paragraph_aware: bool = True,
+    model: str = "cl100k_base",
+) -> List[Tuple[int, int]]:
+    """
+    Token-exact chunking: encode `text` once and cut windows of at most `max_tokens`
+    tokens, consecutive windows sharing exactly `overlap_tokens` tokens. Returns
+    (char_start, char_end) spans into `text`. With `paragraph_aware`, a window ends at
+    the last paragraph break in its second half, so chunks keep whole paragraphs.
+    """
+    offs = token_offsets(text, model)
+    n = len(offs)
+    if n == 0:
+        return []
+    overlap = max(0, min(overlap_tokens, max_tokens - 1))
+    breaks: List[int] = []
+    if paragraph_aware:
+        # token index of the first token of each paragraph
+        breaks = sorted({bisect_left(offs, m.end()) for m in re.finditer(r"\n\s*\n", text)})
+
+    spans: List[Tuple[int, int]] = []
+    start = 0
+    while True:
+        end = min(start + max_tokens, n)
+        if end < n and breaks:
+            j = bisect_right(breaks, end) - 1
+            if j >= 0 and breaks[j] > start + max(overlap, max_tokens // 2):
+                end = breaks[j]
+        c0 = offs[start]
+        c1 = offs[end] if end < n else len(text)
+        # trim surrounding whitespace so spans line up with the visible text
+        while c0 < c1 and text[c0].isspace():
+            c0 += 1
+        while c1 > c0 and text[c1 - 1].isspace():
+            c1 -= 1
+        if c1 > c0:
+            spans.append((c0, c1))
+        if end >= n:
+            break
+        start = end - overlap
+    return spans
+
+
 def chunk_text(text: str, max_tokens: int = 900, overlap_tokens: int = 180) -> List[str]:
     """
     Chunk text into overlapping segments by token count.
@@ -87,6 +166,28 @@ def chunk_text(text: str, max_tokens: int = 900, overlap_tokens: int = 180) -> L
     return chunks
 
 
+def join_pages(pages: List[str]) -> Tuple[str, List[int]]:
+    """
+    Clean and join pages into one document (paragraphs separated by blank lines).
+    Returns the text and the character offset at which each page starts, so the
+    1-based page of offset c is bisect_right(page_starts, c).
+    """
+    parts: List[str] = []
+    page_starts: List[int] = []
+    pos = 0
+    for page in pages:
+        sep = "\n\n" if parts else ""
+        # empty pages share the next page's start; bisect_right then picks the later one
+        page_starts.append(pos + len(sep))
+        paras = split_into_paragraphs(page)
+        if not paras:
+            continue
+        body = sep + "\n\n".join(paras)
+        parts.append(body)
+        pos += len(body)
+    return "".join(parts), page_starts
+
+
 def load_text_from_path(path: str) -> str:
     """Load text from PDF, Markdown or TXT."""
     from pypdf import PdfReader
@@ -117,6 +218,15 @@ def glob_docs(root: str = "data/raw") -> List[str]:
     return sorted(paths)
 
 
-def ensure_dirs():
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """Hex SHA-256 of a file's bytes, read in blocks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def ensure_dirs(index_dir: str = "data/index"):
     """Ensure index directory exists."""
-    os.makedirs("data/index", exist_ok=True)
+    os.makedirs(index_dir, exist_ok=True)
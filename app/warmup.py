@@ -0,0 +1,167 @@
+# app/warmup.py
+"""
+Background warm-up of the retrieval stack, so pages render before any ML library loads.
+
+The app calls WARMUP.start() after its first paint; a daemon thread then imports faiss
+and sentence-transformers (torch), loads the index and embedder, runs one encode, and
+optionally loads the reranker. `WARMUP.index()` blocks only if a question arrives
+before that finishes. Afterwards it checks every INDEX_CHECK_S whether a new build
+was published and, if so, loads it in the background and swaps it in; queries
+already running finish on the build they started with. Every stage is timed for
+the startup report:
+
+    python -m app.warmup          # cold-start breakdown in a fresh process
+"""
+from __future__ import annotations
+import os, sys, time, logging, argparse, threading
+from typing import Any, Dict, Optional
+
+log = logging.getLogger(__name__)
+
+INDEX_CHECK_S = float(os.environ.get("INDEX_CHECK_S", 5))  # how often to look for a newly published build
+
+
+def _timed(timings: Dict[str, float], stage: str):
+    class _T:
+        def __enter__(self):
+            self.t0 = time.perf_counter()
+
+        def __exit__(self, *exc):
+            timings[stage] = time.perf_counter() - self.t0
+
+    return _T()
+
+
+class Warmup:
+    """Loads one RAGIndex (and its models) in a background thread, once per process."""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self.state = "idle"  # idle -> running -> ready | error
+        self.error: Optional[str] = None
+        self._idx = None
+        self._rerank = False
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._next_check = 0.0
+        self._swapping = False
+
+    def record(self, stage: str, seconds: float) -> None:
+        """Record a stage measured elsewhere (e.g. the app's own imports); first value wins."""
+        self.timings.setdefault(stage, seconds)
+
+    def start(self, rerank: bool = False) -> "Warmup":
+        """Start the warm-up; `rerank` asked for after the index loaded starts a reranker-only load."""
+        late = None
+        with self._lock:
+            if rerank and not self._rerank and self._idx is not None:
+                late = self._idx  # _run has already decided whether to load the reranker
+            self._rerank = self._rerank or rerank
+            if self.state in ("idle", "error"):
+                self.state, self.error = "running", None
+                self._done.clear()
+                threading.Thread(target=self._run, name="rag-warmup", daemon=True).start()
+        if late is not None:
+            threading.Thread(target=self._warm_reranker, args=(late,), name="reranker-warmup", daemon=True).start()
+        return self
+
+    def _warm_reranker(self, idx) -> None:
+        with _timed(self.timings, "load reranker"):
+            idx.reranker.warm_up(wait=True)
+
+    def _run(self) -> None:
+        t = self.timings
+        t0 = time.perf_counter()
+        try:
+            with _timed(t, "import faiss"):
+                import faiss  # noqa: F401
+            with _timed(t, "import sentence_transformers (torch)"):
+                import sentence_transformers  # noqa: F401
+            with _timed(t, "import app.rag"):
+                from app.rag import RAGIndex
+            idx = RAGIndex()
+            with _timed(t, "load index"):
+                idx.load()
+            with _timed(t, "load embedder"):
+                idx.embedder
+            with _timed(t, "first encode"):
+                idx.embed_query("warm up")
+            with self._lock:  # start(rerank=True) from here on warms the reranker itself
+                self._idx = idx
+                rerank = self._rerank
+            if rerank:
+                self._warm_reranker(idx)
+            t["warm-up total"] = time.perf_counter() - t0
+            self.state = "ready"
+        except Exception as e:
+            log.warning("Warm-up failed: %s", e)
+            self.error = f"{type(e).__name__}: {e}"
+            self.state = "error"
+        finally:
+            self._done.set()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def index(self, timeout: Optional[float] = None):
+        """The loaded RAGIndex, starting the warm-up if needed and waiting for it."""
+        self.start()
+        if not self._done.wait(timeout):
+            raise TimeoutError("Retrieval index is still loading")
+        if self._idx is None:
+            raise RuntimeError(self.error or "Warm-up failed")
+        self._maybe_swap()
+        return self._idx
+
+    def _maybe_swap(self) -> None:
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + INDEX_CHECK_S
+        idx = self._idx
+        if not idx.stale():
+            return
+        with self._lock:
+            if self._swapping:
+                return
+            self._swapping = True
+        threading.Thread(target=self._swap, args=(idx,), name="index-swap", daemon=True).start()
+
+    def _swap(self, old) -> None:
+        t0 = time.perf_counter()
+        try:
+            new = old.reload()
+            self._idx = new  # one reference assignment: each query sees the old or the new build
+            self.timings["last index swap"] = time.perf_counter() - t0
+            log.info("Index %s replaced by %s", old.version, new.version)
+        except Exception as e:
+            log.warning("Loading new index build failed; keeping %s: %s", old.version, e)
+        finally:
+            self._swapping = False
+
+    def report(self) -> Dict[str, Any]:
+        return {"state": self.state, "error": self.error, "seconds": dict(self.timings)}
+
+
+WARMUP = Warmup()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Time a cold start of the app's modules and models.")
+    ap.add_argument("--rerank", action="store_true", help="also load the cross-encoder")
+    args = ap.parse_args()
+
+    for mod in ("app.data_store", "app.llm"):
+        with _timed(WARMUP.timings, f"import {mod}"):
+            try:
+                __import__(mod)
+            except ImportError as e:
+                print(f"{mod}: {e}", file=sys.stderr)
+    WARMUP.start(rerank=args.rerank)
+    try:
+        WARMUP.index()
+    except Exception as e:
+        print(f"Warm-up failed: {e}", file=sys.stderr)
+    for stage, s in WARMUP.timings.items():
+        print(f"{stage:40} {s * 1000:9.1f} ms")
@@ -0,0 +1,126 @@
+"""
+Minimal OpenAI-compatible chat completions server for local testing (no network, no key).
+Usage:
+    python scripts/openai_stub.py --port 8787 --ttft-ms 400 --token-ms 30
+    OPENAI_BASE_URL=http://127.0.0.1:8787/v1 OPENAI_API_KEY=stub python -m app.llm
+    OPENAI_BASE_URL=http://127.0.0.1:8787/v1 OPENAI_API_KEY=stub streamlit run app/main.py
+
+Answers with a canned reply (or --reply) that echoes the question. Supports
+"stream": true (server-sent events) and plain JSON responses.
+"""
+
+import json
+import time
+import uuid
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = (
+    "- **Open** the dust cap and mouthpiece [1].\n"
+    "- **Insert** one capsule; close until it clicks [1].\n"
+    "- **Pierce** the capsule by pressing the button once [1].\n"
+    "- **Exhale** away, then inhale deeply and hold [1].\n"
+    "⚠️ Do not swallow capsules. (stub answer to: {question})"
+)
+
+
+def make_handler(reply: str, ttft_ms: float, token_ms: float, fail_every: int = 0):
+    calls = {"n": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _json(self, status: int, body: dict) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True  # client gave up (e.g. its timeout fired)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            req = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                return self._json(404, {"error": {"message": f"unknown path {self.path}"}})
+            calls["n"] += 1
+            if fail_every and calls["n"] % fail_every == 0:
+                return self._json(503, {"error": {"message": "stub overload", "type": "server_error"}})
+
+            question = next((m["content"] for m in reversed(req.get("messages", [])) if m["role"] == "user"), "")
+            text = reply.format(question=question.splitlines()[0][:80] if question else "")
+            tokens = [w + " " for w in text.split(" ")]
+            model = req.get("model", "stub")
+            cid = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+            usage = {
+                "prompt_tokens": sum(len(m["content"].split()) for m in req.get("messages", [])),
+                "completion_tokens": len(tokens),
+            }
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            time.sleep(ttft_ms / 1000)
+
+            if not req.get("stream"):
+                time.sleep(token_ms * len(tokens) / 1000)
+                return self._json(200, {
+                    "id": cid, "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def send(obj) -> None:
+                data = (obj if isinstance(obj, str) else "data: " + json.dumps(obj)) + "\n\n"
+                raw = data.encode("utf-8")
+                self.wfile.write(f"{len(raw):x}\r\n".encode() + raw + b"\r\n")
+                self.wfile.flush()
+
+            base = {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+            try:
+                send({**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]})
+                for i, tok in enumerate(tokens):
+                    if i:
+                        time.sleep(token_ms / 1000)
+                    send({**base, "choices": [{"index": 0, "delta": {"content": tok}, "finish_reason": None}]})
+                send({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+                if (req.get("stream_options") or {}).get("include_usage"):
+                    send({**base, "choices": [], "usage": usage})
+                send("data: [DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True  # client stopped reading
+
+    return Handler
+
+
+def main():
+    ap = argparse.ArgumentParser(description="OpenAI-compatible stub server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8787)
+    ap.add_argument("--ttft-ms", type=float, default=300, help="delay before the first token")
+    ap.add_argument("--token-ms", type=float, default=25, help="delay between streamed tokens")
+    ap.add_argument("--fail-every", type=int, default=0, help="answer every Nth request with 503")
+    ap.add_argument("--reply", default=DEFAULT_REPLY)
+    args = ap.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.reply, args.ttft_ms, args.token_ms, args.fail_every))
+    print(f"OpenAI stub listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
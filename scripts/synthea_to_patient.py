@@ -1,111 +1,412 @@
 """
-Convert a Synthea patient JSON into our app's patient.json format.
+Convert Synthea FHIR output into our app's patient profile format.
 Usage:
     python scripts/synthea_to_patient.py path/to/synthea_patient.json
+    python scripts/synthea_to_patient.py output/fhir/ --out-dir data/patients --workers 8
+    python scripts/synthea_to_patient.py output/fhir/ --store data/profiles.db
+    python scripts/synthea_to_patient.py bulk/*.ndjson --store data/profiles.db
+
+One bundle file writes data/patient.json (or --out). Directories and several files are
+converted in a process pool into a sharded directory (--out-dir, <id[:2]>/<id>.json)
+or the multi-patient store (--store). NDJSON input may hold one Bundle per line, or
+individual resources (FHIR bulk export), which are grouped by patient reference.
+Bundles are parsed incrementally, one entry at a time, so large files never sit in
+memory as a single JSON document.
 """
 
 import json
 import sys
 import os
+import re
+import time
+import hashlib
+import argparse
 from pathlib import Path
+from collections import deque
 from datetime import date
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 OUT_PATH = Path("data/patient.json")
 
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
 
-def convert_synthea_to_patient(synthea_json: dict) -> dict:
-    patient = synthea_json["entry"][0]["resource"]  # main Patient resource
-    demographics = {
-        "full_name": f"{patient['name'][0]['given'][0]} {patient['name'][0]['family']}",
-        "dob": patient.get("birthDate", ""),
-        "blood_type": patient.get("extension", [{}])[0].get("valueCode", ""),  # optional
+
+# ---------- Conversion (single pass over resources) ----------
+def _patient(p: dict, out: dict) -> None:
+    if out["profile"] is not None:
+        return  # first Patient resource wins
+    out["patient_id"] = p.get("id", "synthea-demo")
+    out["profile"] = {
+        "full_name": f"{p['name'][0]['given'][0]} {p['name'][0]['family']}",
+        "dob": p.get("birthDate", ""),
+        "blood_type": p.get("extension", [{}])[0].get("valueCode", ""),  # optional
         "medical_aid": {
             "provider": "SyntheticHealth",  # not in Synthea
             "plan": "DemoPlan",
-            "member_no": patient.get("id", ""),
+            "member_no": p.get("id", ""),
             "emergency_hotline": ""
         }
     }
 
-    # Conditions
-    conditions = []
-    for e in synthea_json["entry"]:
-        if e["resource"]["resourceType"] == "Condition":
-            c = e["resource"]
-            conditions.append({
-                "name": c.get("code", {}).get("text", ""),
-                "severity": c.get("severity", {}).get("text", ""),
-                "notes": c.get("clinicalStatus", {}).get("text", "")
-            })
-
-    # Allergies
-    allergies = []
-    for e in synthea_json["entry"]:
-        if e["resource"]["resourceType"] == "AllergyIntolerance":
-            a = e["resource"]
-            allergies.append({
-                "substance": a.get("code", {}).get("text", ""),
-                "reaction": ", ".join(
-                    [r["description"] for r in a.get("reaction", []) if "description" in r]
-                ),
-                "severity": a.get("criticality", "")
-            })
-
-    # Medications
-    medications = []
-    for e in synthea_json["entry"]:
-        if e["resource"]["resourceType"] == "MedicationRequest":
-            m = e["resource"]
-            med = {
-                "name": m.get("medicationCodeableConcept", {}).get("text", ""),
-                "device": {"type": "Medication", "model": ""},
-                "dosage": "",
-                "storage_location": "Unknown",
-                "how_to_use_steps": [],
-                "warnings": [],
-                "leaflets": [],
-                "last_updated": str(date.today())
-            }
-            if "dosageInstruction" in m:
-                med["dosage"] = "; ".join(
-                    [d.get("text", "") for d in m["dosageInstruction"] if "text" in d]
-                )
-            medications.append(med)
-
-    profile = {
-        "patient_id": patient.get("id", "synthea-demo"),
-        "profile": demographics,
+
+def _condition(c: dict, out: dict) -> None:
+    out["conditions"].append({
+        "name": c.get("code", {}).get("text", ""),
+        "severity": c.get("severity", {}).get("text", ""),
+        "notes": c.get("clinicalStatus", {}).get("text", "")
+    })
+
+
+def _allergy(a: dict, out: dict) -> None:
+    out["allergies"].append({
+        "substance": a.get("code", {}).get("text", ""),
+        "reaction": ", ".join(
+            [r["description"] for r in a.get("reaction", []) if "description" in r]
+        ),
+        "severity": a.get("criticality", "")
+    })
+
+
+def _medication(m: dict, out: dict) -> None:
+    med = {
+        "name": m.get("medicationCodeableConcept", {}).get("text", ""),
+        "device": {"type": "Medication", "model": ""},
+        "dosage": "",
+        "storage_location": "Unknown",
+        "how_to_use_steps": [],
+        "warnings": [],
+        "leaflets": [],
+        "last_updated": out["today"]
+    }
+    if "dosageInstruction" in m:
+        med["dosage"] = "; ".join(
+            [d.get("text", "") for d in m["dosageInstruction"] if "text" in d]
+        )
+    out["medications"].append(med)
+
+
+HANDLERS: Dict[str, Callable[[dict, dict], None]] = {
+    "Patient": _patient,
+    "Condition": _condition,
+    "AllergyIntolerance": _allergy,
+    "MedicationRequest": _medication,
+}
+
+
+def convert_resources(resources: Iterable[dict]) -> dict:
+    """Build one profile from a patient's resources, dispatching each resource once."""
+    today = str(date.today())
+    out: Dict[str, Any] = {"profile": None, "conditions": [], "allergies": [], "medications": [], "today": today}
+    for r in resources:
+        handler = HANDLERS.get(r.get("resourceType"))
+        if handler is not None:
+            handler(r, out)
+    if out["profile"] is None:
+        raise ValueError("No Patient resource")
+    return {
+        "patient_id": out["patient_id"],
+        "profile": out["profile"],
         "emergency_contacts": [],  # Synthea doesn’t include family contacts
-        "conditions": conditions,
-        "allergies": allergies,
-        "medications": medications,
+        "conditions": out["conditions"],
+        "allergies": out["allergies"],
+        "medications": out["medications"],
         "preferences": {"preferred_hospital": "", "gp": ""},
-        "meta": {"last_reviewed": str(date.today())}
+        "meta": {"last_reviewed": today}
     }
 
-    return profile
 
+def convert_synthea_to_patient(synthea_json: dict) -> dict:
+    return convert_resources(e["resource"] for e in synthea_json["entry"])
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python scripts/synthea_to_patient.py path/to/synthea_patient.json")
-        sys.exit(1)
 
-    in_path = Path(sys.argv[1])
-    if not in_path.exists():
-        print(f"File not found: {in_path}")
-        sys.exit(1)
+# ---------- Streaming bundle parser ----------
+_WS = re.compile(r"[ \t\n\r]*")
+
+
+class _Stream:
+    """Incremental JSON reader over a text file: decodes one value at a time with raw_decode."""
+
+    def __init__(self, f, chunk_size: int = 1 << 20):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.dec = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        data = self.f.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data  # drop what has been consumed
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            self.pos = _WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, ch: str) -> None:
+        got = self.peek()
+        if got != ch:
+            raise ValueError(f"Expected {ch!r}, got {got!r}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                obj, end = self.dec.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue  # a number may continue in the next chunk
+            self.pos = end
+            return obj
+
+
+def iter_bundle_resources(path: str) -> Iterator[dict]:
+    """Resources of a Bundle file, yielded one `entry` at a time without loading the file."""
+    with open(path, "r", encoding="utf-8") as f:
+        s = _Stream(f)
+        s.expect("{")
+        while s.peek() != "}":
+            key = s.value()
+            s.expect(":")
+            if key != "entry":
+                s.value()  # small top-level fields (resourceType, type, meta)
+            else:
+                s.expect("[")
+                while s.peek() != "]":
+                    entry = s.value()
+                    if isinstance(entry, dict) and "resource" in entry:
+                        yield entry["resource"]
+                    if s.peek() == ",":
+                        s.pos += 1
+                s.pos += 1
+            if s.peek() == ",":
+                s.pos += 1
+
 
-    with open(in_path, "r", encoding="utf-8") as f:
-        synthea_data = json.load(f)
+# ---------- NDJSON ----------
+_RTYPE = re.compile(r'"resourceType"\s*:\s*"(\w+)"')
+_REF = re.compile(r"^(?:urn:uuid:|Patient/)")
 
-    profile = convert_synthea_to_patient(synthea_data)
 
-    os.makedirs(OUT_PATH.parent, exist_ok=True)
-    with open(OUT_PATH, "w", encoding="utf-8") as f:
-        json.dump(profile, f, indent=2, ensure_ascii=False)
+def _patient_ref(r: dict) -> Optional[str]:
+    if r.get("resourceType") == "Patient":
+        return r.get("id")
+    ref = (r.get("subject") or r.get("patient") or {}).get("reference", "")
+    return _REF.sub("", ref) or None
+
+
+def _ndjson_tasks(path: str, groups: Dict[str, List[dict]], batch: int) -> Iterator[Tuple[str, Any]]:
+    """Tasks for Bundle lines; loose resources are collected into `groups` by patient."""
+    lines: List[str] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            # resourceType is normally the first key; only scan the whole line if it is not
+            m = _RTYPE.search(line, 0, 200) or _RTYPE.search(line)
+            if m is None:
+                continue
+            rtype = m.group(1)
+            if rtype == "Bundle":
+                lines.append(line)
+                if len(lines) >= batch:
+                    yield ("lines", (path, lines))
+                    lines = []
+            elif rtype in HANDLERS:  # skip Observations, Encounters, ... without parsing them
+                r = json.loads(line)
+                pid = _patient_ref(r)
+                if pid:
+                    groups.setdefault(pid, []).append(r)
+    if lines:
+        yield ("lines", (path, lines))
+
+
+# ---------- Workers ----------
+Result = Tuple[Optional[dict], Optional[str], str]  # (profile, error, label)
+
+
+def _run_task(task: Tuple[str, Any]) -> List[Result]:
+    kind, arg = task
+    if kind == "file":
+        try:
+            return [(convert_resources(iter_bundle_resources(arg)), None, arg)]
+        except Exception as e:
+            return [(None, f"{type(e).__name__}: {e}", arg)]
+    out: List[Result] = []
+    if kind == "lines":
+        path, lines = arg
+        for line in lines:
+            try:
+                out.append((convert_synthea_to_patient(json.loads(line)), None, path))
+            except Exception as e:
+                out.append((None, f"{type(e).__name__}: {e}", path))
+    else:  # "group": resources of one or more patients
+        for pid, resources in arg:
+            try:
+                out.append((convert_resources(resources), None, f"patient {pid}"))
+            except Exception as e:
+                out.append((None, f"{type(e).__name__}: {e}", f"patient {pid}"))
+    return out
+
+
+def _expand(inputs: List[str]) -> List[str]:
+    files: List[str] = []
+    for p in inputs:
+        if os.path.isdir(p):
+            for ext in ("*.json", "*.ndjson", "*.jsonl"):
+                files.extend(str(x) for x in sorted(Path(p).rglob(ext)))
+        else:
+            files.append(p)
+    return files
+
+
+def _tasks(files: List[str], batch: int) -> Iterator[Tuple[str, Any]]:
+    groups: Dict[str, List[dict]] = {}
+    for fp in files:
+        if fp.endswith((".ndjson", ".jsonl")):
+            yield from _ndjson_tasks(fp, groups, batch)
+        else:
+            yield ("file", fp)
+    items = list(groups.items())
+    for i in range(0, len(items), batch):
+        yield ("group", items[i : i + batch])
+
+
+class _Sink:
+    """Writes converted profiles to a sharded directory or the profile store."""
+
+    def __init__(self, out_dir: str = "", store_path: str = "", batch: int = 1000):
+        self.out_dir = out_dir
+        self.store = None
+        self.pending: List[dict] = []
+        self.batch = batch
+        self.written = 0
+        if store_path:
+            from app.profile_store import ProfileStore
+            self.store = ProfileStore(store_path)
+
+    def add(self, profile: dict) -> None:
+        if self.store is not None:
+            self.pending.append(profile)
+            if len(self.pending) >= self.batch:
+                self.flush()
+            return
+        pid = str(profile["patient_id"])
+        shard = os.path.join(self.out_dir, hashlib.sha1(pid.encode("utf-8")).hexdigest()[:2])
+        os.makedirs(shard, exist_ok=True)
+        with open(os.path.join(shard, f"{pid}.json"), "w", encoding="utf-8") as f:
+            json.dump(profile, f, ensure_ascii=False)
+        self.written += 1
+
+    def flush(self) -> None:
+        if self.store is not None and self.pending:
+            self.written += self.store.put_many(self.pending, batch_size=self.batch)
+            self.pending = []
+
+
+def convert_batch(
+    inputs: List[str], out_dir: str = "", store_path: str = "", workers: int = 0, batch: int = 64
+) -> Dict[str, Any]:
+    """Convert every bundle/NDJSON file under `inputs`; returns a throughput/error report."""
+    files = _expand(inputs)
+    sink = _Sink(out_dir=out_dir, store_path=store_path)
+    workers = workers or os.cpu_count() or 1
+    t0 = time.perf_counter()
+    ok = 0
+    errors: List[Tuple[str, str]] = []
+
+    def consume(results: List[Result]) -> None:
+        nonlocal ok
+        for profile, err, label in results:
+            if err is None:
+                sink.add(profile)
+                ok += 1
+            else:
+                errors.append((label, err))
+        done = ok + len(errors)
+        if done and done % 1000 < len(results):
+            print(f"  {done} patients, {done / (time.perf_counter() - t0):.0f}/s", file=sys.stderr)
+
+    if workers <= 1:
+        for task in _tasks(files, batch):
+            consume(_run_task(task))
+    else:
+        # bounded window of in-flight tasks: Executor.map would queue every task up front
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            window: deque = deque()
+            for task in _tasks(files, batch):
+                window.append(pool.submit(_run_task, task))
+                if len(window) >= workers * 4:
+                    consume(window.popleft().result())
+            while window:
+                consume(window.popleft().result())
+    sink.flush()
+    dt = time.perf_counter() - t0
+    return {
+        "files": len(files),
+        "converted": ok,
+        "written": sink.written,
+        "failed": len(errors),
+        "errors": errors,
+        "seconds": dt,
+        "patients_per_s": (ok + len(errors)) / dt if dt else 0.0,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert Synthea FHIR bundles into patient profiles.")
+    ap.add_argument("inputs", nargs="+", help="bundle .json files, .ndjson exports, or directories")
+    ap.add_argument("--out", default=str(OUT_PATH), help="output file for a single bundle")
+    ap.add_argument("--out-dir", default="", help="sharded output directory for many patients")
+    ap.add_argument("--store", default="", help="SQLite profile store to upsert into")
+    ap.add_argument("--workers", type=int, default=0, help="processes (0 = one per CPU)")
+    ap.add_argument("--batch", type=int, default=64, help="NDJSON bundles/patients per task")
+    args = ap.parse_args()
+
+    missing = [p for p in args.inputs if not os.path.exists(p)]
+    if missing:
+        print(f"File not found: {', '.join(missing)}")
+        sys.exit(1)
+
+    single = len(args.inputs) == 1 and os.path.isfile(args.inputs[0]) and args.inputs[0].endswith(".json")
+    if single and not (args.out_dir or args.store):
+        profile = convert_resources(iter_bundle_resources(args.inputs[0]))
+        out = Path(args.out)
+        os.makedirs(out.parent, exist_ok=True)
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(profile, f, indent=2, ensure_ascii=False)
+        print(f"✅ Converted Synthea record saved to {out}")
+        return
 
-    print(f"✅ Converted Synthea record saved to {OUT_PATH}")
+    if not (args.out_dir or args.store):
+        ap.error("batch conversion needs --out-dir or --store")
+    rep = convert_batch(args.inputs, out_dir=args.out_dir, store_path=args.store, workers=args.workers, batch=args.batch)
+    print(
+        f"✅ {rep['converted']} patients from {rep['files']} files in {rep['seconds']:.1f}s "
+        f"({rep['patients_per_s']:.0f}/s); written {rep['written']} to {args.store or args.out_dir}"
+    )
+    if rep["failed"]:
+        print(f"⚠️ {rep['failed']} failed:")
+        for label, err in rep["errors"][:20]:
+            print(f"  {label}: {err}")
+        if rep["failed"] > 20:
+            print(f"  … and {rep['failed'] - 20} more")
+        sys.exit(2)
 
 
 if __name__ == "__main__":